@@ -1,7 +1,6 @@
 import os
 import html
 import json
-import base64
 import time
 import random
 import requests
@@ -12,6 +11,14 @@ from dotenv import load_dotenv
 import utils.settings
 import utils.retrospect
 import utils.lorebook
+import utils.image_pipeline
+import utils.ui_state
+import utils.tracing
+import utils.prompt_budget
+import utils.rag_speculation
+import utils.rag_namespaces
+import utils.rag_summaries
+from requests.adapters import HTTPAdapter
 from utils.emotion_recognizer import recognize_emotion_from_text
 from utils.logging import track_response_time
 import logging 
@@ -38,14 +45,22 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# Keep-alive pool for the vision backend, so each image does not pay for a new connection
+vision_session = requests.Session()
+vision_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
 max_context = int(os.environ.get("TOKEN_LIMIT"))
 marker_length = int(os.environ.get("MESSAGE_PAIR_LIMIT"))
 
 force_token_count = False
 forced_token_level = 120
 
+# Token counts of the last budgeted prompt
+last_prompt_report = {}
+
 stored_received_message = "None!"
 currently_sending_message = ""
+currently_streaming_reply = ""
 
 VISUAL_CHARACTER_NAME = os.environ.get("VISUAL_CHARACTER_NAME")
 VISUAL_PRESET_NAME = os.environ.get("VISUAL_PRESET_NAME")
@@ -55,17 +70,20 @@ with open("Configurables/SoftReset.json", 'r') as openfile:
     soft_reset_message = json.load(openfile)
 
 
-def run(user_input, temp_level):
+@utils.tracing.traced("llm.run")
+def run(user_input, temp_level, on_partial=None):
     global received_message
     global ooga_history
     global forced_token_level
     global force_token_count
     global currently_sending_message
+    global currently_streaming_reply
 
     logging.info("Running with user input: %s and temp level: %d", user_input, temp_level)
 
     # Message that is currently being sent
     currently_sending_message = user_input
+    currently_streaming_reply = ""
 
     # Load the history from JSON, to clean up the quotation marks
 
@@ -134,11 +152,23 @@ def run(user_input, temp_level):
     }
 
     logging.info("Sending request to API: %s", request)
-    response = requests.post(URI, headers=headers, json=request, verify=False)
 
+    # Stream the reply if someone wants to see it as it is written
+    if on_partial is None and utils.settings.web_ui_stream_replies:
+        on_partial = show_partial_reply
+
+    with utils.tracing.span("llm.post", preset=preset, streamed=on_partial is not None):
+        if on_partial is None:
+            response = requests.post(URI, headers=headers, json=request, verify=False)
+            request_completed = response.status_code == 200
+            if request_completed:
+                response_content = response.json()['choices'][0]['message']['content']
+        else:
+            request_completed, response_content = stream_completion(request, on_partial)
 
-    if response.status_code == 200:
-        received_message = response.json()['choices'][0]['message']['content']
+
+    if request_completed:
+        received_message = response_content
 
         # Translate issues with the received message
         received_message = html.unescape(received_message)
@@ -152,7 +182,7 @@ def run(user_input, temp_level):
         global stored_received_message
 
         if received_message == stored_received_message:
-            run(user_input, 2)
+            run(user_input, 2, on_partial)
             return
 
         stored_received_message = received_message
@@ -160,12 +190,12 @@ def run(user_input, temp_level):
 
         # If her reply is the same as any in the past 20 chats, run another request
         if check_if_in_history(received_message):
-            run(user_input, 1)
+            run(user_input, 1, on_partial)
             return
 
         # If her reply is blank, request another run, clearing the previous history add, and escape
         if len(received_message) < 3:
-            run(user_input, 1)
+            run(user_input, 1, on_partial)
             return
 
 
@@ -181,6 +211,7 @@ def run(user_input, temp_level):
 
         # Clear the currently sending message variable
         currently_sending_message = ""
+        currently_streaming_reply = ""
 
         # Clear any token forcing
         force_token_count = False
@@ -188,24 +219,86 @@ def run(user_input, temp_level):
         # Save
         save_histories()
 
+        # Get a head start on the RAG and lore for whatever gets said next
+        utils.rag_speculation.prepare_next_turn(ooga_history)
+
+
+
+
+
+def show_partial_reply(text):
+    global currently_streaming_reply
+
+    # The web UI chat appends the new tokens as they arrive
+    currently_streaming_reply = text
+    utils.ui_state.notify("chat")
+
+
+def stream_completion(request, on_partial):
+
+    # Same request, but as server-sent events, handing the text so far to on_partial
+    stream_request = dict(request)
+    stream_request['stream'] = True
 
+    streamed_text = ""
+    try:
+        response = requests.post(URI, headers=headers, json=stream_request, verify=False, stream=True,
+                                 timeout=utils.settings.stream_reply_timeout)
+        if response.status_code != 200:
+            return False, ""
 
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
 
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
 
-def send_via_oogabooga(user_input):
+            # Skip anything that is not a chunk (keepalives, error events), rather than losing the reply
+            try:
+                delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                logging.warning(f"Skipping unreadable stream event: {data[:200]}")
+                continue
+
+            if delta:
+                streamed_text += delta
+                on_partial(streamed_text)
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Streamed reply failed: {e}")
+        return False, ""
+
+    return True, streamed_text
+
+
+def send_via_oogabooga(user_input, on_partial=None):
 
     user_input = user_input
 
+    # Not idle; background summaries wait until we are
+    utils.rag_summaries.note_activity()
+
     # Write last, non-system message to RAG
     # NOTE: On re-opening, it will still add the latest message. This is fine! We are just always in debt 1 depth (except from when recalced)
     # NOTE: Not safe for undo! Undo will double paste the message! We have a manual check to not add duplicates now, although, if it is supposed to be a dupe then get rekt XD
-    utils.based_rag.add_message_to_database()
+    with utils.tracing.span("rag.add_message"):
+        utils.based_rag.add_message_to_database()
 
     # RAG
     utils.based_rag.run_based_rag(user_input, ooga_history[len(ooga_history) - 1][1])
 
     # Run
-    run(user_input, 0)
+    last_pair = ooga_history[-1] if ooga_history else None
+    run(user_input, 0, on_partial)
+
+    # A failed request appends nothing (pruning may shorten the history even when one lands, so compare the tail)
+    if not ooga_history or ooga_history[-1] == last_pair:
+        return
+
+    # A namespaced chat files the pair under its own memories now; the shared ones pass it over
+    utils.rag_namespaces.record_reply(ooga_history[-1])
 
 @track_response_time
 def receive_via_oogabooga():
@@ -221,6 +314,9 @@ def next_message_oogabooga():
     cycle_message = ooga_history[-1][0]
     ooga_history.pop()
 
+    # Only matters straight after a RAG recalculation, when the old reply was already counted in
+    utils.based_rag.remove_rerolled_message()
+
     # Save
     save_histories()
 
@@ -240,6 +336,8 @@ def undo_message():
     # Save
     save_histories()
 
+    utils.rag_speculation.prepare_next_turn(ooga_history)
+
 
 
 def check_load_past_chat():
@@ -260,6 +358,7 @@ def check_load_past_chat():
         utils.based_rag.load_rag_history()
 
 
+@utils.tracing.traced("history.save")
 def save_histories():
 
     # Export to JSON
@@ -269,6 +368,9 @@ def save_histories():
     # Save RAG database too
     utils.based_rag.store_rag_history()
 
+    # Push the new history to the web UI
+    utils.ui_state.notify("chat")
+
 
 
 #
@@ -440,6 +542,34 @@ def summary_memory_run(messages_input, user_sent_message):
         save_histories()
 
 
+# Summarizes some history pairs for the RAG's summary tier, in the background. Leaves the chat history alone; None if it failed
+def summarize_pairs(pairs, instruction, max_tokens):
+
+    preset = 'Z-Waif-ADEF-Standard'
+
+    if utils.settings.model_preset != "Default":
+        preset = utils.settings.model_preset
+
+    request = {
+        "messages": encode_raw_new_api(pairs, instruction, len(pairs)),
+        'max_tokens': max_tokens,
+        'mode': 'chat',
+        'character': CHARACTER_CARD,
+        'truncation_length': max_context,
+        'stop': ["[System", "\nUser:", "---", "<|"],
+
+        'preset': preset
+    }
+
+    response = requests.post(URI, headers=headers, json=request, verify=False)
+
+    if response.status_code != 200:
+        return None
+
+    summary = html.unescape(response.json()['choices'][0]['message']['content']).strip()
+    return summary or None
+
+
 
 def swap_language_model(model_ID):
 
@@ -542,10 +672,13 @@ def view_image(direct_talk_transcript):
         base_prompt = direct_talk_transcript
 
 
-    with open('LiveImage.png', 'rb') as f:
-        img_str = base64.b64encode(f.read()).decode('utf-8')
-        prompt = f'{base_prompt}<img src="data:image/jpeg;base64,{img_str}">'
-        past_messages.append({"role": "user", "content": prompt})
+    img_str = utils.image_pipeline.get_latest_jpeg_b64()
+    if img_str is None:
+        print("No image has been captured to view!")
+        return "[System C] No image was available to view."
+
+    prompt = f'{base_prompt}<img src="data:image/jpeg;base64,{img_str}">'
+    past_messages.append({"role": "user", "content": prompt})
 
 
     # Stopping Strings (real important, early vicuna is godlike but also starts to get derailed.
@@ -558,7 +691,9 @@ def view_image(direct_talk_transcript):
     # Send it in for viewing!
 
     received_cam_message = ""
-    while len(received_cam_message) < 9:    # must not be a blank reply
+    attempts = 0
+    while len(received_cam_message) < 9 and attempts < utils.settings.cam_vision_retry_budget:    # must not be a blank reply
+        attempts += 1
 
         request = {
             'max_tokens': 300,
@@ -575,12 +710,20 @@ def view_image(direct_talk_transcript):
             'preset': VISUAL_PRESET_NAME
         }
 
-        response = requests.post(IMG_URI, json=request)
-        received_cam_message = response.json()['choices'][0]['message']['content']
+        try:
+            response = vision_session.post(IMG_URI, json=request, timeout=utils.settings.cam_vision_timeout)
+            received_cam_message = response.json()['choices'][0]['message']['content']
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            logging.error(f"Vision request attempt {attempts} failed: {e}")
+            continue
 
         # Translate issues with the received message
         received_cam_message = html.unescape(received_cam_message)
 
+    if len(received_cam_message) < 9:
+        logging.error(f"Vision model gave no usable description after {attempts} attempts")
+        received_cam_message = "I couldn't quite make out the image."
+
 
     # Add Header
     received_cam_message = "[System C] " + received_cam_message
@@ -649,8 +792,12 @@ def check_if_in_history(message):
 
 
 # Encodes from the old api's way of storing history (and ooba internal) to the new one
+@utils.tracing.traced("prompt.encode")
 def encode_new_api(user_input):
 
+    if utils.settings.prompt_budget_enabled:
+        return encode_budgeted_api(user_input)
+
     #
     # Append 40 of the most recent history pairs (however long our marker length is)
     #
@@ -703,6 +850,42 @@ def encode_new_api(user_input):
     return messages_to_send
 
 
+# Same as above, but fits a token budget instead of leaving the server to truncate the overflow
+def encode_budgeted_api(user_input):
+    global last_prompt_report
+
+    reply_tokens = forced_token_level if force_token_count else utils.settings.max_tokens
+    budget = max_context - reply_tokens - utils.settings.prompt_system_reserve_tokens
+    if utils.settings.prompt_token_budget:
+        budget = min(budget, utils.settings.prompt_token_budget)
+
+    lore_gathered = utils.lorebook.lorebook_gather(ooga_history[-3:], user_input)
+    if lore_gathered == utils.lorebook.total_lore_default:
+        lore_gathered = None
+
+    rag_message = utils.based_rag.call_rag_message() if utils.settings.rag_enabled else None
+
+    counter = utils.prompt_budget.get_token_counter()
+    if utils.settings.prompt_layout == "stable":
+        messages_to_send, last_prompt_report = utils.prompt_budget.build_stable_prompt(
+            ooga_history, user_input, budget, counter, marker_length,
+            utils.settings.prompt_history_block, lore_gathered, rag_message)
+    else:
+        messages_to_send, last_prompt_report = utils.prompt_budget.build_prompt(
+            ooga_history, user_input, budget, counter, marker_length, lore_gathered, rag_message)
+
+    # How much of this prompt the backend's cache could still hold from the last one
+    cache = utils.prompt_budget.prefix_cache
+    last_prompt_report['prefix_tokens'] = cache.observe(messages_to_send, counter)
+    last_prompt_report['prefix_hit_rate'] = round(cache.hit_rate(), 3)
+
+    span = utils.tracing.current_span()
+    if span is not None:
+        span.attrs.update(last_prompt_report)
+
+    return messages_to_send
+
+
 # encodes a given input to the new API, with no additives
 def encode_raw_new_api(user_messages_input, user_message_last, raw_marker_length):
     #
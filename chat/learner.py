@@ -2,29 +2,25 @@
 # Run the following command in your terminal:
 # pip install Flask
 
-import sqlite3
 import time
 from textblob import TextBlob  # For sentiment analysis
 import random  # For dynamic personality shaping
-from transformers import pipeline  # Import the transformers library
 from flask import Flask, request, jsonify
+from utils.sqlite_pipeline import get_sqlite_pipeline
+from utils.model_registry import EMOTION, infer
 
 class ChatLearner:
     def __init__(self, db_name='chat_learner.db'):
-        # Connect to the SQLite database (or create it if it doesn't exist)
-        self.connection = sqlite3.connect(db_name)
-        self.cursor = self.connection.cursor()
+        # Writes are batched by a single writer thread; reads use a per-thread connection
+        self.pipeline = get_sqlite_pipeline(db_name)
         
         # Create tables for messages, personality templates, emotional states, and user profiles
         self.create_tables()
         self.prune_old_messages()  # Clean up old messages on initialization
-        
-        # Initialize the emotion recognition model
-        self.emotion_recognizer = pipeline("text-classification", model="bhadresh-savani/bert-base-uncased-emotion")
 
     def create_tables(self):
-        """Create necessary tables in the database."""
-        self.cursor.execute('''
+        """Create necessary tables and indexes in the database."""
+        self.pipeline.executescript('''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 message TEXT NOT NULL,
@@ -32,35 +28,31 @@ class ChatLearner:
                 timestamp INTEGER NOT NULL,
                 user_id TEXT NOT NULL,
                 context TEXT
-            )
-        ''')
-        
-        self.cursor.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS personality_templates (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 name TEXT NOT NULL,
                 template TEXT NOT NULL
-            )
-        ''')
-        
-        self.cursor.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS emotional_states (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 message_id INTEGER NOT NULL,
                 emotion TEXT NOT NULL,
                 FOREIGN KEY (message_id) REFERENCES messages (id)
-            )
-        ''')
-        
-        self.cursor.execute('''
+            );
+
             CREATE TABLE IF NOT EXISTS user_profiles (
                 user_id TEXT PRIMARY KEY,
                 personality TEXT,
                 preferences TEXT
-            )
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_messages_user_time ON messages (user_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_messages_time ON messages (timestamp);
+            CREATE INDEX IF NOT EXISTS idx_emotional_states_message ON emotional_states (message_id);
         ''')
-        
-        self.connection.commit()
 
     def learn_from_message(self, message_data):
         """
@@ -77,20 +69,21 @@ class ChatLearner:
         timestamp = int(time.time())
 
         if message and sentiment is not None:
-            try:
-                self.cursor.execute('''
+            def store_message(cursor):
+                cursor.execute('''
                     INSERT INTO messages (message, sentiment, timestamp, user_id, context) VALUES (?, ?, ?, ?, ?)
                 ''', (message, sentiment, timestamp, user_id, context))
-                message_id = self.cursor.lastrowid
-                
+                message_id = cursor.lastrowid
+
                 if emotion:
-                    self.cursor.execute('''
+                    cursor.execute('''
                         INSERT INTO emotional_states (message_id, emotion) VALUES (?, ?)
                     ''', (message_id, emotion))
-                self.connection.commit()
-                print(f"Learned message: '{message}' with sentiment: {sentiment} and emotion: {emotion} from user: {user_id}")
-            except Exception as e:
-                print(f"Error learning message: {e}")
+
+            # Queued; committed with the rest of its batch
+            self.pipeline.submit(store_message).add_done_callback(
+                lambda future: print(f"Error learning message: {future.exception()}") if future.exception() else None
+            )
 
     def analyze_sentiment(self, message):
         """Analyze the sentiment of a given message."""
@@ -99,8 +92,8 @@ class ChatLearner:
 
     def recognize_emotion(self, message):
         """Recognize emotion from the message using a pre-trained model."""
-        # Use the emotion recognition model to predict the emotion
-        predictions = self.emotion_recognizer(message)
+        # Use the shared emotion recognition model to predict the emotion
+        predictions = infer(EMOTION, message)
         # Extract the emotion with the highest score
         emotion = max(predictions, key=lambda x: x['score'])
         return emotion['label']  # Return the predicted emotion label
@@ -129,38 +122,38 @@ class ChatLearner:
     def update_user_profile(self, user_id, personality=None, preferences=None):
         """Update the user profile with new personality or preferences."""
         try:
-            self.cursor.execute('''
+            self.pipeline.execute('''
                 INSERT INTO user_profiles (user_id, personality, preferences) VALUES (?, ?, ?)
                 ON CONFLICT(user_id) DO UPDATE SET personality = ?, preferences = ?
-            ''', (user_id, personality, preferences, personality, preferences))
-            self.connection.commit()
+            ''', (user_id, personality, preferences, personality, preferences)).result()
             print(f"User profile for {user_id} updated.")
         except Exception as e:
             print(f"Error updating user profile: {e}")
 
     def get_user_profile(self, user_id):
         """Retrieve a user profile by user ID."""
-        self.cursor.execute('SELECT personality, preferences FROM user_profiles WHERE user_id = ?', (user_id,))
-        return self.cursor.fetchone()
+        return self.pipeline.query_one('SELECT personality, preferences FROM user_profiles WHERE user_id = ?', (user_id,))
 
     def prune_old_messages(self):
         """Remove messages and emotional states older than 365 days."""
         one_year_ago = int(time.time()) - (365 * 24 * 60 * 60)
 
-        self.cursor.execute('''
-            DELETE FROM emotional_states
-            WHERE message_id IN (
-                SELECT id FROM messages WHERE timestamp < ?
-            )
-        ''', (one_year_ago,))
+        def prune(cursor):
+            cursor.execute('''
+                DELETE FROM emotional_states
+                WHERE message_id IN (
+                    SELECT id FROM messages WHERE timestamp < ?
+                )
+            ''', (one_year_ago,))
+
+            cursor.execute('DELETE FROM messages WHERE timestamp < ?', (one_year_ago,))
 
-        self.cursor.execute('DELETE FROM messages WHERE timestamp < ?', (one_year_ago,))
-        self.connection.commit()
+        self.pipeline.submit(prune).result()
         print("Pruned messages and emotional states older than 365 days.")
 
     def close(self):
-        """Close the database connection."""
-        self.connection.close()
+        """Write out anything still queued."""
+        self.pipeline.flush()
 
 # API Support Skeleton
 app = Flask(__name__)
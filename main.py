@@ -7,7 +7,7 @@ import emoji
 import utils.audio
 import utils.hotkeys
 import utils.transcriber_translate
-import win32com.client
+import utils.speech_output
 import utils.vtube_studio
 import utils.alarm
 import utils.volume_listener
@@ -22,10 +22,15 @@ import utils.camera
 
 import utils.z_waif_discord
 import utils.web_ui
+import utils.metrics_store
+import utils.tracing
 
 import utils.settings
 import utils.retrospect
 import utils.based_rag
+import utils.rag_speculation
+import utils.rag_namespaces
+import utils.rag_summaries
 
 from utils import settings
 from utils.z_waif_twitch import start_twitch_bot
@@ -87,8 +92,10 @@ async def main_twitch_chat(message_data):
         User [{message_data['author']}]: {message_data['content']}
         Assistant: """
 
-        # Send to Oogabooga and get response
-        API.Oogabooga_Api_Support.send_via_oogabooga(formatted_message)
+        # Send to Oogabooga and get response, remembered under this channel's (or viewer's) own memories
+        namespace = utils.rag_namespaces.namespace_for("twitch", message_data['channel'], message_data['author'])
+        with utils.rag_namespaces.audience(namespace):
+            API.Oogabooga_Api_Support.send_via_oogabooga(formatted_message)
         reply_message = API.Oogabooga_Api_Support.receive_via_oogabooga()
         
         # Clean response
@@ -152,13 +159,20 @@ def main():
 
 
 
+@utils.tracing.traced("mic_turn", new_trace=True)
 def main_converse():
+    # We are talking now, so she stops
+    utils.speech_output.interrupt()
+
     print(
         "\rYou" + colorama.Fore.GREEN + colorama.Style.BRIGHT + " (mic " + colorama.Fore.YELLOW + "[Recording]" + colorama.Fore.GREEN + ") " + colorama.Fore.RESET + ">",
         end="", flush=True)
 
     # Actual recording and waiting bit
-    audio_buffer = utils.audio.record()
+    with utils.tracing.span("audio.record"):
+        audio_buffer = utils.audio.record(on_partial=utils.rag_speculation.partial_audio_callback(),
+                                          partial_seconds=utils.settings.rag_speculation_partial_seconds)
+    utils.rag_speculation.get_speculator().cancel_partials()
 
 
     try:
@@ -170,7 +184,8 @@ def main_converse():
         # My own edit- To remove possible transcribing errors
         transcript = "Whoops! The code is having some issues, chill for a second."
 
-        transcript = utils.transcriber_translate.to_transcribe_original_language(audio_buffer)
+        with utils.tracing.span("transcribe"):
+            transcript = utils.transcriber_translate.to_transcribe_original_language(audio_buffer)
 
 
 
@@ -213,6 +228,7 @@ def main_converse():
         pass
 
 
+@utils.tracing.traced("speak.queue")
 def main_message_speak():
     #
     #   Message is received Here
@@ -227,15 +243,21 @@ def main_message_speak():
 
     s_message = emoji.replace_emoji(message, replace='')
 
+    # Queued to the speech pipeline, so the main loop is free while she talks
+    utils.speech_output.speak(s_message)
 
-    speaker = win32com.client.Dispatch("SAPI.SpVoice")
-    speaker.Speak(s_message)
 
+def report_speech_timing(sentence, duration):
 
-    # Reset the volume cooldown so she don't pickup on herself
-    utils.hotkeys.cooldown_listener_timer()
+    # Hold the volume cooldown for the sentence so she don't pickup on herself
+    utils.hotkeys.cooldown_listener_timer(duration)
+
+    # Let the model know how long she is talking for
+    if utils.settings.vtube_enabled:
+        utils.vtube_studio.set_speech_timing(sentence, duration)
 
 
+@utils.tracing.traced("message_checks")
 def message_checks(message):
 
     #
@@ -285,8 +307,11 @@ def main_rate():
 
 
 
+@utils.tracing.traced("next_turn", new_trace=True)
 def main_next():
 
+    utils.speech_output.interrupt()
+
     API.Oogabooga_Api_Support.next_message_oogabooga()
 
     # Run our message checks
@@ -296,6 +321,7 @@ def main_next():
     # Pipe us to the reply function
     main_message_speak()
 
+@utils.tracing.traced("minecraft_turn", new_trace=True)
 def main_minecraft_chat(message):
 
     # Limit the amount of tokens allowed to send (minecraft chat limits)
@@ -316,6 +342,7 @@ def main_minecraft_chat(message):
         main_message_speak()
 
 
+@utils.tracing.traced("discord_turn", new_trace=True)
 def main_discord_chat(message):
 
     # Actual sending of the message, waits for reply automatically
@@ -336,6 +363,7 @@ def main_discord_chat(message):
 
 
 
+@utils.tracing.traced("web_ui_turn", new_trace=True)
 def main_web_ui_chat(message):
 
     # Actual sending of the message, waits for reply automatically
@@ -353,6 +381,7 @@ def main_web_ui_chat(message):
     if utils.settings.speak_shadowchats:
         main_message_speak()
 
+@utils.tracing.traced("web_ui_next_turn", new_trace=True)
 def main_web_ui_next():
 
     API.Oogabooga_Api_Support.next_message_oogabooga()
@@ -387,6 +416,8 @@ def main_undo():
 
         undo_allowed = False
 
+        utils.speech_output.interrupt()
+
         API.Oogabooga_Api_Support.undo_message()
 
         print("\nUndoing the previous message!\n")
@@ -640,6 +671,13 @@ def run_program():
 
     utils.settings.eyes_follow = os.environ.get("EYES_FOLLOW")
 
+    speech_engine_string = os.environ.get("SPEECH_ENGINE")
+    if speech_engine_string:
+        utils.settings.speech_engine = speech_engine_string
+
+    # Start the speech output pipeline, it runs on its own threads
+    utils.speech_output.start_speech_output(utils.settings.speech_engine, on_sentence=report_speech_timing)
+
 
     # Run any needed log conversions
     utils.log_conversion.run_conversion()
@@ -699,6 +737,14 @@ def run_program():
     gradio_thread.daemon = True
     gradio_thread.start()
 
+    # Summarize older history for the RAG while nobody is talking
+    if utils.settings.rag_enabled and utils.settings.rag_summaries_enabled:
+        utils.rag_summaries.start_summarizer()
+
+    # Latency percentiles for scrapers, on its own small server thread
+    if utils.settings.metrics_export_port:
+        utils.metrics_store.serve_metrics(utils.settings.metrics_export_port)
+
     # Initialize Twitch if enabled
     if settings.TWITCH_ENABLED:
         twitch_thread = threading.Thread(target=start_twitch_bot, daemon=True)
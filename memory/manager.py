@@ -1,44 +1,32 @@
 from datetime import datetime
-import json
-import os
+from utils.memory_store import get_memory_store, SOURCE_MANAGER
 
 class MemoryManager:
     def __init__(self, memory_file="user_memories.json"):
         self.memory_file = memory_file
-        self.memories = self._load_memories()
-        
-    def _load_memories(self):
-        if os.path.exists(self.memory_file):
-            with open(self.memory_file, 'r') as f:
-                return json.load(f)
-        return {}
+
+        # Shared indexed store; old JSON files are migrated into it once
+        self.store = get_memory_store()
+        self.store.migrate_json_file(memory_file)
 
     def add_memory(self, user_id, context, platform, emotion=None, interaction_type=None):
-        if user_id not in self.memories:
-            self.memories[user_id] = {
-                'first_interaction': datetime.now().isoformat(),
-                'interactions': [],
-                'preferences': {},
-                'emotional_history': [],
-                'topics_of_interest': set()
-            }
-            
+        current_time = datetime.now()
         interaction = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': current_time.isoformat(),
             'context': context,
             'platform': platform,
             'emotion': emotion,
             'interaction_type': interaction_type
         }
         
-        self.memories[user_id]['interactions'].append(interaction)
-        self._save_memories()
+        self.store.add_interaction(user_id, SOURCE_MANAGER, interaction, current_time.timestamp())
         
     def get_user_context(self, user_id):
-        if user_id not in self.memories:
+        user = self.store.get_user(user_id)
+        if user is None:
             return None
-        return self.memories[user_id]
-        
-    def _save_memories(self):
-        with open(self.memory_file, 'w') as f:
-            json.dump(self.memories, f, indent=4)
\ No newline at end of file
+        return {
+            'first_interaction': user['first_seen'],
+            'interactions': self.store.recent(user_id, SOURCE_MANAGER),
+            'preferences': user['preferences']
+        }
\ No newline at end of file
@@ -19,24 +19,32 @@ def get_speak_input() -> bool:
     from utils.hotkeys import get_speak_input
     return get_speak_input()
 
-def record():
+def save_wav(audio: bytes, path: str):
+    wf = wave.open(path, 'wb')
+    wf.setnchannels(CHANNELS)
+    wf.setsampwidth(pyaudio.get_sample_size(FORMAT))
+    wf.setframerate(RATE)
+    wf.writeframes(audio)
+    wf.close()
+
+def record(on_partial: Optional[Callable[[bytes], None]] = None, partial_seconds: float = 2.0):
     p = pyaudio.PyAudio()
     stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
     frames = []
+    frames_per_partial = int(RATE / CHUNK * partial_seconds)
 
     while get_speak_input():
         data = stream.read(CHUNK)
         frames.append(data)
 
+        # Hand off the audio so far, so work can start before we stop talking
+        if on_partial is not None and frames_per_partial and len(frames) % frames_per_partial == 0:
+            on_partial(b''.join(frames))
+
     stream.stop_stream()
     stream.close()
     p.terminate()
 
-    wf = wave.open(SAVE_PATH, 'wb')
-    wf.setnchannels(CHANNELS)
-    wf.setsampwidth(p.get_sample_size(FORMAT))
-    wf.setframerate(RATE)
-    wf.writeframes(b''.join(frames))
-    wf.close()
+    save_wav(b''.join(frames), SAVE_PATH)
 
     return SAVE_PATH
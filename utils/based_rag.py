@@ -1,13 +1,18 @@
 import API.Oogabooga_Api_Support
-import string
 import threading
 import utils.lorebook
-import random
 import json
 import os
-import time
 import utils.logging
 import utils.settings
+import utils.tracing
+import utils.rag_hybrid
+import utils.rag_namespaces
+import utils.rag_speculation
+import utils.rag_summaries
+import utils.rag_windows
+import utils.text_store
+import utils.tokenizer
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict
 import numpy as np
@@ -34,6 +39,7 @@ histories_word_id_database = {
 }
 
 history_database = [["Start of all history!", "Start of all history!"]]
+history_store_path = "RAG_Database/LiveRAG_History"     # With rag_history_mmap, history lives here (.bin text, .idx offsets)
 
 show_rag_debug = True
 show_rag_debug_deep = False
@@ -41,10 +47,24 @@ show_rag_debug_deep = False
 current_rag_message = "No memory currently!"
 
 history_demarc = 20         # This is the point where the history gets considered as usable for RAG
+common_word_ratio = 0.00077 # Words making up more than this share of everything said are too common to search by
 
 manual_recalculate_ignore_latest = False
 is_setting_up = True
 
+# Bumped whenever stored history is rebuilt or removed, so cached searches know to start over
+database_generation = 0
+
+# Word to its ids in word_database, so parsing a message is a lookup per word
+word_index = {}
+word_index_source = None
+word_index_size = 0
+word_index_lock = threading.Lock()
+
+# What each recent add changed, newest last, so undo and reroll can take it back out exactly
+undo_log = []
+undo_log_depth = 50         # How many adds back an undo can reach before falling back to just dropping the entry
+
 char_name = os.environ.get("CHAR_NAME")
 
 
@@ -66,6 +86,9 @@ def setup_based_rag():
     global manual_recalculate_ignore_latest
     global is_setting_up
     global history_database
+    global database_generation
+
+    database_generation += 1
 
     #
     # IMPLEMENT SMART THREADING: Split it per thread and continually grab next order
@@ -95,17 +118,35 @@ def setup_based_rag():
 
     # Main loop that will run through and count all uses of a given word
     # Thread this as well eventually
+    # Split everything in one go first; the per-message cache is left for live turns
+    my_words = utils.tokenizer.words_bulk(pair[0] for pair in history_database)
+    her_words = utils.tokenizer.words_bulk(pair[1] for pair in history_database)
+
+    undo_log.clear()
+
     i = 0
     while i < len(history_database):
 
+        # The latest pair gets logged, so a reroll straight after this can take it back out
+        if i == len(history_database) - 1:
+            delta = start_message_delta()
+            delta['history'] = i
+
         # Add in each message pair
-        parse_words_to_database(history_database[i][0], 0)
-        parse_words_to_database(history_database[i][1], 1)
+        my_ids = parse_words_to_database(history_database[i][0], 0, my_words[i])
+        her_ids = parse_words_to_database(history_database[i][1], 1, her_words[i])
+
+        if i == len(history_database) - 1:
+            log_message_delta(delta, my_ids + her_ids)
 
         i = i + 1
 
 
 
+    # Move the text out to disk now it is all in
+    keep_history_on_disk()
+
+
     # Calculate the values of all words
     # Thread this as well eventually
 
@@ -137,6 +178,7 @@ def setup_based_rag():
 
 
 
+@utils.tracing.traced("rag.search")
 def run_based_rag(message, her_previous):
 
     global word_database
@@ -148,67 +190,102 @@ def run_based_rag(message, her_previous):
     # Clear the log, a new operation is beginning
     utils.logging.clear_rag_log()
 
+    global current_rag_message
+
+    # A namespaced audience (a Discord channel, a Twitch chat) recalls from its own memories, and the shared ones
+    namespace = utils.rag_namespaces.current_namespace()
+    if namespace is not None:
+        current_rag_message = utils.rag_namespaces.recall(message, her_previous, namespace) or "No memory currently!"
+
+        if show_rag_debug:
+            utils.logging.update_rag_log(namespace + "\n" + current_rag_message)
+        return
+
+
     #
-    # EVALUATE OUR SENT ONES FIRST
+    # EVALUATE OUR SENT ONES FIRST, THEN HERS
     #
 
-    # Parse the message being sent
-    history_word_ids = parse_words_to_database(message, 2)
-    history_word_scores = []
+    # Most of this was worked out while we were still talking; only new words get parsed here
+    history_word_ids = utils.rag_speculation.message_word_ids(message)
+    hers_history_word_ids = utils.rag_speculation.message_word_ids(her_previous)
 
+    highest_score_ids = pick_keywords(history_word_ids, hers_history_word_ids)
 
-    # Check the score value of all words
-    # NOTE: This is a maintenance item that doesn't need to run every time, so we just do it randomly
-
-    random_recalc = random.randint(0, 100)
-    if random_recalc > 70:
-        calc_word_values()
+    # Output our highest scoring words
+    if show_rag_debug:
+        x = 0
+        log_output_text = ""
+        while x < len(highest_score_ids):
+            log_output_text += str(word_database['word'][highest_score_ids[x]]) + "\n"
+            x = x + 1
 
+        utils.logging.update_rag_log(log_output_text)
 
-    # Run evaluation now that we have all of the words
-    i = 0
-    while i < len(history_word_ids):
 
-        # Pair all word keys with scores
-        score = word_database['value'][history_word_ids[i]]
+    #
+    # NOW EVALUATE ALL MESSAGE PAIRS AND SCORE THEM
+    #
 
-        # Boost lore word score (only single word)
-        if utils.lorebook.rag_word_check(word_database['word'][history_word_ids[i]]):
-            score = (score + 1) / 2
+    # Blend in embedding search, if set; keywords alone when it is off or misses its deadline
+    scored = None
+    if utils.settings.rag_hybrid_enabled:
+        scored = utils.rag_hybrid.hybrid_matches(message, highest_score_ids)
 
-        history_word_scores.append(score)
+    # Several memories, if asked for; falls through to the single latest one when nothing scored
+    if utils.settings.rag_top_k > 1:
+        rag_message = utils.rag_windows.retrieve_memories(highest_score_ids, history_database, char_name, scored)
+        if rag_message is not None:
+            current_rag_message = rag_message
 
-        i = i + 1
+            if show_rag_debug:
+                utils.logging.update_rag_log(current_rag_message)
+            return
 
-    # Local variable, to control cutoff
-    history_word_ids_feed_demarc = i
+    best_message_id = utils.rag_hybrid.best_match(scored[0]) if scored else None
+    if best_message_id is None:
+        best_message_id = utils.rag_speculation.best_memory(highest_score_ids)
 
 
     #
-    # EVALUATE HER SENT ONES SECOND
+    #   Create for the current message!
     #
 
-    hers_history_word_ids = parse_words_to_database(her_previous, 3)
+    # The summary of the stretch of history it is in says as much in fewer tokens, once one has been made
+    current_rag_message = utils.rag_summaries.summary_memory(best_message_id, highest_score_ids) or compose_rag_message(best_message_id)
 
+    if show_rag_debug:
+        utils.logging.update_rag_log(current_rag_message)
 
-    # Run evaluation now that we have all of the words
 
-    i = 0
-    while i < len(hers_history_word_ids):
+# Keyword scores for a parsed message, with lorebook words boosted
+def score_word_ids(word_ids, weight=1.0, database=None):
+
+    database = database or word_database
+
+    scores = []
+    for word_id in word_ids:
 
         # Pair all word keys with scores
-        score = word_database['value'][hers_history_word_ids[i]]
+        score = database['value'][word_id]
 
         # Boost lore word score (only single word)
-        if utils.lorebook.rag_word_check(word_database['word'][hers_history_word_ids[i]]):
+        if utils.lorebook.rag_word_check(database['word'][word_id]):
             score = (score + 1) / 2
 
-        history_word_ids.append(hers_history_word_ids[i])
-        history_word_scores.append(score * 0.97)            # Make hers less powerful
+        scores.append(score * weight)
 
-        i = i + 1
+    return scores
 
 
+# Picks the top six scoring words, with at most two of them being hers
+def pick_keywords(my_word_ids, her_word_ids, database=None):
+
+    history_word_ids = list(my_word_ids) + list(her_word_ids)
+    history_word_scores = score_word_ids(my_word_ids, 1.0, database) + score_word_ids(her_word_ids, 0.97, database)      # Make hers less powerful
+
+    # Local variable, to control cutoff
+    history_word_ids_feed_demarc = len(my_word_ids)
 
 
     # Get the top six scoring words, in order
@@ -249,68 +326,45 @@ def run_based_rag(message, her_previous):
         # Iterate to our next word, of course until we get to top 6 words
         j = j + 1
 
-    # Output our highest scoring words
-    if show_rag_debug:
-        x = 0
-        log_output_text = ""
-        while x < len(highest_score_ids):
-            log_output_text += str(word_database['word'][highest_score_ids[x]]) + "\n"
-            x = x + 1
-
-        utils.logging.update_rag_log(log_output_text)
+    return highest_score_ids
 
 
-    #
-    # NOW EVALUATE ALL MESSAGE PAIRS AND SCORE THEM
-    #
+# Scores message pairs from start up to the recall cutoff, carrying on from a previous best
+# Returns the best message id and score, and where the scan stopped so it can be resumed
+def search_memories(highest_score_ids, start=1, best_message_id=0, best_message_score=0):
 
+    # Disallow any recalling from past the demarc. Should be able to recall / flow from there
+    end = len(histories_word_id_database['me']) - history_demarc
 
-    # Evaluate
-    i = 0
-    while i < len(histories_word_id_database['me']):
+    i = max(start, 1)           # Disallow message 1; always start on message 2 or higher
+    while i < end:
         score_value = evaluate_message(highest_score_ids, histories_word_id_database['me'][i]) + evaluate_message(highest_score_ids, histories_word_id_database['her'][i])
         histories_word_id_database['scores'][i] = score_value
-        i = i + 1
-
-
-    # Print us out the best score & message
-
-    i = 1                       # Disallow message 1; always start on message 2 or higher
-    best_message_score = 0
-    best_message_id = 0
-
-    # Disallow any recalling from past the demarc. Should be able to recall / flow from there
-    while i < len(histories_word_id_database['me']) - history_demarc:
-
-        central_score = histories_word_id_database['scores'][i-1]
-        central_score += histories_word_id_database['scores'][i]
-        central_score += histories_word_id_database['scores'][i+1]
 
         # Less than or equal to makes it so that more recent entries are given a bigger score
-        if best_message_score <= histories_word_id_database['scores'][i]:
+        if best_message_score <= score_value:
             best_message_id = i
-            best_message_score = histories_word_id_database['scores'][i]
+            best_message_score = score_value
 
         i = i + 1
 
+    return best_message_id, best_message_score, i
 
-    #
-    #   Create for the current message!
-    #
 
-    global current_rag_message
+def compose_rag_message(best_message_id, history=None):
 
-    current_rag_message = "[System M]; This message is a memory of an interaction you have had, relevant to what is currently happening;\n"
-    current_rag_message += "User: " + history_database[best_message_id - 1][0] + "\n"
-    current_rag_message += char_name + ": " + history_database[best_message_id - 1][1] + "\n"
-    current_rag_message += "User: " + history_database[best_message_id][0] + "\n"
-    current_rag_message += char_name + ": " + history_database[best_message_id][1] + "\n"
-    current_rag_message += "User: " + history_database[best_message_id + 1][0] + "\n"
-    current_rag_message += char_name + ": " + history_database[best_message_id + 1][1] + "\n"
-    current_rag_message += "[System M]; This is the end of the memory!"
+    history = history or history_database
 
-    if show_rag_debug:
-        utils.logging.update_rag_log(current_rag_message)
+    rag_message = "[System M]; This message is a memory of an interaction you have had, relevant to what is currently happening;\n"
+    rag_message += "User: " + history[best_message_id - 1][0] + "\n"
+    rag_message += char_name + ": " + history[best_message_id - 1][1] + "\n"
+    rag_message += "User: " + history[best_message_id][0] + "\n"
+    rag_message += char_name + ": " + history[best_message_id][1] + "\n"
+    rag_message += "User: " + history[best_message_id + 1][0] + "\n"
+    rag_message += char_name + ": " + history[best_message_id + 1][1] + "\n"
+    rag_message += "[System M]; This is the end of the memory!"
+
+    return rag_message
 
 
 
@@ -320,14 +374,10 @@ def call_rag_message():
 
 
 
-def parse_words_to_database(message, flag):
+def parse_words_to_database(message, flag, words=None):
 
-    global word_database
+    global word_database, word_index_size
 
-    # Count, using a word collector to detect when spaces are gone
-    i = 0
-    word_collector = ""
-    word_start_marker = 0
     history_word_ids = []
 
 
@@ -338,72 +388,47 @@ def parse_words_to_database(message, flag):
         count_to_total = False
 
 
-
-    refined_message = message.translate(str.maketrans('', '', string.punctuation))
-    refined_message = str.lower(refined_message)
-    refined_message = refined_message.replace("\n", " ")
+    # Split by the shared tokenizer (cached per message), unless the caller already did it
+    if words is None:
+        words = utils.tokenizer.words(message)
 
     if show_rag_debug_deep:
-        utils.logging.update_rag_log(refined_message)
+        utils.logging.update_rag_log(utils.tokenizer.refine(message))
 
 
-    while i < len(refined_message):
+    with word_index_lock:
+        sync_word_index()
 
-        if refined_message[i] == " ":
-            word_start_marker = i + 1
+        for word in words:
 
-        # Look for stopping, either spaces or end of message
-        if i + 1 == len(refined_message) or refined_message[i+1] == ' ':
-
-            # Feed our word collector the marked version
-            word_collector = refined_message[word_start_marker:i+1]
-
-            j = 0
-            word_found = False
-
-            # Scan if word is in database
-            while j < len(word_database["word"]):
-                if word_collector == word_database["word"][j]:
+            # Look the word up in the index, rather than scanning the whole database
+            word_ids = word_index.get(word)
 
+            if word_ids:
+                for j in word_ids:
                     if count_to_total:
                         word_database["count"][j] = word_database["count"][j] + 1
-
-                    word_found = True
+                        word_database["value"][j] = word_value(word_database["count"][j])
 
                     # Add to our history word ID database
                     history_word_ids.append(j)
 
-                j = j + 1
-
-
             # If word not in database and we are counting, add it in (word will simply be skipped for eval parsing)
-            if not word_found and count_to_total:
-                word_database["word"].append(word_collector)
+            elif count_to_total:
+                word_database["word"].append(word)
                 word_database["count"].append(1)
-                word_database["value"].append(0.99)         # Note: will have to be recalculated later on for new words
+                word_database["value"].append(word_value(1))
+
+                word_index[word] = [len(word_database["word"]) - 1]
+                word_index_size = len(word_database["word"])
 
                 # Add to our history word ID database
                 history_word_ids.append(len(word_database["word"]) - 1)
 
-
-            # Set the marker for our next word
-            word_start_marker = i + 2
-
-            # Boost again to skip space
-            i = i + 1
-
-
-            # Clear the word
-            word_collector = ""
-
             # Boost our total word count
             if count_to_total:
                 word_database['total_word_count'] = word_database['total_word_count'] + 1
 
-
-
-        i = i + 1
-
     # Sent by me, history
     if flag == 0:
         histories_word_id_database["me"].append(history_word_ids)
@@ -428,15 +453,35 @@ def parse_words_to_database(message, flag):
         return history_word_ids
 
 
-# Calculates the value of all words
-def calc_word_values():
-    global word_database
+# Brings the word index up to date; the word list only grows, unless a saved one is loaded over it
+def sync_word_index():
 
-    # Give base values to all the words, with a maximum score being 1
-    i = 0
-    while i < len(word_database["value"]):
-        word_database['value'][i] = (1 / (word_database['count'][i] + 19)) * 20
-        i = i + 1
+    global word_index, word_index_source, word_index_size
+
+    if word_database['word'] is not word_index_source:
+        word_index = {}
+        word_index_source = word_database['word']
+        word_index_size = 0
+
+    # Duplicates are possible in a loaded database, and the old scan matched every copy
+    for word_id in range(word_index_size, len(word_index_source)):
+        word_index.setdefault(word_index_source[word_id], []).append(word_id)
+
+    word_index_size = len(word_index_source)
+
+
+# The value of a word, from how often it has been used, with a maximum score being 1
+def word_value(count):
+    return (1 / (count + 19)) * 20
+
+
+# Calculates the value of all words, in one go. Only needed for a freshly built or loaded database;
+# after that, every count change refreshes its own word's value
+def calc_word_values(database=None):
+
+    database = database or word_database
+
+    database['value'][:] = ((1 / (np.asarray(database['count'], dtype=np.float64) + 19)) * 20).tolist()
 
 
 
@@ -450,7 +495,7 @@ def prune_common(point):
     i = 0
     while i < len(histories_word_id_database["me"][point]):
         word_id = histories_word_id_database["me"][point][i]
-        if (word_database['count'][word_id] / word_database['total_word_count']) > 0.00077:
+        if (word_database['count'][word_id] / word_database['total_word_count']) > common_word_ratio:
             histories_word_id_database["me"][point].pop(i)
             i = 0
 
@@ -459,7 +504,7 @@ def prune_common(point):
     i = 0
     while i < len(histories_word_id_database["her"][point]):
         word_id = histories_word_id_database["her"][point][i]
-        if (word_database['count'][word_id] / word_database['total_word_count']) > 0.00077:
+        if (word_database['count'][word_id] / word_database['total_word_count']) > common_word_ratio:
             histories_word_id_database["her"][point].pop(i)
             i = 0
 
@@ -518,16 +563,27 @@ def add_message_to_database():
     while history[new_msg][0].__contains__("[System D]"):
         new_msg = new_msg - 1
 
+    # Already filed under a namespace (a Discord channel, a Twitch chat), keep it out of the shared memories
+    if utils.rag_namespaces.is_claimed(history[new_msg]):
+        return
+
     # Add latest message pair, to both the word database AND local hist
-    parse_words_to_database(history[new_msg][0], 0)
-    parse_words_to_database(history[new_msg][1], 1)
+    delta = start_message_delta()
+
+    my_ids = parse_words_to_database(history[new_msg][0], 0)
+    her_ids = parse_words_to_database(history[new_msg][1], 1)
 
     history_database += [[history[new_msg][0], history[new_msg][1]]]
 
+    log_message_delta(delta, my_ids + her_ids)
+
 
     # Prune these as well (always latest one, may not sync 1:1 to history due to system messages)
     prune_common(len(histories_word_id_database['me']) - 1)
 
+    # Embed the new pair in the background, for hybrid search
+    utils.rag_hybrid.schedule_sync()
+
 
 
 # Remove last entry in the database (undo)
@@ -537,18 +593,108 @@ def remove_latest_database_message():
     if not utils.settings.rag_enabled:
         return
 
+    # Take back exactly what the latest add did, word counts included
+    if revert_latest_message():
+        return
+
     #
-    # NOTE: Does NOT uncount words! This should mostly be fine in the large scale, and we still have manual recalcs that can self right this
+    # NOTE: Nothing logged (loaded from a previous session), so this does NOT uncount words! Manual recalcs can self right this
     #
 
-    global histories_word_id_database
+    global histories_word_id_database, database_generation
+
+    database_generation += 1
 
     histories_word_id_database["me"].pop()
     histories_word_id_database["her"].pop()
     histories_word_id_database["scores"].pop()
+    history_database.pop()
+
+
+# Reroll of her latest reply; it is normally only added on the next send, so there is nothing to take back
+def remove_rerolled_message():
+
+    global manual_recalculate_ignore_latest
+
+    # Blocking statement to stop if our RAG is not enabled
+    if not utils.settings.rag_enabled:
+        return
+
+    # Straight after a recalculation the latest pair is already in, and has to come back out for the new reply
+    if manual_recalculate_ignore_latest and revert_latest_message():
+        manual_recalculate_ignore_latest = False
+
+
+# Where the database stood before an add
+def start_message_delta():
+    return {
+        'words': len(word_database['word']),
+        'total_word_count': word_database['total_word_count'],
+        'pairs': len(histories_word_id_database['me']),
+        'history': len(history_database)
+    }
+
+
+# Keep the ids the add counted (before pruning), to uncount them on undo
+def log_message_delta(delta, word_ids):
+
+    delta['word_ids'] = word_ids
+    undo_log.append(delta)
 
+    if len(undo_log) > undo_log_depth:
+        del undo_log[0]
 
 
+# Undoes the latest logged add, in the time it takes to walk its words. Returns False if there was nothing to undo
+def revert_latest_message():
+
+    global database_generation, word_index_size
+
+    if not undo_log:
+        return False
+
+    delta = undo_log.pop()
+
+    # Something else changed the database since; the log no longer lines up
+    if len(histories_word_id_database['me']) != delta['pairs'] + 1 or len(history_database) != delta['history'] + 1:
+        undo_log.clear()
+        return False
+
+    with word_index_lock:
+        sync_word_index()
+
+        # Uncount the words that were already known, and refresh their values
+        for word_id in delta['word_ids']:
+            if word_id < delta['words']:
+                word_database['count'][word_id] = word_database['count'][word_id] - 1
+                word_database['value'][word_id] = word_value(word_database['count'][word_id])
+
+        # Words first seen in this message go back out, index included (always the newest ids)
+        for word_id in range(len(word_database['word']) - 1, delta['words'] - 1, -1):
+            word_ids = word_index[word_database['word'][word_id]]
+            word_ids.pop()
+            if not word_ids:
+                del word_index[word_database['word'][word_id]]
+
+        del word_database['word'][delta['words']:]
+        del word_database['count'][delta['words']:]
+        del word_database['value'][delta['words']:]
+        word_index_size = delta['words']
+
+        word_database['total_word_count'] = delta['total_word_count']
+
+    del histories_word_id_database['me'][delta['pairs']:]
+    del histories_word_id_database['her'][delta['pairs']:]
+    del histories_word_id_database['scores'][delta['pairs']:]
+    del history_database[delta['history']:]
+
+    database_generation += 1
+
+    return True
+
+
+
+@utils.tracing.traced("rag.store")
 def store_rag_history():
 
     # Blocking statement to stop if our RAG is not enabled
@@ -562,8 +708,15 @@ def store_rag_history():
     with open("RAG_Database/LiveRAG_HistoryWordID.json", 'w') as outfile:
         json.dump(histories_word_id_database, outfile, indent=4)
 
-    with open("RAG_Database/LiveRAG_History.json", 'w') as outfile:
-        json.dump(history_database, outfile, indent=4)
+    # On disk already, only the offsets need writing
+    if isinstance(history_database, utils.text_store.PairTextStore):
+        history_database.flush()
+    else:
+        with open("RAG_Database/LiveRAG_History.json", 'w') as outfile:
+            json.dump(history_database, outfile, indent=4)
+
+    # And any namespaces with something new
+    utils.rag_namespaces.get_namespace_store().save_all()
 
 
 def load_rag_history():
@@ -572,20 +725,25 @@ def load_rag_history():
     if not utils.settings.rag_enabled:
         return
 
-    global word_database, histories_word_id_database, history_database, is_setting_up
+    global word_database, histories_word_id_database, history_database, is_setting_up, database_generation
+
+    database_generation += 1
+    undo_log.clear()
 
     # Check if we need to load, or generate the RAG
     path = 'RAG_Database/LiveRAG_Words.json'
     path2 = 'RAG_Database/LiveRAG_HistoryWordID.json'
     path3 = 'RAG_Database/LiveRAG_History.json'
+    path4 = history_store_path + ".idx"
 
     check_file = os.path.isfile(path)
     check_file2 = os.path.isfile(path2)
     check_file3 = os.path.isfile(path3)
+    check_file4 = os.path.isfile(path4)
 
 
     # Switch
-    if check_file and check_file2 and check_file3:
+    if check_file and check_file2 and (check_file3 or check_file4):
 
         # File found, load
 
@@ -598,8 +756,25 @@ def load_rag_history():
         with open(path2, 'r') as openfile:
             histories_word_id_database = json.load(openfile)
 
-        with open(path3, 'r') as openfile:
-            history_database = json.load(openfile)
+        # Let go of any store from before, its files are about to be reopened or replaced
+        if isinstance(history_database, utils.text_store.PairTextStore):
+            history_database.close()
+
+        # Whichever of the JSON and the store was saved last (the setting may have been switched since)
+        if check_file4 and (not check_file3 or os.path.getmtime(path4) >= os.path.getmtime(path3)):
+            history_database = utils.text_store.PairTextStore(history_store_path)
+            if not utils.settings.rag_history_mmap:
+                store = history_database
+                history_database = list(store)
+                store.close()
+
+        else:
+            with open(path3, 'r') as openfile:
+                history_database = json.load(openfile)
+            keep_history_on_disk()
+
+        # Older saves kept stale values between the random recalcs; bring them in line with the counts once
+        calc_word_values()
 
         # Flag this as done
         is_setting_up = False
@@ -611,25 +786,53 @@ def load_rag_history():
         manual_recalculate_database()
 
 
-def manual_recalculate_database():
+# Swap the history list for the memory-mapped store, if enabled
+def keep_history_on_disk():
 
-    # All in one
+    global history_database
 
-    print("\nManually re-calculating the RAG database. Give me some time...\n")
-    utils.logging.update_rag_log("\nManually re-calculating the RAG database. Give me some time...\n")
-    setup_based_rag()
+    if not utils.settings.rag_history_mmap:
+        return
+
+    if isinstance(history_database, utils.text_store.PairTextStore):
+        history_database.flush()
+        return
+
+    history_database = utils.text_store.PairTextStore.create(history_store_path, history_database)
 
 
-def word_value_passive_calculation():
+# Back to the empty database we start with, for a rebuild from nothing
+def clear_rag_database():
 
-    # Passively recalculate word values in the background
-    # NYI - Not yet implemented. Will need to be pretty smart
+    global word_database, histories_word_id_database, history_database, database_generation
 
-    while True:
-        time.sleep(120)
+    if isinstance(history_database, utils.text_store.PairTextStore):
+        history_database.close()
 
-        if not is_setting_up:
-            calc_word_values()
+    word_database = {
+        'word': ["", " ", "the", "it"],
+        'count': [1, 1, 1, 1],
+        'value': [0.0, 0.0, 0.0, 0.0],
+        'total_word_count': 0
+    }
+    histories_word_id_database = {
+        'me': [],
+        'her': [],
+        'scores': []
+    }
+    history_database = [["Start of all history!", "Start of all history!"]]
+
+    undo_log.clear()
+    database_generation += 1
+
+
+def manual_recalculate_database():
+
+    # All in one
+
+    print("\nManually re-calculating the RAG database. Give me some time...\n")
+    utils.logging.update_rag_log("\nManually re-calculating the RAG database. Give me some time...\n")
+    setup_based_rag()
 
 
 class RAGProcessor:
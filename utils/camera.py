@@ -8,6 +8,7 @@ import logging
 
 import utils.settings
 import utils.vtube_studio
+import utils.image_pipeline
 import random
 
 # Configure logging
@@ -43,8 +44,8 @@ def capture_pic():
     if result:
 
         image = cv2.resize(image,(320, 240))
-        # saving image in local storage
-        cv2.imwrite("LiveImage.png", image)
+        # keep it in memory for the vision request, no need for disk
+        utils.image_pipeline.store_frame(image)
 
         # Show it to us, if we are previewing!
         if utils.settings.cam_image_preview:
@@ -74,8 +75,8 @@ def use_image_feed():
     dim = (int(image.shape[1] * f), int(image.shape[0] * f))
     image = cv2.resize(image, dim)
 
-    # saving image in local storage
-    cv2.imwrite("LiveImage.png", image)
+    # keep it in memory for the vision request, no need for disk
+    utils.image_pipeline.store_frame(image)
 
 
 
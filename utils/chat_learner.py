@@ -1,9 +1,7 @@
-import sqlite3
 import time
 import logging
 from textblob import TextBlob  # For sentiment analysis
 import random  # For dynamic personality shaping
-from transformers import pipeline  # Import the transformers library
 from flask import Flask, request, jsonify
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
@@ -12,6 +10,8 @@ from utils.emotion_recognizer import recognize_emotion_from_text
 from utils.logging import log_info, log_error
 from utils.performance_metrics import track_performance
 from utils.memory_manager import MemoryManager  # Import the new class
+from utils.sqlite_pipeline import get_sqlite_pipeline
+from utils.model_registry import TEXT_GENERATION, infer
 
 # Ensure apscheduler is installed in your environment
 # Run: pip install apscheduler
@@ -22,15 +22,15 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 class ChatLearner:
     def __init__(self, db_name='chat_learner.db', rag_processor=None):
         log_info("Initializing ChatLearner.")
-        self.connection = sqlite3.connect(db_name)
+        # Writes are batched by a single writer thread; reads use a per-thread connection
+        self.pipeline = get_sqlite_pipeline(db_name)
         self.memory_manager = MemoryManager(rag_processor)
         self.setup_database()
         self.user_histories = {}
         self.emotional_states = {}
 
     def setup_database(self):
-        cursor = self.connection.cursor()
-        cursor.execute('''
+        self.pipeline.executescript('''
             CREATE TABLE IF NOT EXISTS interactions (
                 user_id TEXT,
                 timestamp DATETIME,
@@ -38,9 +38,11 @@ class ChatLearner:
                 response TEXT,
                 emotion TEXT,
                 context TEXT
-            )
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_interactions_user_time ON interactions (user_id, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_interactions_time ON interactions (timestamp);
         ''')
-        self.connection.commit()
 
     def learn_from_message(self, message_data):
         log_info(f"Learning from message: {message_data}.")
@@ -65,36 +67,32 @@ class ChatLearner:
         user_history = self.get_user_history(user_id)
         emotional_state = self.get_emotional_state(user_id)
         
-        # Use transformer pipeline for response generation
-        generator = pipeline('text-generation')
-        
         # Create context-aware prompt
         prompt = self.create_context_prompt(user_history, emotional_state, message)
         
-        # Generate response
-        response = generator(prompt, max_length=150)[0]['generated_text']
+        # Generate response; the model is loaded once and shared, batched with other users
+        response = infer(TEXT_GENERATION, prompt, max_length=150)[0]['generated_text']
         
         return self.post_process_response(response, emotional_state)
 
     def get_user_history(self, user_id):
-        cursor = self.connection.cursor()
-        cursor.execute('''
+        # Served by idx_interactions_user_time, no full scan
+        return self.pipeline.query('''
             SELECT message, response, emotion, timestamp 
             FROM interactions 
             WHERE user_id = ? 
             ORDER BY timestamp DESC 
             LIMIT 10
         ''', (user_id,))
-        return cursor.fetchall()
 
     def store_interaction(self, user_id, message, response, emotion):
-        cursor = self.connection.cursor()
-        cursor.execute('''
+        # Same format as SQLite's datetime('now'), but taken now rather than at commit
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self.pipeline.execute('''
             INSERT INTO interactions 
             (user_id, timestamp, message, response, emotion) 
-            VALUES (?, datetime('now'), ?, ?, ?)
-        ''', (user_id, message, response, emotion))
-        self.connection.commit()
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, timestamp, message, response, emotion))
 
     def get_emotional_state(self, user_id):
         return self.emotional_states.get(user_id, {
@@ -136,33 +134,35 @@ class ChatLearner:
 
     def prune_old_messages(self):
         """Remove messages and emotional states older than 365 days"""
-        cursor = self.connection.cursor()
-        cursor.execute('''
+        self.pipeline.execute('''
             DELETE FROM interactions 
             WHERE timestamp < datetime('now', '-365 days')
         ''')
-        self.connection.commit()
 
 # API Support Skeleton
 app = Flask(__name__)
-learner = ChatLearner()
 
-# Initialize the scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(learner.prune_old_messages, IntervalTrigger(days=365))  # Schedule cleanup every 365 days
-scheduler.start()
+# Built on the first API request, not on import; importing ChatLearner shouldn't start anything
+learner = None
+response_generator = None
+scheduler = None
+
 
-# Assuming you have memory_manager and chat_learner defined somewhere in your code
-memory_manager = MemoryManager()  # Initialize as needed
-chat_learner = ChatLearner()  # Initialize as needed
+def get_learner():
+    global learner, response_generator, scheduler
+    if learner is None:
+        learner = ChatLearner()
+        response_generator = PersonalizedResponseGenerator(learner.memory_manager, learner)
 
-# Initialize PersonalizedResponseGenerator with the required arguments
-response_generator = PersonalizedResponseGenerator(memory_manager, chat_learner)  # Pass the required arguments
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(learner.prune_old_messages, IntervalTrigger(days=365))  # Schedule cleanup every 365 days
+        scheduler.start()
+    return learner
 
 @app.route('/learn', methods=['POST'])
 def learn():
     data = request.json
-    learner.learn_from_message(data)
+    get_learner().learn_from_message(data)
     return jsonify({"status": "success", "message": "Message learned."})
 
 @app.route('/generate_response', methods=['POST'])
@@ -172,6 +172,7 @@ def generate_response():
     user_message = data.get('message')
     
     # Generate a personalized response
+    get_learner()
     response = response_generator.generate_response(user_id, user_message)
     return jsonify({"response": response})
 
@@ -1,8 +1,7 @@
-import json
-import os
 from datetime import datetime, timedelta
 from chat.learner import ChatLearner
 from memory.manager import MemoryManager
+from utils.memory_store import get_memory_store, SOURCE_CONTEXT
 import logging
 
 # Configure logging
@@ -12,44 +11,31 @@ class ContextualMemory:
     def __init__(self, memory_file="user_context_memory.json"):
         logging.info("Initializing ContextualMemory.")
         self.memory_file = memory_file
-        self.context_memory = self._load_memory()
 
-    def _load_memory(self):
-        if os.path.exists(self.memory_file):
-            with open(self.memory_file, 'r') as f:
-                return json.load(f)
-        return {}
-
-    def save_memory(self):
-        with open(self.memory_file, 'w') as f:
-            json.dump(self.context_memory, f, indent=2)
+        # Shared indexed store; old JSON files are migrated into it once
+        self.store = get_memory_store()
+        self.store.migrate_json_file(memory_file)
 
     def update_context(self, user_id, context_data):
         logging.info(f"Updating context for user: {user_id}.")
-        if user_id not in self.context_memory:
-            self.context_memory[user_id] = {
-                "last_updated": datetime.now().isoformat(),
-                "context": []
-            }
-        self.context_memory[user_id]["context"].append(context_data)
-        self.context_memory[user_id]["last_updated"] = datetime.now().isoformat()
-        self.save_memory()
+        self.store.add_interaction(user_id, SOURCE_CONTEXT, context_data)
 
     def get_context(self, user_id):
-        return self.context_memory.get(user_id, {"context": [], "last_updated": None})
+        last_updated = self.store.last_timestamp(user_id, SOURCE_CONTEXT)
+        if last_updated is None:
+            return {"context": [], "last_updated": None}
+        return {
+            "context": self.store.recent(user_id, SOURCE_CONTEXT),
+            "last_updated": datetime.fromtimestamp(last_updated).isoformat()
+        }
 
     def clear_context(self, user_id):
-        if user_id in self.context_memory:
-            del self.context_memory[user_id]
-            self.save_memory()
+        self.store.delete_user_source(user_id, SOURCE_CONTEXT)
 
     def prune_old_context(self):
-        """Remove context data older than 365 days."""
+        """Remove the whole context of users not updated in 365 days."""
         one_year_ago = datetime.now() - timedelta(days=365)
-        for user_id in list(self.context_memory.keys()):
-            last_updated = datetime.fromisoformat(self.context_memory[user_id]["last_updated"])
-            if last_updated < one_year_ago:
-                self.clear_context(user_id)
+        self.store.expire_idle_users(one_year_ago.timestamp(), SOURCE_CONTEXT)
 class EnhancedMemorySystem:
     def __init__(self):
         self.memory_manager = MemoryManager()
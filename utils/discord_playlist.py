@@ -0,0 +1,213 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional, Tuple
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+YDL_OPTS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'no_warnings': True,
+    'extract_audio': True,
+    'force_generic_extractor': False,
+    'noplaylist': True
+}
+
+
+def is_youtube_url(url: str) -> bool:
+    return 'youtube.com' in url or 'youtu.be' in url
+
+
+def extract_stream_url(url: str) -> str:
+    """Resolve a page URL into a direct audio stream URL with yt-dlp"""
+    if not is_youtube_url(url):
+        return url
+
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(YDL_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if 'formats' in info:
+        formats = [f for f in info['formats'] if f.get('acodec') != 'none']
+        if not formats:
+            formats = info['formats']
+        return formats[0]['url']
+
+    return info['url']
+
+
+@dataclass
+class ResolveMetrics:
+    resolutions: int = 0
+    cache_hits: int = 0
+    failures: int = 0
+    recent_seconds: Deque[float] = field(default_factory=lambda: deque(maxlen=100))
+
+    def summary(self) -> dict:
+        timings = sorted(self.recent_seconds)
+        return {
+            'resolutions': self.resolutions,
+            'cache_hits': self.cache_hits,
+            'failures': self.failures,
+            'p50_seconds': timings[len(timings) // 2] if timings else 0.0,
+            'max_seconds': timings[-1] if timings else 0.0
+        }
+
+
+class StreamResolver:
+    """Resolves track URLs on a bounded pool, caching stream URLs until they expire"""
+
+    def __init__(self, extractor: Callable[[str], str] = extract_stream_url,
+                 max_workers: int = 2, ttl_seconds: float = 1800):
+        self.extractor = extractor
+        self.ttl_seconds = ttl_seconds
+        self.metrics = ResolveMetrics()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="z_waif_ytdl")
+        self._cache: Dict[str, Tuple[str, float]] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, url: str) -> Future:
+        """Future for the stream URL; shared with any resolution already running"""
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached is not None and cached[1] > time.monotonic():
+                self.metrics.cache_hits += 1
+                done = Future()
+                done.set_result(cached[0])
+                return done
+
+            if url in self._in_flight:
+                return self._in_flight[url]
+
+            future = self._executor.submit(self._resolve_now, url)
+            self._in_flight[url] = future
+            return future
+
+    def _resolve_now(self, url: str) -> str:
+        start = time.perf_counter()
+        try:
+            stream_url = self.extractor(url)
+        except Exception:
+            with self._lock:
+                self.metrics.failures += 1
+                self._in_flight.pop(url, None)
+            raise
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._cache[url] = (stream_url, time.monotonic() + self.ttl_seconds)
+            self._in_flight.pop(url, None)
+            self.metrics.resolutions += 1
+            self.metrics.recent_seconds.append(elapsed)
+        logging.info(f"Resolved stream for {url} in {elapsed:.2f}s")
+        return stream_url
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass
+class GuildQueue:
+    upcoming: Deque[str] = field(default_factory=deque)
+    now_playing: Optional[str] = None
+    starting: bool = False
+
+
+class PlaylistEngine:
+    """Per-guild track queues that keep the next few tracks resolved ahead of time"""
+
+    def __init__(self, resolver: Optional[StreamResolver] = None, prefetch_count: int = 2):
+        self.resolver = resolver or StreamResolver()
+        self.prefetch_count = prefetch_count
+        self.guilds: Dict[int, GuildQueue] = {}
+
+    def queue_for(self, guild_id: int) -> GuildQueue:
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = GuildQueue()
+        return self.guilds[guild_id]
+
+    def enqueue(self, guild_id: int, url: str) -> int:
+        """Add a track; returns its position in the upcoming queue"""
+        queue = self.queue_for(guild_id)
+        queue.upcoming.append(url)
+        self.prefetch(guild_id)
+        return len(queue.upcoming)
+
+    def prefetch(self, guild_id: int):
+        queue = self.queue_for(guild_id)
+        for url in list(queue.upcoming)[:self.prefetch_count]:
+            self.resolver.resolve(url)
+
+    def is_playing(self, guild_id: int) -> bool:
+        queue = self.queue_for(guild_id)
+        return queue.starting or queue.now_playing is not None
+
+    def claim_start(self, guild_id: int) -> bool:
+        """Mark the guild as starting playback; False if it already is, or is playing.
+
+        Call it before awaiting anything, so a second /play that lands while
+        the first is still connecting only queues its track.
+        """
+        if self.is_playing(guild_id):
+            return False
+        self.queue_for(guild_id).starting = True
+        return True
+
+    def advance(self, guild_id: int) -> Optional[str]:
+        """Move to the next track, starting resolution of the ones behind it"""
+        queue = self.queue_for(guild_id)
+        queue.starting = False
+        queue.now_playing = queue.upcoming.popleft() if queue.upcoming else None
+        self.prefetch(guild_id)
+        return queue.now_playing
+
+    async def stream_url(self, url: str) -> str:
+        return await asyncio.wrap_future(self.resolver.resolve(url))
+
+    def clear(self, guild_id: int):
+        self.guilds.pop(guild_id, None)
+
+    def metrics(self) -> dict:
+        return self.resolver.metrics.summary()
+
+
+def benchmark_playlist_handoff(tracks: int = 5, resolve_seconds: float = 0.3, track_seconds: float = 0.5):
+    """Gap between tracks with a stubbed extractor, resolving on demand vs ahead"""
+
+    def stub_extractor(url):
+        time.sleep(resolve_seconds)
+        return "stream://" + url
+
+    async def play_all(prefetch_count):
+        engine = PlaylistEngine(StreamResolver(stub_extractor, max_workers=2), prefetch_count=prefetch_count)
+        for i in range(tracks):
+            engine.enqueue(0, f"https://youtu.be/track{i}")
+
+        gaps = []
+        track_ended = None
+        while engine.advance(0) is not None:
+            await engine.stream_url(engine.queue_for(0).now_playing)
+            if track_ended is not None:
+                gaps.append(time.perf_counter() - track_ended)
+            await asyncio.sleep(track_seconds)     # The track playing
+            track_ended = time.perf_counter()
+
+        engine.resolver.shutdown()
+        return max(gaps), engine.metrics()
+
+    for prefetch_count in (0, 2):
+        worst_gap, metrics = asyncio.run(play_all(prefetch_count))
+        print(f"prefetch {prefetch_count}: worst gap {worst_gap * 1000:.1f} ms, "
+              f"resolution p50 {metrics['p50_seconds'] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    benchmark_playlist_handoff()
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+import logging
+
+import utils.tracing
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+class DiscordResponseBridge:
+    """Runs blocking LLM generation off the gateway event loop.
+
+    The Oobabooga support module keeps its history in module globals, so all
+    generations share one worker thread. Semaphores cap how many messages per
+    guild and per channel may be waiting on it at once.
+    """
+
+    def __init__(self, generate: Callable[[str, Callable[[str], None]], str],
+                 per_guild: int = 2, per_channel: int = 1, edit_interval: float = 1.0):
+        self.generate = generate
+        self.per_guild = per_guild
+        self.per_channel = per_channel
+        self.edit_interval = edit_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="z_waif_llm")
+        self._guild_limits: Dict[object, asyncio.Semaphore] = {}
+        self._channel_limits: Dict[object, asyncio.Semaphore] = {}
+
+    def _limit(self, limits: Dict[object, asyncio.Semaphore], key, size: int) -> asyncio.Semaphore:
+        if key not in limits:
+            limits[key] = asyncio.Semaphore(size)
+        return limits[key]
+
+    async def respond(self, channel, content: str, guild_id=None) -> Optional[str]:
+        """Generate a reply for the channel, editing it in as it streams"""
+        guild_limit = self._limit(self._guild_limits, guild_id, self.per_guild)
+        channel_limit = self._limit(self._channel_limits, channel.id, self.per_channel)
+
+        # Channel first, so a busy channel queues on its own slot rather than holding one of the guild's
+        async with channel_limit, guild_limit:
+            loop = asyncio.get_running_loop()
+            partial = {'text': ""}
+            partial_ready = asyncio.Event()
+
+            def on_partial(text: str):
+                partial['text'] = text
+                loop.call_soon_threadsafe(partial_ready.set)
+
+            posted = None
+            shown_text = ""
+            last_edit = 0.0
+
+            async with channel.typing():
+                generation = loop.run_in_executor(self._executor, utils.tracing.bind(self.generate), content, on_partial)
+
+                while not generation.done():
+                    partial_ready.clear()
+                    waiter = asyncio.ensure_future(partial_ready.wait())
+                    await asyncio.wait({generation, waiter}, timeout=self.edit_interval,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+
+                    # Throttle edits, Discord rate limits them per channel
+                    text = partial['text'][:DISCORD_MESSAGE_LIMIT]
+                    if text and text != shown_text and time.monotonic() - last_edit >= self.edit_interval:
+                        if posted is None:
+                            posted = await channel.send(text)
+                        else:
+                            await posted.edit(content=text)
+                        shown_text = text
+                        last_edit = time.monotonic()
+
+                response = await generation
+
+            if not response:
+                response = "Sorry, I couldn't process that."
+            response = response[:DISCORD_MESSAGE_LIMIT]
+
+            if posted is None:
+                await channel.send(response)
+            elif response != shown_text:
+                await posted.edit(content=response)
+
+            return response
+
+    async def reply_text(self, content: str) -> Optional[str]:
+        """A reply without posting it, on the same single worker as respond"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, utils.tracing.bind(self.generate), content, None)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def benchmark_gateway_latency(messages: int = 8, generation_seconds: float = 0.4,
+                              heartbeat_interval: float = 0.05):
+    """Heartbeat lag on a fake gateway while a burst of messages is answered"""
+
+    class FakeMessage:
+        async def edit(self, content):
+            await asyncio.sleep(0)
+
+    class FakeTyping:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+    class FakeChannel:
+        def __init__(self, channel_id):
+            self.id = channel_id
+
+        def typing(self):
+            return FakeTyping()
+
+        async def send(self, content):
+            await asyncio.sleep(0)
+            return FakeMessage()
+
+    def fake_generate(content, on_partial):
+        for i in range(4):
+            time.sleep(generation_seconds / 4)
+            on_partial(content[:i + 1])
+        return "reply to " + content
+
+    async def heartbeat(lags, stop):
+        while not stop.is_set():
+            expected = time.perf_counter() + heartbeat_interval
+            await asyncio.sleep(heartbeat_interval)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    async def burst(use_bridge):
+        lags = []
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(lags, stop))
+        bridge = DiscordResponseBridge(fake_generate, edit_interval=0.1)
+        channels = [FakeChannel(i % 3) for i in range(messages)]
+
+        start = time.perf_counter()
+        if use_bridge:
+            await asyncio.gather(*(bridge.respond(channel, f"message {i}", guild_id=0)
+                                   for i, channel in enumerate(channels)))
+        else:
+            for i, channel in enumerate(channels):
+                await channel.send(fake_generate(f"message {i}", lambda text: None))
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await beat
+        bridge.shutdown()
+        lags.sort()
+        return {
+            'mode': "executor_bridge" if use_bridge else "blocking_in_coroutine",
+            'total_s': elapsed,
+            'heartbeat_p50_ms': lags[len(lags) // 2] * 1000 if lags else 0.0,
+            'heartbeat_max_ms': lags[-1] * 1000 if lags else 0.0
+        }
+
+    results = [asyncio.run(burst(False)), asyncio.run(burst(True))]
+    for result in results:
+        print(f"{result['mode']:>22}: total {result['total_s']:.2f} s, heartbeat lag "
+              f"p50 {result['heartbeat_p50_ms']:.1f} ms, max {result['heartbeat_max_ms']:.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_gateway_latency()
@@ -2,12 +2,12 @@ from pathlib import Path
 import asyncio
 import tempfile
 import time
-from gtts import gTTS
 import os
 from . import settings
+from .tts_cache import TTSCache, load_common_phrases, split_sentences
+from .discord_playlist import StreamResolver
 import discord
 from discord import FFmpegPCMAudio
-import yt_dlp
 import utils.api as API  # Adjust the import based on your project structure
 import librosa
 import numpy as np
@@ -25,6 +25,14 @@ class DiscordVoiceHandler:
         self.audio_queue = {}
         self.temp_dir = Path(tempfile.gettempdir()) / "z_waif_voice"
         self.temp_dir.mkdir(exist_ok=True)
+        self.tts_cache = TTSCache(
+            self.temp_dir / "tts_cache",
+            max_bytes=settings.DISCORD_TTS_CACHE_MAX_MB * 1024 * 1024
+        )
+        self.stream_resolver = StreamResolver(
+            max_workers=settings.DISCORD_RESOLVE_WORKERS,
+            ttl_seconds=settings.DISCORD_STREAM_URL_TTL
+        )
         
         # YouTube DL options for streaming
         self.ydl_opts = {
@@ -62,105 +70,80 @@ class DiscordVoiceHandler:
         """Play audio from URL"""
         try:
             print(f"Starting play_audio for URL: {url}")
-            
-            # Check if it's a YouTube URL
-            if 'youtube.com' in url or 'youtu.be' in url:
-                print("YouTube URL detected")
-                
-                # YouTube DL options
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'quiet': False,
-                    'no_warnings': False,
-                    'extract_audio': True,
-                    'force_generic_extractor': False,
-                    'noplaylist': True
-                }
-                
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        print("Extracting video info...")
-                        info = await asyncio.get_event_loop().run_in_executor(
-                            None, lambda: ydl.extract_info(url, download=False)
-                        )
-                        print("Info extracted successfully")
-                        
-                        if 'formats' in info:
-                            print("Selecting best audio format...")
-                            formats = [f for f in info['formats'] 
-                                     if f.get('acodec') != 'none']
-                            if not formats:
-                                formats = info['formats']
-                            
-                            stream_url = formats[0]['url']
-                            print(f"Audio stream URL selected: {stream_url}")
-                        else:
-                            stream_url = info['url']
-                            print("Using direct URL")
-                        
-                        print("Setting up FFmpeg options...")
-                        ffmpeg_options = {
-                            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-                            'options': '-vn'
-                        }
-                        
-                        print("Creating audio source...")
-                        audio_source = FFmpegPCMAudio(stream_url, **ffmpeg_options)
-                        
-                        print("Starting playback...")
-                        voice_client.play(audio_source, after=lambda e: asyncio.create_task(self.check_for_new_messages()))
-                        print("Playback started successfully")
-                        
-                except Exception as e:
-                    print(f"Error in YouTube processing: {e}")
-                    raise
-                    
-            else:
-                print("Non-YouTube URL detected")
-                audio_source = FFmpegPCMAudio(url)
-                voice_client.play(audio_source, after=lambda e: asyncio.create_task(self.check_for_new_messages()))
-                print("Direct URL playback started")
-                
+
+            # Resolved on the shared pool; instant if it was prefetched
+            stream_url = await asyncio.wrap_future(self.stream_resolver.resolve(url))
+            self.play_stream(stream_url, voice_client, after_callback)
+
         except Exception as e:
             print(f"Error in play_audio: {e}")
             raise
+
+    def play_stream(self, stream_url, voice_client, after_callback=None):
+        """Start playback of an already resolved stream URL"""
+        ffmpeg_options = {}
+        if stream_url.startswith("http"):
+            ffmpeg_options = {
+                'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+                'options': '-vn'
+            }
+
+        audio_source = FFmpegPCMAudio(stream_url, **ffmpeg_options)
+        voice_client.play(audio_source, after=after_callback)
+        print("Playback started successfully")
             
     async def text_to_speech(self, text, voice_client):
-        """Convert text to speech and play in voice channel"""
+        """Convert text to speech and play in voice channel, sentence by sentence"""
         try:
-            # Generate TTS file
-            temp_file = await self.generate_tts(text)
-            
-            # Play audio
-            source = FFmpegPCMAudio(str(temp_file))
+            loop = asyncio.get_event_loop()
+            sentences = split_sentences(text)
+            if not sentences:
+                return
+
             if voice_client.is_playing():
                 voice_client.stop()
-                
-            voice_client.play(source)
-            
-            # Wait briefly to ensure playback starts
-            await asyncio.sleep(0.5)
-            
-            # Cleanup will happen in background
-            asyncio.create_task(self.cleanup_old_files())
-            
+
+            # Synthesize the next sentence while the current one plays
+            next_file = loop.run_in_executor(None, self._cached_tts, sentences[0])
+            for i in range(len(sentences)):
+                temp_file = await next_file
+                if i + 1 < len(sentences):
+                    next_file = loop.run_in_executor(None, self._cached_tts, sentences[i + 1])
+
+                finished = asyncio.Event()
+                source = FFmpegPCMAudio(str(temp_file))
+                voice_client.play(source, after=lambda e: loop.call_soon_threadsafe(finished.set))
+                await finished.wait()
+
         except Exception as e:
             print(f"TTS Error: {e}")
             raise
-            
+
+    def _cached_tts(self, text: str) -> Path:
+        return self.tts_cache.get(text, settings.DISCORD_TTS_VOICE, settings.DISCORD_TTS_LANGUAGE)
+
     async def generate_tts(self, text: str) -> Path:
-        """Generate TTS audio file from text"""
-        tts = gTTS(text=text, lang=settings.DISCORD_TTS_LANGUAGE)
-        
-        # Save to temp file
-        temp_file = self.temp_dir / f"tts_{hash(text)}.mp3"
-        tts.save(str(temp_file))
-        
-        return temp_file
-        
+        """Generate TTS audio file from text (cached by content)"""
+        return await asyncio.get_event_loop().run_in_executor(None, self._cached_tts, text)
+
+    async def presynthesize_common_phrases(self):
+        """Warm the TTS cache with the fixed lines in Configurables/TTSPhrases.json"""
+        if not settings.DISCORD_TTS_PRESYNTHESIZE:
+            return
+
+        made = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: self.tts_cache.presynthesize(
+                load_common_phrases(), settings.DISCORD_TTS_VOICE, settings.DISCORD_TTS_LANGUAGE
+            )
+        )
+        logging.info(f"Pre-synthesized {made} TTS phrases. Cache: {self.tts_cache.stats()}")
+
+        # Old per-process files from before the cache existed
+        await self.cleanup_old_files()
+
     async def cleanup_old_files(self):
-        """Clean up old temporary files"""
-        for file in self.temp_dir.glob("*.mp3"):
+        """Clean up old temporary files (the TTS cache evicts its own)"""
+        for file in self.temp_dir.glob("tts_*.mp3"):
             if file.stat().st_mtime < (time.time() - 3600):  # Older than 1 hour
                 try:
                     file.unlink()
@@ -1,17 +1,13 @@
-import torch
-from transformers import pipeline
 import logging
+from utils.model_registry import EMOTION, infer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize the emotion recognition model
-emotion_recognizer = pipeline("text-classification", model="bhadresh-savani/bert-base-uncased-emotion")
-
 def recognize_emotion_from_text(text):
     """Recognize emotion from a given text input."""
     logging.info("Recognizing emotion from text.")
-    predictions = emotion_recognizer(text)
+    predictions = infer(EMOTION, text)
     emotion = max(predictions, key=lambda x: x['score'])
     return emotion['label']
 
@@ -279,12 +279,13 @@ def listener_timer():
         time.sleep(0.02)
 
 
-def cooldown_listener_timer():
+def cooldown_listener_timer(speaking_seconds=0.0):
     global SPEAKING_TIMER
     global SPEAKING_TIMER_COOLDOWN
 
+    # Extra seconds cover speech that is still playing
     SPEAKING_TIMER = 0
-    SPEAKING_TIMER_COOLDOWN = 0.47
+    SPEAKING_TIMER_COOLDOWN = 0.47 + speaking_seconds
 
 
 def input_change_listener_sensitivity():
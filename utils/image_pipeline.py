@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import logging
+
+import utils.settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ENCODE_CACHE_SIZE = 16
+
+# Latest frame from the camera or the image feed, kept in memory instead of LiveImage.png
+_latest_frame = None
+_frame_lock = threading.Lock()
+
+# frame hash -> base64 JPEG
+_encode_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def store_frame(image):
+    """Hold on to the newest frame for the next view_image call"""
+    global _latest_frame
+    with _frame_lock:
+        _latest_frame = image
+
+
+def get_frame():
+    with _frame_lock:
+        return _latest_frame
+
+
+def frame_hash(image, quality: int, max_dimension: int) -> str:
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.shape}|{quality}|{max_dimension}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def fit_to_dimension(image, max_dimension: int):
+    import cv2
+
+    height, width = image.shape[:2]
+    scale = max_dimension / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def encode_jpeg_b64(image, quality: Optional[int] = None, max_dimension: Optional[int] = None) -> str:
+    """JPEG-encode a frame in memory, reusing the result for an identical frame"""
+    import cv2
+
+    if quality is None:
+        quality = utils.settings.cam_jpeg_quality
+    if max_dimension is None:
+        max_dimension = utils.settings.cam_max_dimension
+
+    key = frame_hash(image, quality, max_dimension)
+    cached = _encode_cache.get(key)
+    if cached is not None:
+        _encode_cache.move_to_end(key)
+        return cached
+
+    result, buffer = cv2.imencode(".jpg", fit_to_dimension(image, max_dimension),
+                                  [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not result:
+        raise ValueError("Could not encode image as JPEG")
+
+    encoded = base64.b64encode(buffer.tobytes()).decode('utf-8')
+    _encode_cache[key] = encoded
+    while len(_encode_cache) > ENCODE_CACHE_SIZE:
+        _encode_cache.popitem(last=False)
+    return encoded
+
+
+def get_latest_jpeg_b64() -> Optional[str]:
+    image = get_frame()
+    if image is None:
+        return None
+    return encode_jpeg_b64(image)
+
+
+def benchmark_image_pipeline(frames: int = 50, width: int = 320, height: int = 240):
+    """Compare the PNG round-trip with in-memory JPEG, capture to request body and POST"""
+    import os
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import cv2
+    import numpy as np
+    import requests
+
+    class StandInVision(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            body = b'{"choices": [{"message": {"content": "A picture of a room."}}]}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInVision)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    uri = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+    rng = np.random.default_rng(7)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (9, 9), 0)
+    png_path = os.path.join(tempfile.gettempdir(), "z_waif_bench_image.png")
+    session = requests.Session()
+
+    def run(label, encode, post):
+        latencies = []
+        payload_bytes = 0
+        for i in range(frames):
+            frame = base.copy()
+            frame[i % height, :, :] = 255   # Each capture is a new frame
+            start = time.perf_counter()
+            img_str = encode(frame)
+            body = json.dumps({'messages': [{'role': 'user', 'content': f'<img src="data:image/jpeg;base64,{img_str}">'}]})
+            post(uri, data=body, headers={"Content-Type": "application/json"})
+            latencies.append(time.perf_counter() - start)
+            payload_bytes = len(body)
+        latencies.sort()
+        return {
+            'mode': label,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'payload_bytes': payload_bytes
+        }
+
+    def png_round_trip(frame):
+        cv2.imwrite(png_path, frame)
+        with open(png_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('utf-8')
+
+    results = [
+        run("png_file_new_connection", png_round_trip, requests.post),
+        run("jpeg_memory_pooled", encode_jpeg_b64, session.post),
+    ]
+
+    server.shutdown()
+    for result in results:
+        print(f"{result['mode']:>26}: p50 {result['p50_ms']:.2f} ms, "
+              f"max {result['max_ms']:.2f} ms, payload {result['payload_bytes']} bytes")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_image_pipeline()
@@ -1,9 +1,13 @@
 import logging
 from datetime import datetime
 import os
+import threading
 import time
+from collections import deque
 from functools import wraps
-from typing import Callable, Any
+from typing import Callable, Any, List, Optional, Tuple
+import utils.metrics_store
+import utils.settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,20 +21,122 @@ file_handler = logging.FileHandler('logs/app.log')
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 app_logger.addHandler(file_handler)
 
-debug_log = "General Debug log will go here!\n\nAnd here!"
-rag_log = "RAG log will go here!"
+
+
+class RingLog:
+    """A log panel's lines, holding only the newest within an entry and a byte cap.
+
+    Adding a line is O(1): lines go on a deque, and the oldest come off the
+    front once over a cap. Each line has a sequence number, so a reader can
+    ask for just what came after the last line it saw. Lines let go of (by
+    the caps or a clear) can be written out to a file instead of dropped.
+    """
+
+    def __init__(self, initial: str = "", max_entries: int = 2000, max_bytes: int = 256 * 1024,
+                 spill_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self._entries: deque = deque()
+        self._bytes = 0
+        self._first = 0         # Sequence number of the oldest line held
+        self._lock = threading.Lock()
+        self._spill = None
+        self._text = None
+        self.version = 0        # Moves on every change, clears included
+
+        if initial:
+            self.append(initial)
+
+    @property
+    def cursor(self) -> int:
+        """Sequence number the next line will get"""
+        return self._first + len(self._entries)
+
+    def append(self, text: str):
+        size = len(text.encode('utf-8'))
+        with self._lock:
+            self._entries.append((text, size))
+            self._bytes += size
+            self._text = None
+            self.version += 1
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop_oldest()
+
+    def _drop_oldest(self):
+        text, size = self._entries.popleft()
+        self._bytes -= size
+        self._first += 1
+        if self.spill_path:
+            if self._spill is None:
+                self._spill = open(self.spill_path, 'a', encoding='utf-8')
+            self._spill.write(text + "\n")
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                self._drop_oldest()
+            self._text = ""
+            self.version += 1
+            if self._spill is not None:
+                self._spill.flush()
+
+    def since(self, cursor: int) -> Tuple[List[str], int]:
+        """Lines added after cursor (or all held, if some were already let go of), and the cursor to ask from next"""
+        with self._lock:
+            return self._newest(self.cursor - max(cursor, self._first)), self.cursor
+
+    def tail(self, count: int) -> List[str]:
+        with self._lock:
+            return self._newest(count)
+
+    def _newest(self, count: int) -> List[str]:
+        # Indexing a deque from the right end costs the distance from it, so this is O(count)
+        count = min(max(count, 0), len(self._entries))
+        return [self._entries[-i][0] for i in range(count, 0, -1)]
+
+    def text(self) -> str:
+        """The whole log as one string; joined once per change, however often it is read"""
+        with self._lock:
+            if self._text is None:
+                self._text = "\n".join(text for text, _ in self._entries)
+            return self._text
+
+    def __str__(self):
+        return self.text()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def flush(self):
+        with self._lock:
+            if self._spill is not None:
+                self._spill.flush()
+
+
+def _ring_log(initial: str, spill_name: str) -> RingLog:
+    return RingLog(initial, utils.settings.log_max_entries, utils.settings.log_max_kb * 1024,
+                   os.path.join('logs', spill_name) if utils.settings.log_spill_to_disk else None)
+
+
+debug_log = _ring_log("General Debug log will go here!\n\nAnd here!", "debug.log")
+rag_log = _ring_log("RAG log will go here!", "rag.log")
 kelvin_log = "Live temperature randomness will go here!"
 
 def track_response_time(func: Callable[..., Any]) -> Callable[..., Any]:
     """Decorator to track and log the response time of a function"""
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        duration = end_time - start_time
-        log_info(f"{func.__name__} took {duration:.2f} seconds")
-        return result
+        start_time = time.perf_counter()
+        success = False
+        try:
+            result = func(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            duration = time.perf_counter() - start_time
+            utils.metrics_store.record(func.__name__, duration, success)
+            log_info(f"{func.__name__} took {duration:.2f} seconds")
     return wrapper
 
 def log_startup():
@@ -49,16 +155,13 @@ def log_error(message: str):
     update_debug_log(f"ERROR: {message}")
 
 def update_debug_log(text: str):
-    global debug_log
-    debug_log += "\n" + str(text)
+    debug_log.append(str(text))
 
 def update_rag_log(text: str):
-    global rag_log
-    rag_log += "\n" + str(text)
+    rag_log.append(str(text))
 
 def clear_rag_log():
-    global rag_log
-    rag_log = ""
+    rag_log.clear()
 
 def update_kelvin_log(text: str):
     global kelvin_log
@@ -80,3 +183,52 @@ def log_stream_status(enabled: bool):
     status = "enabled" if enabled else "disabled"
     log_info(f"Streaming mode {status}")
     update_debug_log(f"Streaming mode {status}")
+
+
+def benchmark_ring_log(turns: int = 5000, block_bytes: int = 1500, reads: int = 200):
+    """Memory and append cost over a long session, string log vs RingLog, and what a UI read costs"""
+    import tracemalloc
+
+    block = ("User: how was the stream today? " * (block_bytes // 32))[:block_bytes]
+
+    def run(label, log, add):
+        tracemalloc.start()
+        start = time.perf_counter()
+        for i in range(turns):
+            log = add(log, f"{i} {block}")
+        elapsed = time.perf_counter() - start
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{label:>9}: {elapsed / turns * 1e6:.1f} us per append, {held / (1024 * 1024):.1f} MB held after {turns} turns")
+        return log
+
+    def add_string(log, text):
+        log += "\n" + text
+        return log
+
+    def add_ring(log, text):
+        log.append(text)
+        return log
+
+    text_log = run("string +=", "", add_string)
+    ring = run("RingLog", RingLog("", utils.settings.log_max_entries, utils.settings.log_max_kb * 1024), add_ring)
+
+    # A panel re-read after each new line: the string is resent whole, the ring joins its capped text once
+    start = time.perf_counter()
+    for i in range(reads):
+        ring.append(str(i))
+        ring.text()
+    ring_us = (time.perf_counter() - start) / reads * 1e6
+
+    cursor = ring.cursor
+    start = time.perf_counter()
+    for i in range(reads):
+        ring.append(str(i))
+        _, cursor = ring.since(cursor)
+    since_us = (time.perf_counter() - start) / reads * 1e6
+
+    print(f"UI read after a new line: string sends {len(text_log) / (1024 * 1024):.1f} MB, RingLog text {len(ring.text()) / 1024:.0f} KB in {ring_us:.0f} us, since(cursor) {since_us:.1f} us")
+
+
+if __name__ == "__main__":
+    benchmark_ring_log()
@@ -1,6 +1,7 @@
-import utils.cane_lib
 import json
 import utils.logging
+import utils.tokenizer
+import utils.tracing
 import logging
 
 # Configure logging
@@ -14,6 +15,10 @@ total_lore_default = "Here is some lore about the current topic from your lorebo
 with open("Configurables/Lorebook.json", 'r') as openfile:
     LORE_BOOK = json.load(openfile)
 
+# Lowercased once at load, rather than for every message checked
+LORE_NAMES = {str.lower(lore['0']) for lore in LORE_BOOK}
+LORE_KEYWORDS = [tuple(" " + lore['0'] + ending for ending in (" ", "\'", "s", "!", ".", ",")) for lore in LORE_BOOK]
+
 
 # For retreival
 def lorebook_check(message):
@@ -27,7 +32,7 @@ def lorebook_check(message):
 
     # Search for new ones
     for lore in LORE_BOOK:
-        if utils.cane_lib.keyword_check(message, [" " + lore['0']]) and lore['2'] == 0:
+        if utils.tokenizer.contains_any(message, (" " + lore['0'],)) and lore['2'] == 0:
             # Set our lockout
             lore['2'] += 9
 
@@ -39,7 +44,30 @@ def lorebook_check(message):
 
     return "No lore!"
 
+# Which lore entries a message mentions; remembered per message, as the same history gets checked every turn
+lore_match_cache = {}
+
+
+def lore_matches(message):
+
+    matches = lore_match_cache.get(message)
+    if matches is not None:
+        return matches
+
+    matches = []
+    for index, keywords in enumerate(LORE_KEYWORDS):
+        if utils.tokenizer.contains_any(message, keywords):
+            matches.append(index)
+
+    if len(lore_match_cache) > 512:
+        lore_match_cache.clear()
+    lore_match_cache[message] = matches
+
+    return matches
+
+
 # Gathers ALL lore in a given scope (send in the message being sent, as well as any message pairs you want to check)
+@utils.tracing.traced("lore.gather")
 def lorebook_gather(messages, sent_message):
 
     # gather, gather, into reformed
@@ -58,11 +86,9 @@ def lorebook_gather(messages, sent_message):
 
     # Search every lore entry for each of the messages, and add the lore as needed
     for message in reformed_messages:
-        # Search for new ones
-        for lore in LORE_BOOK:
-            if utils.cane_lib.keyword_check(message, [" " + lore['0'] + " ", " " + lore['0'] + "\'", " " + lore['0'] + "s",
-                                                      " " + lore['0'] + "!", " " + lore['0'] + ".", " " + lore['0'] + ",", " " + lore['0'] + "!",
-                                                      ]) and lore['2'] == 0:
+        for index in lore_matches(message):
+            lore = LORE_BOOK[index]
+            if lore['2'] == 0:
 
                 total_lore += (lore['0'] + ", " + lore['1'] + "\n\n")
                 lore['2'] = 7   # lore has procced, prevent dupes
@@ -77,10 +103,5 @@ def lorebook_gather(messages, sent_message):
 
 # Check if keyword is in the lorebook
 def rag_word_check(word):
-    # Lockout clearing
-    for lore in LORE_BOOK:
-        if str.lower(lore['0']) == word:
-            return True
-
-    return False
+    return word in LORE_NAMES
 
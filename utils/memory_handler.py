@@ -1,7 +1,6 @@
-import json
-import os
 from datetime import datetime, timedelta
 import logging
+from utils.memory_store import get_memory_store, SOURCE_HANDLER
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -11,72 +10,40 @@ class MemoryHandler:
         logging.info("Initializing MemoryHandler.")
         self.platform = platform
         self.memory_file = memory_file
-        self.memories = self._load_memories()
-        self._clean_old_memories()
-        
-    def _load_memories(self):
-        if os.path.exists(self.memory_file):
-            with open(self.memory_file, 'r') as f:
-                return json.load(f)
-        return {}
-        
-    def save_memories(self):
-        with open(self.memory_file, 'w') as f:
-            json.dump(self.memories, f, indent=2)
+
+        # Shared indexed store; old JSON files are migrated into it once
+        self.store = get_memory_store()
+        self.store.migrate_json_file(memory_file)
             
     def _clean_old_memories(self):
-        current_time = datetime.now()
-        one_year_ago = current_time - timedelta(days=365)
-        
-        for user_id in list(self.memories.keys()):
-            # Filter interactions older than one year
-            self.memories[user_id]["interactions"] = [
-                interaction for interaction in self.memories[user_id]["interactions"]
-                if datetime.fromisoformat(interaction["timestamp"]) > one_year_ago
-            ]
-            
-            # Clean conversation history based on timestamps in interactions
-            if self.memories[user_id]["interactions"]:
-                recent_interactions = self.memories[user_id]["interactions"][-50:]  # Keep last 50 for context
-                self.memories[user_id]["conversation_history"] = [
-                    f"User: {interaction['content']}" 
-                    for interaction in recent_interactions
-                ]
-        
-        self.save_memories()
+        # Expiry also runs on a schedule in the store, this just forces it now
+        one_year_ago = datetime.now() - timedelta(days=365)
+        self.store.expire_before(one_year_ago.timestamp(), SOURCE_HANDLER)
     
     def update_user_memory(self, user_id, interaction_data):
         logging.info(f"Updating user memory for user: {user_id}.")
         current_time = datetime.now()
         
-        if user_id not in self.memories:
-            self.memories[user_id] = {
-                "first_seen": current_time.isoformat(),
-                "interactions": [],
-                "preferences": {},
-                "conversation_history": []
-            }
-        
         # Add new interaction
-        self.memories[user_id]["interactions"].append({
+        self.store.add_interaction(user_id, SOURCE_HANDLER, {
             "timestamp": current_time.isoformat(),
             "content": interaction_data["content"],
             "context": interaction_data.get("context", ""),
             "emotion": interaction_data.get("emotion", "")
-        })
-        
-        # Clean old memories for this user
-        self._clean_old_memories()
+        }, current_time.timestamp())
         
     def get_user_context(self, user_id):
-        if user_id not in self.memories:
+        user = self.store.get_user(user_id)
+        if user is None:
             return "This is a new user."
             
-        memory = self.memories[user_id]
-        recent_interactions = memory["conversation_history"]
+        recent_interactions = [
+            f"User: {interaction['content']}"
+            for interaction in self.store.recent(user_id, SOURCE_HANDLER, limit=50)  # Keep last 50 for context
+        ]
         return "\n".join([
             f"User history context:",
-            f"First seen: {memory['first_seen']}",
+            f"First seen: {user['first_seen']}",
             f"Recent conversation:",
             "\n".join(recent_interactions)
         ]) 
\ No newline at end of file
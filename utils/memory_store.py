@@ -0,0 +1,226 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_DB_PATH = "memory_store.db"
+RETENTION_DAYS = 365
+
+# Sources, one per module that used to keep its own JSON file
+SOURCE_HANDLER = "handler"      # utils/memory_handler.MemoryHandler
+SOURCE_MANAGER = "manager"      # memory/manager.MemoryManager
+SOURCE_CONTEXT = "context"      # utils/contextual_memory.ContextualMemory
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    preferences TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ts REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_interactions_user ON interactions (user_id, source, ts);
+CREATE INDEX IF NOT EXISTS idx_interactions_ts ON interactions (ts);
+CREATE TABLE IF NOT EXISTS migrations (
+    name TEXT PRIMARY KEY,
+    migrated_at REAL NOT NULL
+);
+"""
+
+
+def _to_timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class MemoryStore:
+    """Shared SQLite (WAL) store for per-user memories, indexed by user and time"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+        self._expiry_thread = None
+
+    def add_interaction(self, user_id: str, source: str, payload: dict, timestamp: Optional[float] = None):
+        ts = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO users (user_id, first_seen) VALUES (?, ?)", (user_id, ts)
+            )
+            self._connection.execute(
+                "INSERT INTO interactions (user_id, source, ts, payload) VALUES (?, ?, ?, ?)",
+                (user_id, source, ts, json.dumps(payload, default=str))
+            )
+            self._connection.commit()
+
+    def recent(self, user_id: str, source: str, limit: Optional[int] = None) -> List[dict]:
+        """Newest-last interactions for a user, read through the (user, source, ts) index"""
+        query = "SELECT payload FROM interactions WHERE user_id = ? AND source = ? ORDER BY ts DESC"
+        params = [user_id, source]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def last_timestamp(self, user_id: str, source: str) -> Optional[float]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT MAX(ts) FROM interactions WHERE user_id = ? AND source = ?", (user_id, source)
+            ).fetchone()
+        return row[0]
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT first_seen, preferences FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'first_seen': datetime.fromtimestamp(row[0]).isoformat(),
+            'preferences': json.loads(row[1])
+        }
+
+    def delete_user_source(self, user_id: str, source: str):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM interactions WHERE user_id = ? AND source = ?", (user_id, source)
+            )
+            self._connection.commit()
+
+    def expire_before(self, cutoff: float, source: Optional[str] = None) -> int:
+        """Indexed range delete of everything older than the cutoff"""
+        with self._lock:
+            if source is None:
+                cursor = self._connection.execute("DELETE FROM interactions WHERE ts < ?", (cutoff,))
+            else:
+                cursor = self._connection.execute(
+                    "DELETE FROM interactions WHERE ts < ? AND source = ?", (cutoff, source)
+                )
+            self._connection.commit()
+        return cursor.rowcount
+
+    def expire_idle_users(self, cutoff: float, source: str) -> int:
+        """Drop everything a user has under a source when none of it is newer than the cutoff"""
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM interactions WHERE source = ? AND user_id IN "
+                "(SELECT user_id FROM interactions WHERE source = ? GROUP BY user_id HAVING MAX(ts) < ?)",
+                (source, source, cutoff)
+            )
+            self._connection.commit()
+        return cursor.rowcount
+
+    def start_expiry_schedule(self, interval_seconds: float, retention_days: int = RETENTION_DAYS,
+                              source: str = SOURCE_HANDLER):
+        """Expire old memories in the background, instead of on every interaction.
+
+        Only the handler's interactions ever expired by age; the manager keeps
+        its history, and contexts go a whole user at a time (prune_old_context).
+        """
+        if self._expiry_thread is not None:
+            return
+
+        def expiry_loop():
+            while True:
+                removed = self.expire_before(time.time() - retention_days * 86400, source)
+                if removed:
+                    logging.info(f"Expired {removed} memories older than {retention_days} days")
+                time.sleep(interval_seconds)
+
+        self._expiry_thread = threading.Thread(target=expiry_loop, daemon=True)
+        self._expiry_thread.start()
+
+    #
+    # Migration from the old whole-file JSON stores
+    #
+
+    def _migrated(self, name: str) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT 1 FROM migrations WHERE name = ?", (name,)
+            ).fetchone() is not None
+
+    def migrate_json_file(self, path: str) -> int:
+        """Import one of the old JSON memory files, once; returns rows imported"""
+        name = os.path.abspath(path)
+        if not os.path.isfile(path) or self._migrated(name):
+            return 0
+
+        with open(path, 'r') as openfile:
+            old_memories = json.load(openfile)
+
+        rows = []
+        users = []
+        for user_id, record in old_memories.items():
+            first_seen = record.get('first_seen') or record.get('first_interaction') or record.get('last_updated')
+            users.append((user_id, _to_timestamp(first_seen), json.dumps(record.get('preferences', {}))))
+
+            for interaction in record.get('interactions', []):
+                # The handler and the manager shared a file name, but not a schema
+                source = SOURCE_HANDLER if 'content' in interaction else SOURCE_MANAGER
+                rows.append((user_id, source, _to_timestamp(interaction.get('timestamp')), json.dumps(interaction)))
+
+            for context in record.get('context', []):
+                timestamp = context.get('timestamp') if isinstance(context, dict) else None
+                rows.append((user_id, SOURCE_CONTEXT, _to_timestamp(timestamp or record.get('last_updated')), json.dumps(context)))
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO users (user_id, first_seen, preferences) VALUES (?, ?, ?)", users
+            )
+            self._connection.executemany(
+                "INSERT INTO interactions (user_id, source, ts, payload) VALUES (?, ?, ?, ?)", rows
+            )
+            self._connection.execute(
+                "INSERT INTO migrations (name, migrated_at) VALUES (?, ?)", (name, time.time())
+            )
+            self._connection.commit()
+
+        logging.info(f"Migrated {len(rows)} memories from {path}")
+        return len(rows)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store(db_path: str = DEFAULT_DB_PATH) -> MemoryStore:
+    """The one store everyone shares; migrates the old JSON files on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MemoryStore(db_path)
+            for old_file in ("user_memories.json", "user_context_memory.json"):
+                try:
+                    _store.migrate_json_file(old_file)
+                except (OSError, ValueError) as e:
+                    logging.error(f"Could not migrate {old_file}: {e}")
+
+            cleanup_minutes = float(os.environ.get("MEMORY_CLEANUP_FREQUENCY", "60").split("#")[0].strip() or 60)
+            _store.start_expiry_schedule(cleanup_minutes * 60)
+        return _store
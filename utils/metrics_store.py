@@ -0,0 +1,270 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Log-linear buckets over microseconds: exact below 64 us, then 32 per power of
+# two (about 3% error) up to 2^32 us, a little over an hour
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_MICROSECONDS = (1 << 32) - 1
+
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 3600
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def bucket_index(microseconds: int) -> int:
+    value = min(max(int(microseconds), 0), MAX_MICROSECONDS)
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - (SUB_BUCKET_BITS + 1)
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_value(index: int) -> float:
+    """Midpoint of a bucket, in microseconds"""
+    if index < 2 * SUB_BUCKETS:
+        return float(index)
+    shift = index // SUB_BUCKETS - 1
+    lower = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+    return lower + (1 << shift) / 2
+
+
+class LatencyHistogram:
+    """Sparse fixed-bucket histogram; recording is one dict increment"""
+
+    __slots__ = ('counts', 'count', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float, success: bool = True):
+        index = bucket_index(seconds * 1e6)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if not success:
+            self.errors += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantiles(self, quantiles: Iterable[float] = QUANTILES) -> List[float]:
+        """Values in seconds at each quantile"""
+        wanted = sorted(quantiles)
+        results = {}
+        if not self.count:
+            return [0.0 for _ in quantiles]
+
+        seen = 0
+        position = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while position < len(wanted) and seen >= wanted[position] * self.count:
+                results[wanted[position]] = bucket_value(index) / 1e6
+                position += 1
+            if position == len(wanted):
+                break
+        return [min(results.get(q, self.max), self.max) for q in quantiles]
+
+
+class RollingSeries:
+    """One function's histograms, one per time window, dropped past retention"""
+
+    def __init__(self, window_seconds: float, retention_seconds: float):
+        self.window_seconds = window_seconds
+        self.max_windows = max(1, int(retention_seconds // window_seconds))
+        self.windows: "OrderedDict[int, LatencyHistogram]" = OrderedDict()
+
+    def record(self, seconds: float, success: bool, now: float):
+        window = int(now // self.window_seconds)
+        histogram = self.windows.get(window)
+        if histogram is None:
+            histogram = self.windows[window] = LatencyHistogram()
+            while len(self.windows) > self.max_windows:
+                self.windows.popitem(last=False)
+        histogram.record(seconds, success)
+
+    def merged(self, since: float) -> LatencyHistogram:
+        first_window = int(since // self.window_seconds)
+        merged = LatencyHistogram()
+        for window in reversed(self.windows):
+            if window < first_window:
+                break
+            merged.merge(self.windows[window])
+        return merged
+
+
+class MetricsStore:
+    """Latency percentiles per function over rolling time windows"""
+
+    def __init__(self, window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 retention_seconds: float = DEFAULT_RETENTION_SECONDS):
+        self.window_seconds = window_seconds
+        self.retention_seconds = retention_seconds
+        self.series: Dict[str, RollingSeries] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, success: bool = True, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = RollingSeries(self.window_seconds, self.retention_seconds)
+            series.record(seconds, success, now)
+
+    def histogram(self, name: str, window_seconds: float = 3600) -> LatencyHistogram:
+        with self._lock:
+            series = self.series.get(name)
+            if series is None:
+                return LatencyHistogram()
+            return series.merged(time.time() - window_seconds)
+
+    def summary(self, window_seconds: float = 3600) -> Dict[str, dict]:
+        """count, error rate, mean, p50/p95/p99 and max (seconds) per function"""
+        summary = {}
+        for name in list(self.series):
+            histogram = self.histogram(name, window_seconds)
+            if not histogram.count:
+                continue
+            p50, p95, p99 = histogram.quantiles(QUANTILES)
+            summary[name] = {
+                'count': histogram.count,
+                'error_rate': histogram.errors / histogram.count,
+                'mean': histogram.total / histogram.count,
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'max': histogram.max
+            }
+        return summary
+
+    def export(self, window_seconds: float = 3600) -> dict:
+        return {
+            'generated_at': time.time(),
+            'window_seconds': window_seconds,
+            'functions': self.summary(window_seconds)
+        }
+
+    def export_prometheus(self, window_seconds: float = 3600) -> str:
+        lines = ["# TYPE z_waif_latency_seconds summary"]
+        for name, stats in self.summary(window_seconds).items():
+            for key, quantile in (('p50', '0.5'), ('p95', '0.95'), ('p99', '0.99')):
+                lines.append(f'z_waif_latency_seconds{{function="{name}",quantile="{quantile}"}} {stats[key]:.6f}')
+            lines.append(f'z_waif_latency_seconds_count{{function="{name}"}} {stats["count"]}')
+            lines.append(f'z_waif_latency_seconds_sum{{function="{name}"}} {stats["mean"] * stats["count"]:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+_store = MetricsStore()
+
+
+def get_metrics_store() -> MetricsStore:
+    return _store
+
+
+def record(name: str, seconds: float, success: bool = True):
+    _store.record(name, seconds, success)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Export endpoint: GET /metrics (Prometheus text) or /metrics.json?window=seconds"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            window = 3600.0
+            for pair in query.split("&"):
+                key, _, value = pair.partition("=")
+                if key == "window" and value:
+                    try:
+                        window = float(value)
+                    except ValueError:
+                        pass
+
+            if path == "/metrics":
+                body = _store.export_prometheus(window).encode('utf-8')
+                content_type = "text/plain; version=0.0.4"
+            elif path == "/metrics.json":
+                body = json.dumps(_store.export(window), indent=2).encode('utf-8')
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Metrics export on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def benchmark_metrics_store(functions: int = 20, samples: int = 200000):
+    """Record cost as history grows, old list-and-cleanup tracker vs the histogram store"""
+    import random
+    from datetime import datetime, timedelta
+
+    rng = random.Random(7)
+    names = [f"function_{i}" for i in range(functions)]
+    latencies = [rng.lognormvariate(-3, 1) for _ in range(samples)]
+
+    # The old PerformanceTracker: append, then rebuild every list on every record
+    history = {name: [] for name in names}
+    cutoff_age = timedelta(days=7)
+    old_samples = 4000
+    start = time.perf_counter()
+    for i in range(old_samples):
+        history[names[i % functions]].append((latencies[i], datetime.now()))
+        cutoff = datetime.now() - cutoff_age
+        for name in history:
+            history[name] = [m for m in history[name] if m[1] > cutoff]
+    old_us = (time.perf_counter() - start) / old_samples * 1e6
+
+    store = MetricsStore()
+    start = time.perf_counter()
+    for i, latency in enumerate(latencies):
+        store.record(names[i % functions], latency)
+    new_us = (time.perf_counter() - start) / samples * 1e6
+
+    start = time.perf_counter()
+    summary = store.summary()
+    summary_ms = (time.perf_counter() - start) * 1000
+
+    exact = sorted(latencies[0::functions])
+    stats = summary[names[0]]
+    print(f"old record: {old_us:.1f} us/sample by {old_samples} samples, and growing with history")
+    print(f"histogram record: {new_us:.2f} us/sample over {samples} samples")
+    print(f"summary of {functions} functions: {summary_ms:.2f} ms")
+    for label, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        actual = exact[int(q * (len(exact) - 1))]
+        print(f"  {label}: {stats[label] * 1000:.2f} ms (exact {actual * 1000:.2f} ms)")
+
+
+if __name__ == "__main__":
+    benchmark_metrics_store()
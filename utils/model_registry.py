@@ -0,0 +1,310 @@
+import gc
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+import logging
+
+import utils.settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Registered model names
+TEXT_GENERATION = "text-generation"
+EMOTION = "emotion"
+
+EMOTION_MODEL = "bhadresh-savani/bert-base-uncased-emotion"
+
+
+def _device() -> int:
+    torch = sys.modules.get("torch")
+    if torch is None:
+        import torch
+    return 0 if torch.cuda.is_available() else -1
+
+
+def _load_text_generation():
+    from transformers import pipeline
+    return pipeline('text-generation', device=_device())
+
+
+def _load_emotion():
+    from transformers import pipeline
+    return pipeline("text-classification", model=EMOTION_MODEL, device=_device())
+
+
+def model_bytes(model) -> int:
+    """Parameter and buffer bytes of a transformers pipeline (or bare torch module)"""
+    module = getattr(model, 'model', model)
+    if not hasattr(module, 'parameters'):
+        return 0
+
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    factory: Callable[[], Any]
+    model: Any = None
+    bytes: int = 0
+    loads: int = 0
+    calls: int = 0
+    in_use: int = 0
+    last_used: float = 0.0
+    load_seconds: float = 0.0
+    pinned: bool = False
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Loads each pipeline once, on first use, and unloads it again when idle.
+
+    Loaded models are accounted by their parameter bytes; with a memory budget
+    set, idle models are evicted least-recently-used first to make room.
+    """
+
+    def __init__(self, memory_budget_bytes: int = 0, idle_seconds: float = 0):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_seconds = idle_seconds
+        self._entries: Dict[str, ModelEntry] = {}
+        self._queues: Dict[str, "BatchedInferenceQueue"] = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def register(self, name: str, factory: Callable[[], Any], pinned: bool = False):
+        """Add a model by name; a pinned one is never unloaded for being idle or over budget"""
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = ModelEntry(name, factory, pinned=pinned)
+
+    def acquire(self, name: str):
+        """The loaded model, pinned against unloading until release()"""
+        entry = self._entries[name]
+        with entry.lock:
+            if entry.model is None:
+                start = time.perf_counter()
+                entry.model = entry.factory()
+                entry.load_seconds = time.perf_counter() - start
+                entry.bytes = model_bytes(entry.model)
+                entry.loads += 1
+                logging.info(f"Loaded model '{name}' in {entry.load_seconds:.1f}s "
+                             f"({entry.bytes / (1024 * 1024):.0f} MB)")
+            entry.in_use += 1
+            entry.calls += 1
+            entry.last_used = time.monotonic()
+            model = entry.model
+
+        self._enforce_budget(keep=name)
+        return model
+
+    def release(self, name: str):
+        entry = self._entries[name]
+        with entry.lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    def loaded_bytes(self) -> int:
+        return sum(entry.bytes for entry in self._entries.values() if entry.model is not None)
+
+    def unload(self, name: str) -> bool:
+        entry = self._entries[name]
+        with entry.lock:
+            if entry.model is None or entry.in_use:
+                return False
+            entry.model = None
+            freed = entry.bytes
+            entry.bytes = 0
+
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        logging.info(f"Unloaded model '{name}', freed {freed / (1024 * 1024):.0f} MB")
+        return True
+
+    def unload_idle(self, idle_seconds: float) -> List[str]:
+        now = time.monotonic()
+        idle = [entry.name for entry in self._entries.values()
+                if entry.model is not None and not entry.pinned and not entry.in_use
+                and now - entry.last_used >= idle_seconds]
+        return [name for name in idle if self.unload(name)]
+
+    def _enforce_budget(self, keep: str):
+        if not self.memory_budget_bytes:
+            return
+
+        candidates = sorted((entry for entry in self._entries.values()
+                             if entry.model is not None and not entry.pinned and entry.name != keep),
+                            key=lambda entry: entry.last_used)
+        for entry in candidates:
+            if self.loaded_bytes() <= self.memory_budget_bytes:
+                break
+            self.unload(entry.name)
+
+    def start_idle_reaper(self, interval_seconds: float = 60):
+        if self._reaper is not None or not self.idle_seconds:
+            return
+
+        def reap_loop():
+            while True:
+                time.sleep(interval_seconds)
+                self.unload_idle(self.idle_seconds)
+
+        self._reaper = threading.Thread(target=reap_loop, daemon=True)
+        self._reaper.start()
+
+    def queue(self, name: str) -> "BatchedInferenceQueue":
+        with self._lock:
+            if name not in self._queues:
+                self._queues[name] = BatchedInferenceQueue(self, name,
+                                                           max_batch=utils.settings.model_batch_size,
+                                                           max_wait=utils.settings.model_batch_wait)
+            return self._queues[name]
+
+    def infer(self, name: str, inputs: str, **kwargs):
+        """Run one input through the named model, batched with concurrent callers"""
+        return self.queue(name).submit(inputs, **kwargs).result()
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            entry.name: {
+                'loaded': entry.model is not None,
+                'megabytes': round(entry.bytes / (1024 * 1024), 1),
+                'loads': entry.loads,
+                'calls': entry.calls,
+                'load_seconds': round(entry.load_seconds, 2)
+            }
+            for entry in self._entries.values()
+        }
+
+
+class BatchedInferenceQueue:
+    """Collects concurrent requests for one model and runs them as a single batch"""
+
+    def __init__(self, registry: ModelRegistry, name: str, max_batch: int = 8, max_wait: float = 0.02):
+        self.registry = registry
+        self.name = name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, inputs: str, **kwargs) -> Future:
+        future = Future()
+        self._requests.put((inputs, kwargs, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # Only requests with the same generation arguments can share a call
+            groups: Dict[tuple, list] = {}
+            for request in batch:
+                groups.setdefault(tuple(sorted(request[1].items())), []).append(request)
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, group: list):
+        try:
+            model = self.registry.acquire(self.name)
+        except Exception as e:
+            logging.error(f"Could not load model '{self.name}': {e}")
+            for _, _, future in group:
+                future.set_exception(e)
+            return
+
+        try:
+            outputs = model([inputs for inputs, _, _ in group], **group[0][1])
+            self.batches += 1
+            for (_, _, future), output in zip(group, outputs):
+                # A single-input call returns a list; keep callers seeing that shape
+                future.set_result(output if isinstance(output, list) else [output])
+        except Exception as e:
+            logging.error(f"Inference on '{self.name}' failed: {e}")
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.registry.release(self.name)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(memory_budget_bytes=utils.settings.model_memory_budget_mb * 1024 * 1024,
+                                      idle_seconds=utils.settings.model_idle_unload_seconds)
+            _registry.register(TEXT_GENERATION, _load_text_generation)
+            _registry.register(EMOTION, _load_emotion)
+            _registry.start_idle_reaper()
+        return _registry
+
+
+def infer(name: str, inputs: str, **kwargs):
+    return get_model_registry().infer(name, inputs, **kwargs)
+
+
+def benchmark_model_registry(requests: int = 16, load_seconds: float = 1.0, batch_seconds: float = 0.05):
+    """Per-call pipeline construction vs the registry, with a stand-in model"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    class StandInPipeline:
+        def __call__(self, inputs, **kwargs):
+            time.sleep(batch_seconds)     # Roughly flat cost per batch on a GPU
+            if isinstance(inputs, list):
+                return [[{'generated_text': text}] for text in inputs]
+            return [{'generated_text': inputs}]
+
+    def load():
+        time.sleep(load_seconds)
+        return StandInPipeline()
+
+    prompts = [f"prompt {i}" for i in range(requests)]
+
+    start = time.perf_counter()
+    for prompt in prompts[:4]:
+        load()(prompt, max_length=150)
+    per_call = (time.perf_counter() - start) / 4
+
+    registry = ModelRegistry()
+    registry.register("stand-in", load)
+    registry.infer("stand-in", "warm up", max_length=150)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=requests) as pool:
+        list(pool.map(lambda prompt: registry.infer("stand-in", prompt, max_length=150), prompts))
+    batched = (time.perf_counter() - start) / requests
+
+    print(f"pipeline per call: {per_call * 1000:.0f} ms per response")
+    print(f"registry, batched: {batched * 1000:.1f} ms per response "
+          f"({registry.queue('stand-in').batches} batches, {registry.stats()['stand-in']['loads']} load)")
+    return {'per_call_ms': per_call * 1000, 'batched_ms': batched * 1000}
+
+
+if __name__ == "__main__":
+    benchmark_model_registry()
@@ -18,6 +18,7 @@ class PerformanceDashboard:
         cutoff_time = datetime.now() - time_window
         summary = {
             'response_times': {},
+            'latency_percentiles': {},
             'resource_usage': {
                 'cpu': [],
                 'memory': []
@@ -25,14 +26,16 @@ class PerformanceDashboard:
             'error_rates': {}
         }
         
-        # Analyze response times
-        for func_name, metrics in self.performance_tracker.metrics_history.items():
-            recent_metrics = [m for m in metrics if m.timestamp > cutoff_time]
-            if recent_metrics:
-                avg_response = sum(m.response_time for m in recent_metrics) / len(recent_metrics)
-                error_rate = len([m for m in recent_metrics if not m.success]) / len(recent_metrics)
-                summary['response_times'][func_name] = avg_response
-                summary['error_rates'][func_name] = error_rate
+        # Response times, read off the tracker's windowed histograms
+        for func_name, stats in self.performance_tracker.store.summary(time_window.total_seconds()).items():
+            summary['response_times'][func_name] = stats['mean']
+            summary['error_rates'][func_name] = stats['error_rate']
+            summary['latency_percentiles'][func_name] = {
+                'p50': stats['p50'],
+                'p95': stats['p95'],
+                'p99': stats['p99'],
+                'count': stats['count']
+            }
                 
         # Add resource usage data
         for component, stats in self.resource_monitor.stats_history.items():
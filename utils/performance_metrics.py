@@ -1,10 +1,13 @@
 import psutil
 import time
 import logging
+import asyncio
 import threading
+from functools import wraps
 from collections import deque
 import datetime
 import os
+import utils.metrics_store
 
 # Configure logging
 logging.basicConfig(
@@ -19,15 +22,37 @@ cpu_history = deque(maxlen=MAX_POINTS)
 memory_history = deque(maxlen=MAX_POINTS)
 time_history = deque(maxlen=MAX_POINTS)
 
+def _record_performance(func, start_time, success):
+    elapsed_time = time.perf_counter() - start_time
+    utils.metrics_store.record(func.__name__, elapsed_time, success)
+    logging.info(f"Function '{func.__name__}' took {elapsed_time:.4f} seconds")
+
 def track_performance(func):
     """Decorator to track function performance"""
+    if asyncio.iscoroutinefunction(func):
+        # Time the awaited call, not just the creation of the coroutine
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            success = False
+            try:
+                result = await func(*args, **kwargs)
+                success = True
+                return result
+            finally:
+                _record_performance(func, start_time, success)
+        return async_wrapper
+
+    @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logging.info(f"Function '{func.__name__}' took {elapsed_time:.4f} seconds")
-        return result
+        start_time = time.perf_counter()
+        success = False
+        try:
+            result = func(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            _record_performance(func, start_time, success)
     return wrapper
 
 def get_system_metrics():
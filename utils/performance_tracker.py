@@ -1,9 +1,10 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional
 import time
 import logging
 from functools import wraps
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from utils.metrics_store import MetricsStore, get_metrics_store
 
 @dataclass
 class PerformanceMetrics:
@@ -13,8 +14,9 @@ class PerformanceMetrics:
     success: bool
 
 class PerformanceTracker:
-    def __init__(self, history_retention_days: int = 7):
-        self.metrics_history: Dict[str, List[PerformanceMetrics]] = {}
+    def __init__(self, history_retention_days: int = 7, store: Optional[MetricsStore] = None):
+        # Histograms in rolling windows; old windows fall off, no per-record cleanup pass
+        self.store = store or get_metrics_store()
         self.retention_period = timedelta(days=history_retention_days)
         
     def track_performance(self):
@@ -36,26 +38,11 @@ class PerformanceTracker:
         return decorator
         
     def _record_metrics(self, function_name: str, response_time: float, success: bool):
-        if function_name not in self.metrics_history:
-            self.metrics_history[function_name] = []
-            
-        self.metrics_history[function_name].append(
-            PerformanceMetrics(
-                response_time=response_time,
-                timestamp=datetime.now(),
-                function_name=function_name,
-                success=success
-            )
-        )
-        self._cleanup_old_metrics()
+        self.store.record(function_name, response_time, success)
         
         if response_time > 1.0:  # Alert on slow responses
             logging.warning(f"Slow response time in {function_name}: {response_time:.2f}s")
-            
-    def _cleanup_old_metrics(self):
-        cutoff_time = datetime.now() - self.retention_period
-        for func_name in self.metrics_history:
-            self.metrics_history[func_name] = [
-                metric for metric in self.metrics_history[func_name]
-                if metric.timestamp > cutoff_time
-            ]
\ No newline at end of file
+
+    def get_percentiles(self, function_name: str, window: timedelta = timedelta(hours=1)) -> Dict[str, float]:
+        p50, p95, p99 = self.store.histogram(function_name, window.total_seconds()).quantiles((0.5, 0.95, 0.99))
+        return {'p50': p50, 'p95': p95, 'p99': p99}
\ No newline at end of file
@@ -4,14 +4,18 @@ import numpy as np
 from datetime import datetime, timedelta
 import json
 import os
-from collections import deque, defaultdict
+import math
+import atexit
+import threading
+import time
+from collections import Counter, defaultdict
 from dataclasses import dataclass, field
 import logging
-import asyncio
 from contextlib import contextmanager
 from scipy.stats import norm
 from utils.vtuber_integration import VTuberIntegration
-from utils.error_boundary import ErrorBoundary
+
+STATE_FILE = 'personality_state.json'
 
 class PersonalityDimension(Enum):
     EXTRAVERSION = auto()
@@ -50,12 +54,144 @@ class InteractionEvent:
     creativity_score: float = 0.0
     empathy_score: float = 0.0
 
-@ErrorBoundary.system()
+class RunningStats:
+    """Mean and variance over a sliding window, updated in O(1) as values enter and leave"""
+
+    __slots__ = ('count', 'mean', '_m2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def remove(self, value: float) -> None:
+        if self.count <= 1:
+            self.count, self.mean, self._m2 = 0, 0.0, 0.0
+            return
+        count = self.count - 1
+        mean = (self.count * self.mean - value) / count
+        self._m2 -= (value - self.mean) * (value - mean)
+        self.count, self.mean = count, mean
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(max(self._m2, 0.0) / self.count) if self.count else 0.0
+
+class InteractionColumns:
+    """Fixed-size ring buffer of interaction history, stored as one array per field"""
+
+    NUMERIC = ('timestamp', 'response_time', 'word_count', 'sentiment', 'score',
+               'depth', 'coherence', 'resonance')
+
+    def __init__(self, capacity: int, extra_columns: Tuple[str, ...] = ()):
+        self.capacity = capacity
+        self.size = 0
+        self._next = 0
+        self._numeric = {name: np.zeros(capacity) for name in self.NUMERIC + tuple(extra_columns)}
+        self._emotions: List[Optional[str]] = [None] * capacity
+        self._tags: List[frozenset] = [frozenset()] * capacity
+
+    def append(self, row: Dict[str, float], emotion: str, tags: frozenset) -> Optional[Dict[str, Any]]:
+        """Store a row; returns the row it overwrote once the buffer is full"""
+        i = self._next
+        evicted = None
+        if self.size == self.capacity:
+            evicted = {name: float(column[i]) for name, column in self._numeric.items()}
+            evicted['emotion'] = self._emotions[i]
+            evicted['tags'] = self._tags[i]
+        else:
+            self.size += 1
+
+        for name, column in self._numeric.items():
+            column[i] = row.get(name, 0.0)
+        self._emotions[i] = emotion
+        self._tags[i] = tags
+        self._next = (i + 1) % self.capacity
+        return evicted
+
+    def _order(self, values):
+        if self.size < self.capacity:
+            return values[:self.size]
+        if isinstance(values, np.ndarray):
+            return np.concatenate((values[self._next:], values[:self._next]))
+        return values[self._next:] + values[:self._next]
+
+    def column(self, name: str) -> np.ndarray:
+        """Oldest-first copy of one column"""
+        return np.array(self._order(self._numeric[name]))
+
+    def tail(self, name: str, n: int) -> np.ndarray:
+        return self.column(name)[-n:] if n else np.zeros(0)
+
+    def emotions(self) -> List[str]:
+        return list(self._order(self._emotions))
+
+    def __len__(self) -> int:
+        return self.size
+
+class DebouncedStatePersister:
+    """Writes state on a background thread, at most once per delay however often it changes"""
+
+    def __init__(self, path: str, snapshot, delay: float = 2.0):
+        self.path = path
+        self.snapshot = snapshot
+        self.delay = delay
+        self.writes = 0
+        self._pending = False
+        self._dirty = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def mark_dirty(self) -> None:
+        self._pending = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._dirty.set()
+
+    def _run(self) -> None:
+        while True:
+            self._dirty.wait()
+            time.sleep(self.delay)     # Let a burst of changes land in one write
+            self._dirty.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            self._pending = False
+            try:
+                state = self.snapshot()
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(state, f, indent=2)
+                os.replace(temp_path, self.path)
+                self.writes += 1
+            except Exception as e:
+                logging.error(f"Failed to save personality state: {e}")
+
 class PersonalityMetricsManager:
-    def __init__(self, history_length: int = 1000):
+    """Personality weights plus interaction statistics kept up to date per event.
+
+    Each interaction is scored once on arrival; depth, coherence and resonance
+    feed running window statistics and the emotion and tag counters, so the
+    dashboard reads aggregates instead of rescanning the history.
+    """
+
+    def __init__(self, history_length: int = 1000, save_delay: float = 2.0):
         self.history_length = history_length
-        self.interaction_history: deque = deque(maxlen=history_length)
-        self.personality_states: deque = deque(maxlen=history_length)
+        self.history = InteractionColumns(
+            history_length,
+            extra_columns=tuple(f'weight_{dim.name}' for dim in PersonalityDimension)
+        )
         self.profile = PersonalityProfile()
         self.context_history: Dict[str, List[InteractionEvent]] = defaultdict(list)
         self.topic_memory: Dict[str, float] = defaultdict(float)
@@ -70,6 +206,21 @@ class PersonalityMetricsManager:
             'personality_shift_momentum': 0.8
         }
         
+        # Running aggregates over the history window
+        self.pattern_stats = {
+            'depth': RunningStats(),
+            'coherence': RunningStats(),
+            'resonance': RunningStats()
+        }
+        self.emotion_counts: Counter = Counter()
+        self.tag_counts: Counter = Counter()
+
+        # Bumped per event; derived views are rebuilt only when it changes
+        self.version = 0
+        self._views: Dict[str, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+        self._persister = DebouncedStatePersister(STATE_FILE, self._state_snapshot, save_delay)
+
         self.metrics = {}
         # Don't call load_state directly in __init__
         self.initialized = False
@@ -77,32 +228,21 @@ class PersonalityMetricsManager:
     async def initialize(self):
         """Async initialization method"""
         if not self.initialized:
-            await self.load_state()
+            self.load_state()
             self.initialized = True
 
-    async def analyze_interaction_patterns(self) -> Dict[str, Any]:
-        """Analyze complex interaction patterns asynchronously"""
-        patterns = defaultdict(list)
-        
-        for event in self.interaction_history:
-            # Analyze conversation depth
-            depth_score = self._calculate_conversation_depth(event)
-            patterns['depth'].append(depth_score)
-            
-            # Analyze topic coherence
-            coherence = self._calculate_topic_coherence(event)
-            patterns['coherence'].append(coherence)
-            
-            # Track emotional resonance
-            emotional_score = self._calculate_emotional_resonance(event)
-            patterns['emotional_resonance'].append(emotional_score)
-        
+    def interaction_patterns(self) -> Dict[str, float]:
+        """Window aggregates, maintained as events arrive"""
         return {
-            'depth_trend': np.mean(patterns['depth']),
-            'coherence_stability': np.std(patterns['coherence']),
-            'emotional_connection': np.mean(patterns['emotional_resonance'])
+            'depth_trend': self.pattern_stats['depth'].mean,
+            'coherence_stability': self.pattern_stats['coherence'].std,
+            'emotional_connection': self.pattern_stats['resonance'].mean
         }
 
+    async def analyze_interaction_patterns(self) -> Dict[str, Any]:
+        """Analyze complex interaction patterns asynchronously"""
+        return self.interaction_patterns()
+
     def _calculate_conversation_depth(self, event: InteractionEvent) -> float:
         """Calculate conversation depth based on context and complexity"""
         factors = [
@@ -111,7 +251,7 @@ class PersonalityMetricsManager:
             event.topic_coherence * 0.3,
             (event.creativity_score + event.empathy_score) * 0.2
         ]
-        return np.mean(factors)
+        return sum(factors) / len(factors)
 
     def _calculate_topic_coherence(self, event: InteractionEvent) -> float:
         """Evaluate topic consistency and development"""
@@ -138,6 +278,12 @@ class PersonalityMetricsManager:
         emotional_consistency = len([e for e in recent_emotions if e == current_emotion]) / len(recent_emotions)
         return emotional_consistency * event.empathy_score
 
+    @staticmethod
+    def _event_score(event: InteractionEvent) -> float:
+        return (0.4 * (1 - min(event.response_time / 5.0, 1.0)) +  # Response speed
+                0.3 * event.sentiment_score +                       # Sentiment
+                0.3 * min(event.word_count / 50.0, 1.0))           # Engagement
+
     @contextmanager
     def personality_adaptation_context(self, context_tags: Set[str]):
         """Context manager for temporary personality adaptations"""
@@ -180,7 +326,7 @@ class PersonalityMetricsManager:
     def load_state(self) -> None:
         """Load personality state from disk with error handling"""
         try:
-            with open('personality_state.json', 'r') as f:
+            with open(STATE_FILE, 'r') as f:
                 state = json.load(f)
                 self.profile.base_weights = {
                     PersonalityDimension(k): float(v) 
@@ -195,30 +341,65 @@ class PersonalityMetricsManager:
             logging.error(f"Unexpected error loading personality state: {e}")
             self._initialize_default_weights()
 
-    @ErrorBoundary.component()
+    def _state_snapshot(self) -> Dict[str, Any]:
+        return {
+            'base_weights': {k.value: float(v) for k, v in self.profile.base_weights.items()},
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def request_save(self) -> None:
+        """Schedule a write; changes within the save delay share one"""
+        self._persister.mark_dirty()
+
     def save_state(self) -> None:
-        """Save personality state to disk with error handling"""
-        try:
-            state = {
-                'base_weights': {k.value: float(v) for k, v in self.profile.base_weights.items()},
-                'timestamp': datetime.now().isoformat()
-            }
-            with open('personality_state.json', 'w') as f:
-                json.dump(state, f, indent=2)
-        except Exception as e:
-            logging.error(f"Failed to save personality state: {e}")
+        """Save personality state to disk now"""
+        self._persister.mark_dirty()
+        self._persister.flush()
 
-    @ErrorBoundary.component()
     def add_interaction(self, event: InteractionEvent) -> None:
         """Process and store a new interaction event with error handling"""
         try:
-            self.interaction_history.append(event)
             self._update_personality_weights(event)
-            self.save_state()
+
+            # Score the event once, on the way in
+            row = {
+                'timestamp': event.timestamp.timestamp(),
+                'response_time': event.response_time,
+                'word_count': event.word_count,
+                'sentiment': event.sentiment_score,
+                'score': self._event_score(event),
+                'depth': self._calculate_conversation_depth(event),
+                'coherence': self._calculate_topic_coherence(event),
+                'resonance': self._calculate_emotional_resonance(event)
+            }
+            for dim in PersonalityDimension:
+                row[f'weight_{dim.name}'] = float(self.profile.base_weights[dim])
+            tags = frozenset(event.context_tags)
+
+            with self._lock:
+                evicted = self.history.append(row, event.emotion, tags)
+                for name, stats in self.pattern_stats.items():
+                    stats.add(row[name])
+                self.emotion_counts[event.emotion] += 1
+                self.tag_counts.update(tags)
+
+                if evicted is not None:
+                    for name, stats in self.pattern_stats.items():
+                        stats.remove(evicted[name])
+                    self.emotion_counts[evicted['emotion']] -= 1
+                    if not self.emotion_counts[evicted['emotion']]:
+                        del self.emotion_counts[evicted['emotion']]
+                    self.tag_counts.subtract(evicted['tags'])
+                    for tag in evicted['tags']:
+                        if self.tag_counts[tag] <= 0:
+                            del self.tag_counts[tag]
+
+                self.version += 1
+
+            self.request_save()
         except Exception as e:
             logging.error(f"Error processing interaction: {e}")
 
-    @ErrorBoundary.component()
     def _update_personality_weights(self, event: InteractionEvent) -> None:
         """Update personality weights based on interaction with error handling"""
         try:
@@ -251,10 +432,25 @@ class PersonalityMetricsManager:
             logging.error(f"Error updating personality weights: {e}")
             # Maintain current weights on error
 
+    def _view(self, name: str, build):
+        """A derived view of the history, rebuilt only after new events"""
+        with self._lock:
+            cached = self._views.get(name)
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+            value = build()
+            self._views[name] = (self.version, value)
+            return value
+
+    def timestamps(self) -> List[str]:
+        return self._view('timestamps', lambda: [
+            datetime.fromtimestamp(t).isoformat() for t in self.history.column('timestamp')
+        ])
+
     def get_personality_metrics(self) -> Dict:
         """Get current personality metrics and history"""
         metrics = {
-            'timestamps': [e.timestamp.isoformat() for e in self.interaction_history],
+            'timestamps': self.timestamps(),
             'interaction_score': self._calculate_interaction_score(),
             'dominant_trait': self._get_dominant_trait(),
         }
@@ -267,20 +463,12 @@ class PersonalityMetricsManager:
 
     def _calculate_interaction_score(self) -> float:
         """Calculate overall interaction score"""
-        if not self.interaction_history:
+        if not len(self.history):
             return 0.0
             
-        recent = list(self.interaction_history)[-10:]
+        recent = self.history.tail('score', 10)
         weights = np.exp(np.linspace(-1, 0, len(recent)))  # Exponential decay
-        
-        scores = [
-            0.4 * (1 - min(e.response_time / 5.0, 1.0)) +  # Response speed
-            0.3 * e.sentiment_score +                       # Sentiment
-            0.3 * min(e.word_count / 50.0, 1.0)           # Engagement
-            for e in recent
-        ]
-        
-        return float(np.average(scores, weights=weights))
+        return float(np.average(recent, weights=weights))
 
     def _get_dominant_trait(self) -> str:
         """Determine the dominant personality trait"""
@@ -297,18 +485,12 @@ class PersonalityMetricsManager:
 
     def get_interaction_history(self) -> Dict:
         """Get interaction history data"""
-        if not self.interaction_history:
+        if not len(self.history):
             return {'timestamps': [], 'scores': []}
             
-        history = list(self.interaction_history)
         return {
-            'timestamps': [e.timestamp.isoformat() for e in history],
-            'scores': [
-                0.4 * (1 - min(e.response_time / 5.0, 1.0)) +
-                0.3 * e.sentiment_score +
-                0.3 * min(e.word_count / 50.0, 1.0)
-                for e in history
-            ]
+            'timestamps': self.timestamps(),
+            'scores': self._view('scores', lambda: self.history.column('score').tolist())
         }
 
 # Global instance
@@ -327,12 +509,11 @@ def get_personality_metrics() -> Dict[str, Any]:
         base_metrics = _manager.get_personality_metrics()
         metrics.update(base_metrics)
         
-        # Add historical values for each dimension
+        # Add historical values for each dimension, as recorded with each interaction
         for dim in PersonalityDimension:
-            metrics[f'{dim.value}_history'] = [
-                state.base_weights.get(dim, 0.0)
-                for state in _manager.personality_states
-            ]
+            metrics[f'{dim.value}_history'] = _manager._view(
+                f'weight_{dim.name}', lambda dim=dim: _manager.history.column(f'weight_{dim.name}').tolist()
+            )
             
     except Exception as e:
         logging.error(f"Error getting personality metrics: {e}")
@@ -350,7 +531,7 @@ def update_personality_weights(weights: Dict[str, float]) -> None:
             _manager.profile.base_weights[dim] = np.clip(float(value), -1.0, 1.0)
         except (ValueError, KeyError):
             logging.warning(f"Invalid personality dimension: {dim_name}")
-    _manager.save_state()
+    _manager.request_save()
 
 async def record_interaction(
     message: str,
@@ -390,28 +571,21 @@ def get_interaction_patterns() -> Dict[str, Any]:
     }
     
     try:
-        # Get patterns from manager
-        async_patterns = asyncio.run(_manager.analyze_interaction_patterns())
-        
         # Get recent history
         history = _manager.get_interaction_history()
         patterns['timestamps'] = history['timestamps']
         patterns['interaction_scores'] = history['scores']
         
-        # Calculate emotion distribution
-        emotion_counts = defaultdict(int)
-        for event in _manager.interaction_history:
-            emotion_counts[event.emotion] += 1
+        # Emotion distribution, from the running counts
+        emotion_counts = dict(_manager.emotion_counts)
         total = sum(emotion_counts.values()) or 1
         patterns['emotion_distribution'] = {
             k: v/total for k, v in emotion_counts.items()
         }
         
         # Get context influence
-        context_tags = set()
-        for event in _manager.interaction_history:
-            context_tags.update(event.context_tags)
-        patterns['context_tags'] = list(context_tags)
+        context_tags = list(_manager.tag_counts)
+        patterns['context_tags'] = context_tags
         
         # Create context influence matrix
         influence_matrix = []
@@ -424,14 +598,13 @@ def get_interaction_patterns() -> Dict[str, Any]:
             influence_matrix.append(row)
         patterns['context_influence'] = influence_matrix
         
-        # Get topic coherence
-        patterns['topic_coherence'] = [
-            _manager._calculate_topic_coherence(event)
-            for event in _manager.interaction_history
-        ]
+        # Topic coherence, as scored when each interaction arrived
+        patterns['topic_coherence'] = _manager._view(
+            'coherence', lambda: _manager.history.column('coherence').tolist()
+        )
         
-        # Add async analysis results
-        patterns.update(async_patterns)
+        # Add the running window aggregates
+        patterns.update(_manager.interaction_patterns())
         
     except Exception as e:
         logging.error(f"Error getting interaction patterns: {e}")
@@ -443,4 +616,68 @@ def update_personality_config(config: Dict[str, Any]) -> None:
     try:
         _manager.config.update(config)
     except Exception as e:
-        logging.error(f"Error updating personality config: {e}") 
\ No newline at end of file
+        logging.error(f"Error updating personality config: {e}") 
+
+
+def benchmark_personality_metrics(events: int = 5000, refreshes: int = 200):
+    """Per-event cost and dashboard refresh cost, old full-rescan path vs running aggregates"""
+    import random
+    import tempfile
+
+    rng = random.Random(7)
+    emotions = ['joy', 'sadness', 'anger', 'fear', 'surprise', 'love']
+    stream = [InteractionEvent(
+        timestamp=datetime.now(),
+        message="hello there",
+        emotion=rng.choice(emotions),
+        response_time=rng.uniform(0.2, 6.0),
+        word_count=rng.randint(1, 80),
+        sentiment_score=rng.uniform(-1, 1),
+        context_tags={rng.choice(['game', 'music', 'chat'])}
+    ) for _ in range(events)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = PersonalityMetricsManager(save_delay=0.5)
+        manager._persister.path = os.path.join(temp_dir, STATE_FILE)
+
+        # The old path: a full json rewrite per event
+        old_path = os.path.join(temp_dir, 'per_event.json')
+        start = time.perf_counter()
+        for _ in stream[:500]:
+            with open(old_path, 'w') as f:
+                json.dump(manager._state_snapshot(), f, indent=2)
+        per_event_save_us = (time.perf_counter() - start) / 500 * 1e6
+
+        start = time.perf_counter()
+        for event in stream:
+            manager.add_interaction(event)
+        add_us = (time.perf_counter() - start) / events * 1e6
+
+        # The old dashboard refresh: rescoring every event in the window
+        window = stream[-manager.history_length:]
+        start = time.perf_counter()
+        for _ in range(20):
+            depth = [manager._calculate_conversation_depth(e) for e in window]
+            coherence = [manager._calculate_topic_coherence(e) for e in window]
+            Counter(e.emotion for e in window)
+            np.mean(depth), np.std(coherence)
+        rescan_ms = (time.perf_counter() - start) / 20 * 1000
+
+        start = time.perf_counter()
+        for _ in range(refreshes):
+            manager.interaction_patterns()
+            dict(manager.emotion_counts)
+        aggregate_us = (time.perf_counter() - start) / refreshes * 1e6
+
+        manager._persister.flush()
+        writes = manager._persister.writes
+
+    expected = np.mean([manager._calculate_conversation_depth(e) for e in window])
+    print(f"add_interaction: {add_us:.1f} us/event (was {per_event_save_us:.0f} us for the json rewrite alone)")
+    print(f"state writes for {events} events: {writes}")
+    print(f"pattern refresh: {aggregate_us:.2f} us vs {rescan_ms:.2f} ms rescanning the window")
+    print(f"running depth mean {manager.pattern_stats['depth'].mean:.6f}, rescanned {expected:.6f}")
+
+
+if __name__ == "__main__":
+    benchmark_personality_metrics()
@@ -0,0 +1,346 @@
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Chat template framing per message (role header and separators), roughly
+MESSAGE_OVERHEAD = 4
+
+# Where the old encoder put its blocks: RAG with 8 pairs after it, lore with 7
+RAG_DEPTH = 8
+LORE_DEPTH = 7
+
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+|[^\sA-Za-z0-9]")
+
+
+def estimate_tokens(text: str) -> int:
+    """BPE-ish estimate when no tokenizer is available: ~4 characters per word piece"""
+    count = 0
+    for piece in _WORD_PATTERN.findall(text):
+        count += math.ceil(len(piece) / 4) if piece[0].isalnum() else 1
+    return count
+
+
+class TokenCounter:
+    """Token counts per message text, through one cached tokenizer.
+
+    History is re-sent every turn, so the same strings are counted over and
+    over; counts are memoized by text in a bounded LRU.
+    """
+
+    def __init__(self, tokenizer_name: str = "", cache_size: int = 8192):
+        self.tokenizer_name = tokenizer_name
+        self.cache_size = cache_size
+        self._tokenizer = None
+        self._tokenizer_loaded = False
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _encode_length(self, text: str) -> int:
+        if not self._tokenizer_loaded:
+            self._tokenizer_loaded = True
+            if self.tokenizer_name:
+                try:
+                    from transformers import AutoTokenizer
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+                except Exception as e:
+                    logging.warning(f"Could not load tokenizer '{self.tokenizer_name}', estimating tokens: {e}")
+
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False))
+        return estimate_tokens(text)
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            count = self._counts.get(text)
+            if count is not None:
+                self._counts.move_to_end(text)
+                self.hits += 1
+                return count
+
+        count = self._encode_length(text)
+        with self._lock:
+            self.misses += 1
+            self._counts[text] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_message(self, text: str) -> int:
+        return self.count(text) + MESSAGE_OVERHEAD
+
+
+def build_prompt(history: List[list], user_input: str, budget: int, counter: TokenCounter,
+                 max_pairs: int, lore: Optional[str] = None, rag: Optional[str] = None) -> Tuple[List[dict], Dict]:
+    """Fill a token budget by priority: the new message, lore and RAG, then recent turns.
+
+    Lore and RAG are reserved first, so it is always the oldest turns that
+    give way. Turns are taken newest first and stop at the first that does
+    not fit, so the kept history is contiguous. Lore and RAG go in at the
+    depths the old encoder used, or at the top when fewer turns are kept.
+    """
+    used = counter.count_message(user_input)
+
+    blocks = {}
+    for name, text in (('lore', lore), ('rag', rag)):
+        if not text:
+            continue
+        cost = counter.count_message(text)
+        if used + cost <= budget:
+            blocks[name] = text
+            used += cost
+
+    kept = 0
+    for pair in reversed(history[-max_pairs:] if max_pairs > 0 else []):
+        cost = counter.count_message(pair[0]) + counter.count_message(pair[1])
+        if used + cost > budget:
+            break
+        used += cost
+        kept += 1
+
+    pairs = history[len(history) - kept:] if kept else []
+    rag_at = max(0, kept - RAG_DEPTH)
+    lore_at = max(0, kept - LORE_DEPTH)
+
+    messages = []
+    for i, pair in enumerate(pairs):
+        if i == rag_at and 'rag' in blocks:
+            messages.append({"role": "user", "content": blocks['rag']})
+        if i == lore_at and 'lore' in blocks:
+            messages.append({"role": "user", "content": blocks['lore']})
+        messages.append({"role": "user", "content": pair[0]})
+        messages.append({"role": "assistant", "content": pair[1]})
+    if not pairs:
+        messages.extend({"role": "user", "content": blocks[name]} for name in ('rag', 'lore') if name in blocks)
+
+    messages.append({"role": "user", "content": user_input})
+
+    report = {
+        'budget': budget,
+        'tokens': used,
+        'pairs': kept,
+        'pairs_dropped': min(len(history), max_pairs) - kept,
+        'lore': 'lore' in blocks,
+        'rag': 'rag' in blocks
+    }
+    return messages, report
+
+
+def build_stable_prompt(history: List[list], user_input: str, budget: int, counter: TokenCounter,
+                        max_pairs: int, block_pairs: int = 8, lore: Optional[str] = None,
+                        rag: Optional[str] = None) -> Tuple[List[dict], Dict]:
+    """Like build_prompt, but laid out so consecutive prompts share a long prefix.
+
+    History starts on a multiple of block_pairs, so the oldest kept turn only
+    moves a block at a time, and lore and RAG (which change every turn) go at
+    the tail. Between block shifts each prompt extends the last one, and the
+    backend can reuse its cached prefix instead of prefilling it again. As
+    there, lore and RAG are reserved before history is fitted.
+    """
+    block_pairs = max(1, block_pairs)
+    n = len(history)
+    start = -(-max(0, n - max_pairs) // block_pairs) * block_pairs
+
+    used = counter.count_message(user_input)
+
+    blocks = []
+    for text in (rag, lore):
+        if not text:
+            continue
+        cost = counter.count_message(text)
+        if used + cost <= budget:
+            blocks.append(text)
+            used += cost
+
+    costs = [counter.count_message(pair[0]) + counter.count_message(pair[1]) for pair in history[start:]]
+    history_cost = sum(costs)
+    while start < n and used + history_cost > budget:
+        step = min(block_pairs, n - start)
+        history_cost -= sum(costs[:step])
+        costs = costs[step:]
+        start += step
+    used += history_cost
+
+    messages = []
+    for pair in history[start:]:
+        messages.append({"role": "user", "content": pair[0]})
+        messages.append({"role": "assistant", "content": pair[1]})
+    messages.extend({"role": "user", "content": text} for text in blocks)
+    messages.append({"role": "user", "content": user_input})
+
+    report = {
+        'budget': budget,
+        'tokens': used,
+        'pairs': n - start,
+        'pairs_dropped': min(n, max_pairs) - (n - start),
+        'lore': bool(lore) and lore in blocks,
+        'rag': bool(rag) and rag in blocks
+    }
+    return messages, report
+
+
+def messages_tokens(messages: List[dict], counter: TokenCounter) -> int:
+    return sum(counter.count_message(message['content']) for message in messages)
+
+
+class PrefixCache:
+    """Single-slot prompt cache, as llama.cpp and exllama keep per slot.
+
+    Tracks how many prompt tokens match the previous prompt from the start;
+    those are the ones a backend could skip prefilling.
+    """
+
+    def __init__(self):
+        self.last: List[str] = []
+        self.reused_tokens = 0
+        self.total_tokens = 0
+
+    def observe(self, messages: List[dict], counter: TokenCounter) -> int:
+        contents = [message['role'] + ":" + message['content'] for message in messages]
+        reused = 0
+        for previous, current in zip(self.last, contents):
+            if previous != current:
+                break
+            reused += counter.count_message(current)
+        total = sum(counter.count_message(content) for content in contents)
+
+        self.last = contents
+        self.reused_tokens += reused
+        self.total_tokens += total
+        return reused
+
+    def hit_rate(self) -> float:
+        return self.reused_tokens / self.total_tokens if self.total_tokens else 0.0
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+prefix_cache = PrefixCache()
+
+
+def get_token_counter() -> TokenCounter:
+    global _counter
+    with _counter_lock:
+        if _counter is None:
+            import utils.settings
+            _counter = TokenCounter(utils.settings.prompt_tokenizer)
+        return _counter
+
+
+def benchmark_prompt_budget(pairs: int = 40, context: int = 4096, reply_tokens: int = 110,
+                            system_reserve: int = 400, turns: int = 50):
+    """Prompt tokens and stand-in server time, fixed pair count vs token budget.
+
+    The stand-in server tokenizes whatever it is sent (~2 us a token), truncates
+    to the context, and prefills what is left (~0.12 ms a token, a mid-size
+    model on a consumer GPU).
+    """
+    import random
+
+    rng = random.Random(3)
+    words = ("the stream chat was really fun today and we should play that game again "
+             "tomorrow maybe with friends who like puzzles music art and long stories").split()
+
+    def sentence(length):
+        return " ".join(rng.choice(words) for _ in range(length)).capitalize() + "."
+
+    history = [[sentence(rng.randint(6, 40)), sentence(rng.randint(20, 90))] for _ in range(pairs + turns)]
+    lore = "[System L] " + sentence(60)
+    rag = "[System M] " + sentence(120)
+
+    def old_encode(window):
+        messages = []
+        for i, pair in enumerate(window):
+            messages.append({"role": "user", "content": pair[0]})
+            messages.append({"role": "assistant", "content": pair[1]})
+            if i == pairs - 9:
+                messages.append({"role": "user", "content": rag})
+            if i == pairs - 8:
+                messages.append({"role": "user", "content": lore})
+        return messages
+
+    def server_ms(sent_tokens):
+        kept = min(sent_tokens, context - reply_tokens - system_reserve)
+        return sent_tokens * 0.002 + kept * 0.12
+
+    for label, budget in (("full context", context - reply_tokens - system_reserve), ("budget 2048", 2048)):
+        counter = TokenCounter()
+        old_tokens = new_tokens = 0
+        old_server = new_server = 0.0
+        build_seconds = 0.0
+        for turn in range(turns):
+            window = history[turn:turn + pairs]
+            user_input = sentence(15)
+
+            sent = messages_tokens(old_encode(window) + [{"role": "user", "content": user_input}], counter)
+            old_tokens += sent
+            old_server += server_ms(sent)
+
+            start = time.perf_counter()
+            messages, report = build_prompt(window, user_input, budget, counter, pairs, lore, rag)
+            build_seconds += time.perf_counter() - start
+            new_tokens += report['tokens']
+            new_server += server_ms(report['tokens'])
+
+        print(f"{label}: prompt {old_tokens / turns:.0f} -> {new_tokens / turns:.0f} tokens, "
+              f"server {old_server / turns:.0f} -> {new_server / turns:.0f} ms per turn, "
+              f"build {build_seconds / turns * 1000:.2f} ms "
+              f"(count cache {counter.hits / max(1, counter.hits + counter.misses) * 100:.0f}% hits)")
+
+
+def benchmark_prefix_layout(pairs: int = 40, context: int = 4096, reply_tokens: int = 110,
+                            system_reserve: int = 400, turns: int = 60, block_pairs: int = 8):
+    """Prefix reuse and stand-in prefill time, sliding window vs stable layout.
+
+    The stand-in backend keeps one cached prompt and only prefills from the
+    first token that differs (~0.12 ms a token).
+    """
+    import random
+
+    rng = random.Random(5)
+    words = ("we talked about the game and the music and the long story from yesterday "
+             "with chat laughing about puzzles art friends and snacks").split()
+
+    def sentence(length):
+        return " ".join(rng.choice(words) for _ in range(length)).capitalize() + "."
+
+    history = [[sentence(rng.randint(6, 30)), sentence(rng.randint(15, 60))] for _ in range(pairs)]
+    budget = context - reply_tokens - system_reserve
+
+    results = {}
+    for layout in ("sliding", "stable"):
+        counter = TokenCounter()
+        cache = PrefixCache()
+        local_history = [list(pair) for pair in history]
+        prefill_ms = 0.0
+        for turn in range(turns):
+            user_input = sentence(12)
+            lore = "[System L] " + sentence(30)
+            rag = "[System M] " + sentence(80)
+            if layout == "sliding":
+                messages, _ = build_prompt(local_history, user_input, budget, counter, pairs, lore, rag)
+            else:
+                messages, _ = build_stable_prompt(local_history, user_input, budget, counter, pairs,
+                                                  block_pairs, lore, rag)
+            reused = cache.observe(messages, counter)
+            prefill_ms += (messages_tokens(messages, counter) - reused) * 0.12
+            local_history.append([user_input, sentence(rng.randint(15, 60))])
+
+        results[layout] = (cache.hit_rate(), prefill_ms / turns)
+        print(f"{layout:>8}: prefix hit rate {cache.hit_rate() * 100:.0f}%, "
+              f"prefill {prefill_ms / turns:.0f} ms per turn")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_prompt_budget()
+    benchmark_prefix_layout()
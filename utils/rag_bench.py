@@ -0,0 +1,260 @@
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Union
+import logging
+
+import API.Oogabooga_Api_Support
+import utils.based_rag
+import utils.lorebook
+import utils.rag_hybrid
+import utils.settings
+import utils.text_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# An engine is either settings to run run_based_rag under, or any retriever taking (message, her_previous) to a memory block
+Engine = Union[Dict[str, object], Callable[[str, str], Optional[str]]]
+
+DEFAULT_ENGINES: Dict[str, Engine] = {
+    "keywords": {"rag_top_k": 1, "rag_hybrid_enabled": False},
+    "windows_k4": {"rag_top_k": 4, "rag_hybrid_enabled": False},
+}
+
+FILLER = ("so", "and", "the", "it", "was", "really", "i", "think", "you", "we", "like", "just")
+
+
+def synthetic_corpus(pairs: int, vocabulary: int = 20000, zipf: float = 1.0, lore_density: float = 0.05,
+                     seed: int = 0) -> List[list]:
+    """Chat pairs of made-up words, drawn with Zipf skew (rank^-zipf), with lorebook names dropped into
+    about lore_density of the user messages"""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) ** zipf for rank in range(vocabulary)]
+    lore = [lore['0'] for lore in utils.lorebook.LORE_BOOK]
+
+    corpus = []
+    for _ in range(pairs):
+        me = rng.choices(words, weights, k=rng.randint(4, 24))
+        if lore and rng.random() < lore_density:
+            me.insert(rng.randrange(len(me) + 1), rng.choice(lore))
+        her = rng.choices(words, weights, k=rng.randint(8, 48))
+        corpus.append([" ".join(me) + ".", " ".join(her) + "."])
+    return corpus
+
+
+def labelled_queries(corpus: List[list], count: int, lore: bool = False, seed: int = 1) -> List[dict]:
+    """Queries that paraphrase one older user message each, labelled with that message.
+
+    A paraphrase keeps about two thirds of the message's words, shuffled, with
+    some filler. Lore queries are drawn from messages naming a lorebook entry,
+    and keep the name.
+    """
+    rng = random.Random(seed)
+    names = [lore['0'] for lore in utils.lorebook.LORE_BOOK]
+
+    # Past the recall cutoff, and off the very first pair, which has no window before it
+    candidates = range(1, len(corpus) - utils.based_rag.history_demarc - 1)
+    if lore:
+        candidates = [i for i in candidates if any(name in corpus[i][0] for name in names)]
+    sources = rng.sample(list(candidates), min(count, len(candidates)))
+
+    queries = []
+    for source in sources:
+        message = corpus[source][0]
+        kept = [name for name in names if name in message] if lore else []
+        words = message.rstrip(".").split(" ")
+        words = rng.sample(words, max(1, round(len(words) * 2 / 3))) + rng.sample(FILLER, 3)
+        rng.shuffle(words)
+        queries.append({'source': source, 'label': message, 'message': " ".join(kept + words) + "?"})
+    return queries
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def latency_summary(seconds: List[float]) -> dict:
+    return {
+        'p50_ms': percentile(seconds, 50) * 1000,
+        'p99_ms': percentile(seconds, 99) * 1000,
+        'mean_ms': sum(seconds) / len(seconds) * 1000 if seconds else 0.0
+    }
+
+
+def recalled(memory: Optional[str], label: str) -> bool:
+    """Whether the labelled message is one of the pairs shown in a memory block"""
+    return memory is not None and ("User: " + label + "\n") in memory
+
+
+@contextmanager
+def settings_override(overrides: Dict[str, object]):
+    saved = {name: getattr(utils.settings, name) for name in overrides}
+    try:
+        for name, value in overrides.items():
+            setattr(utils.settings, name, value)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(utils.settings, name, value)
+
+
+def run_engine(engine: Engine, queries: List[dict], her_previous: str) -> dict:
+    """Latency and recall for one engine over one query set"""
+    seconds = []
+    hits = 0
+
+    if callable(engine):
+        for query in queries:
+            start = time.perf_counter()
+            memory = engine(query['message'], her_previous)
+            seconds.append(time.perf_counter() - start)
+            hits += recalled(memory, query['label'])
+        k = None
+
+    else:
+        rag = utils.based_rag
+        with settings_override(engine):
+            # Embed everything first, so the engine is measured warm rather than racing its own backfill
+            if utils.settings.rag_hybrid_enabled:
+                utils.rag_hybrid.get_hybrid_retriever().sync(rag.history_database)
+
+            for query in queries:
+                start = time.perf_counter()
+                rag.run_based_rag(query['message'], her_previous)
+                seconds.append(time.perf_counter() - start)
+                hits += recalled(rag.current_rag_message, query['label'])
+            k = utils.settings.rag_top_k
+
+    result = latency_summary(seconds)
+    result['queries'] = len(queries)
+    result['recall'] = hits / len(queries) if queries else 0.0
+    result['k'] = k
+    return result
+
+
+def build_database(corpus: List[list]) -> dict:
+    """setup_based_rag over the corpus from an empty database, timed, with the memory it took"""
+    rag = utils.based_rag
+    rag.clear_rag_database()
+    API.Oogabooga_Api_Support.ooga_history = [list(pair) for pair in corpus]
+
+    before = utils.text_store.rss_bytes()
+    start = time.perf_counter()
+    rag.setup_based_rag()
+    build_seconds = time.perf_counter() - start
+    after = utils.text_store.rss_bytes()
+
+    result = {
+        'build_seconds': build_seconds,
+        'rss_before_mb': before / (1024 * 1024),
+        'rss_growth_mb': (after - before) / (1024 * 1024),
+        'words': len(rag.word_database['word'])
+    }
+    if isinstance(rag.history_database, utils.text_store.PairTextStore):
+        result['history_on_disk_mb'] = os.path.getsize(rag.history_database.blob_path) / (1024 * 1024)
+    return result
+
+
+def time_adds(pairs: List[list]) -> dict:
+    """add_message_to_database for each new pair, as each send does"""
+    rag = utils.based_rag
+    history = API.Oogabooga_Api_Support.ooga_history
+
+    # Setup took the latest pair in already; nothing after it has been
+    rag.manual_recalculate_ignore_latest = False
+
+    seconds = []
+    for pair in pairs:
+        history.append(list(pair))
+        start = time.perf_counter()
+        rag.add_message_to_database()
+        seconds.append(time.perf_counter() - start)
+
+    result = latency_summary(seconds)
+    result['adds'] = len(pairs)
+    return result
+
+
+def benchmark_rag(sizes=(2000, 10000, 30000), engines: Optional[Dict[str, Engine]] = None, queries: int = 200,
+                  adds: int = 100, vocabulary: int = 20000, zipf: float = 1.0, lore_density: float = 0.05,
+                  seed: int = 0, out: Optional[str] = "rag_bench.json") -> dict:
+    """Build, add and query timings, memory and recall@k for each history size and engine, saved as JSON.
+
+    Runs in a scratch directory (no chat logs, its own RAG_Database), so no
+    saved database is read or overwritten, but the one in memory is cleared:
+    run it on its own, not from a live session. Debug logging is off while
+    it runs, as it would otherwise dominate the timings.
+    """
+    engines = engines or DEFAULT_ENGINES
+    rag = utils.based_rag
+    report = {
+        'config': {
+            'sizes': list(sizes), 'queries': queries, 'adds': adds, 'vocabulary': vocabulary, 'zipf': zipf,
+            'lore_density': lore_density, 'seed': seed, 'history_mmap': utils.settings.rag_history_mmap,
+            'engines': {name: engine if isinstance(engine, dict) else getattr(engine, '__name__', 'callable')
+                        for name, engine in engines.items()}
+        },
+        'runs': []
+    }
+    out = os.path.abspath(out) if out else None
+
+    saved_history = API.Oogabooga_Api_Support.ooga_history
+    saved_debug = rag.show_rag_debug
+    saved_name = rag.char_name
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, settings_override({'rag_enabled': True}):
+        os.makedirs(os.path.join(directory, "Logs"))
+        os.makedirs(os.path.join(directory, "RAG_Database"))
+        os.chdir(directory)
+        rag.show_rag_debug = False
+        rag.char_name = rag.char_name or "Character"
+        try:
+            for size in sizes:
+                corpus = synthetic_corpus(size + adds, vocabulary, zipf, lore_density, seed)
+                query_sets = {
+                    'paraphrase': labelled_queries(corpus[:size], queries, False, seed + 1),
+                    'lore': labelled_queries(corpus[:size], queries, True, seed + 2)
+                }
+
+                run = {'pairs': size}
+                run.update(build_database(corpus[:size]))
+                run['add'] = time_adds(corpus[size:])
+
+                her_previous = rag.history_database[-1][1]
+                run['engines'] = {}
+                for name, engine in engines.items():
+                    run['engines'][name] = {label: run_engine(engine, query_set, her_previous)
+                                            for label, query_set in query_sets.items() if query_set}
+
+                report['runs'].append(run)
+                print(f"{size} pairs: built in {run['build_seconds']:.2f} s (+{run['rss_growth_mb']:.0f} MB RSS), "
+                      f"add p50 {run['add']['p50_ms']:.2f} ms p99 {run['add']['p99_ms']:.2f} ms")
+                for name, results in run['engines'].items():
+                    for label, result in results.items():
+                        print(f"  {name:>12} {label:>10}: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+                              f"recall@{result['k'] or '?'} {result['recall']:.2f}")
+        finally:
+            rag.clear_rag_database()
+            os.chdir(previous_directory)
+            rag.show_rag_debug = saved_debug
+            rag.char_name = saved_name
+            API.Oogabooga_Api_Support.ooga_history = saved_history
+
+    if out:
+        with open(out, 'w') as outfile:
+            json.dump(report, outfile, indent=4)
+        print(f"results saved to {out}")
+    return report
+
+
+if __name__ == "__main__":
+    benchmark_rag()
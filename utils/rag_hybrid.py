@@ -0,0 +1,319 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+import utils.based_rag
+import utils.model_registry
+import utils.rag_speculation
+import utils.settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EMBEDDING = "embedding"
+
+# Each side's best few go into the fusion; 60 is the usual reciprocal-rank constant
+CANDIDATES = 50
+RRF_K = 60
+EMBED_BATCH = 32
+
+Matches = Dict[int, Tuple[float, FrozenSet[int]]]
+
+
+def _load_embedding():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(utils.settings.rag_embedding_model)
+
+
+def registry_encode(texts: List[str]) -> np.ndarray:
+    """Unit-length embeddings through the shared model registry"""
+    registry = utils.model_registry.get_model_registry()
+    registry.register(EMBEDDING, _load_embedding)
+    model = registry.acquire(EMBEDDING)
+    try:
+        return np.asarray(model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+    finally:
+        registry.release(EMBEDDING)
+
+
+def pair_text(pair: list) -> str:
+    return pair[0] + "\n" + pair[1]
+
+
+class PairEmbeddings:
+    """One unit-length embedding per history pair, in history order, grown as pairs are added.
+
+    Rows are kept in a preallocated matrix that doubles when full, so adding
+    a pair never copies the rest. The text behind each row is kept too; if
+    history is rebuilt or undone, rows past the first changed pair are dropped.
+    """
+
+    def __init__(self):
+        self.rows: Optional[np.ndarray] = None
+        self.texts: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def matching_prefix(self, history: List[list]) -> int:
+        with self._lock:
+            count = min(len(self.texts), len(history))
+            for i in range(count):
+                if self.texts[i] != pair_text(history[i]):
+                    count = i
+                    break
+            del self.texts[count:]
+            return count
+
+    def append(self, start: int, vectors: np.ndarray, texts: List[str]) -> bool:
+        with self._lock:
+            # Something else changed history while this batch was embedding
+            if start != len(self.texts):
+                return False
+
+            needed = len(self.texts) + len(texts)
+            if self.rows is None or needed > len(self.rows) or self.rows.shape[1] != vectors.shape[1]:
+                capacity = max(needed, 2 * (len(self.rows) if self.rows is not None else 0), 1024)
+                rows = np.zeros((capacity, vectors.shape[1]), dtype=np.float32)
+                if self.rows is not None and self.rows.shape[1] == vectors.shape[1]:
+                    rows[:len(self.texts)] = self.rows[:len(self.texts)]
+                self.rows = rows
+
+            self.rows[len(self.texts):needed] = vectors
+            self.texts.extend(texts)
+            return True
+
+    def ranking(self, query: np.ndarray, end: int, n: int) -> List[int]:
+        """Best n pairs from 1 up to end by cosine similarity, ties to the later pair"""
+        with self._lock:
+            end = min(end, len(self.texts))
+            if end <= 1:
+                return []
+            scores = self.rows[1:end] @ query
+
+        n = min(n, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n]
+        return [int(i) + 1 for i in sorted(top, key=lambda i: (scores[i], i), reverse=True)]
+
+
+def lexical_ranking(matches: Matches, n: int) -> List[int]:
+    return [i for i, _ in sorted(matches.items(), key=lambda item: (item[1][0], item[0]), reverse=True)[:n]]
+
+
+def fuse(rankings: List[List[int]], k: int = RRF_K) -> Dict[int, float]:
+    """Reciprocal-rank fusion: each list adds 1/(k + rank) for every pair it ranks"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, i in enumerate(ranking, 1):
+            fused[i] = fused.get(i, 0.0) + 1 / (k + rank)
+    return fused
+
+
+class HybridRetriever:
+    """Keyword and embedding search over history pairs, fused by rank within a latency budget.
+
+    The embedding side runs on its own thread while the keyword side runs on
+    the caller's. If it has not answered by the deadline, the keyword result
+    is used alone. History is embedded in the background as pairs are added.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray] = registry_encode):
+        self.encode = encode
+        self.embeddings = PairEmbeddings()
+        self._query_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-vector")
+        self._running = None
+        self._sync_wanted = threading.Event()
+        self._sync_thread = None
+        self._generation = None
+        self.queries = 0
+        self.deadline_misses = 0
+
+    # Background embedding of history
+
+    def schedule_sync(self):
+        self._sync_wanted.set()
+        if self._sync_thread is None:
+            self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True, name="rag-embed")
+            self._sync_thread.start()
+
+    def _sync_loop(self):
+        while True:
+            self._sync_wanted.wait()
+            self._sync_wanted.clear()
+            try:
+                self.sync(utils.based_rag.history_database)
+            except Exception as e:
+                logging.warning(f"Embedding history for hybrid RAG failed: {e}")
+
+    def sync(self, history: List[list]):
+        """Embed every pair not embedded yet, a batch at a time"""
+        if utils.based_rag.database_generation != self._generation:
+            self._generation = utils.based_rag.database_generation
+            self.embeddings.matching_prefix(history)
+
+        start = len(self.embeddings)
+        while start < len(history):
+            texts = [pair_text(pair) for pair in history[start:start + EMBED_BATCH]]
+            if not self.embeddings.append(start, self.encode(texts), texts):
+                return
+            start += len(texts)
+
+    # Search
+
+    def _vector_ranking(self, message: str, end: int) -> List[int]:
+        query = self.encode([message])[0]
+        return self.embeddings.ranking(query, end, CANDIDATES)
+
+    def fused_matches(self, message: str, matches: Matches, end: int, deadline_seconds: float) -> Tuple[Matches, bool]:
+        """Keyword matches re-scored by fused rank, and whether the embedding side made the deadline"""
+        self.queries += 1
+        started = time.perf_counter()
+
+        # One worker: a query that missed its deadline and is still encoding (or loading the model) would hold up this one
+        if self._running is not None and not self._running.done():
+            self.deadline_misses += 1
+            return matches, False
+        vector = self._query_pool.submit(self._vector_ranking, message, end)
+        self._running = vector
+
+        lexical = lexical_ranking(matches, CANDIDATES)
+
+        try:
+            ranking = vector.result(timeout=max(0.0, deadline_seconds - (time.perf_counter() - started)))
+        except FutureTimeoutError:
+            vector.cancel()
+            self.deadline_misses += 1
+            return matches, False
+        except Exception as e:
+            logging.warning(f"Embedding search failed, keywords only: {e}")
+            return matches, False
+
+        fused = fuse([lexical, ranking])
+        return {i: (score, matches[i][1] if i in matches else frozenset()) for i, score in fused.items()}, True
+
+    def stats(self) -> dict:
+        return {
+            'embedded_pairs': len(self.embeddings),
+            'queries': self.queries,
+            'deadline_misses': self.deadline_misses
+        }
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_hybrid_retriever() -> HybridRetriever:
+    global _retriever
+    with _retriever_lock:
+        if _retriever is None:
+            _retriever = HybridRetriever()
+        return _retriever
+
+
+def schedule_sync():
+    if utils.settings.rag_hybrid_enabled:
+        get_hybrid_retriever().schedule_sync()
+
+
+def hybrid_matches(message: str, highest_score_ids: List[int]) -> Tuple[Matches, int]:
+    """Scored pairs for a message, fused with embedding search when it answers in time"""
+    matches, end = utils.rag_speculation.memory_matches(highest_score_ids)
+    retriever = get_hybrid_retriever()
+    retriever.schedule_sync()
+    fused, _ = retriever.fused_matches(message, matches, end, utils.settings.rag_hybrid_deadline_ms / 1000)
+    return fused, end
+
+
+def best_match(matches: Matches) -> Optional[int]:
+    if not matches:
+        return None
+    return max(matches.items(), key=lambda item: (item[1][0], item[0]))[0]
+
+
+def benchmark_rag_hybrid(pairs: int = 20000, dim: int = 384, queries: int = 50, encode_ms: float = 15.0,
+                         deadline_ms: float = 150.0):
+    """Lexical vs hybrid latency, and the fallback when the embedding side is slow.
+
+    A stand-in encoder (hashed words onto random directions, with a sleep
+    for model time) keeps this runnable without downloading a model.
+    """
+    import random
+
+    rng = random.Random(19)
+    generator = np.random.default_rng(19)
+    vocabulary = [f"w{i}" for i in range(5000)]
+    directions = generator.standard_normal((len(vocabulary), dim)).astype(np.float32)
+    lookup = {word: i for i, word in enumerate(vocabulary)}
+    delay = [encode_ms / 1000]
+    loading = [0.0]
+
+    def encode(texts):
+        time.sleep(delay[0] + loading[0] if len(texts) == 1 else 0)
+        loading[0] = 0.0
+        vectors = np.zeros((len(texts), dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.split():
+                if word in lookup:
+                    vectors[row] += directions[lookup[word]]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    history = [[" ".join(rng.choices(vocabulary, weights, k=12)), " ".join(rng.choices(vocabulary, weights, k=30))]
+               for _ in range(pairs)]
+    me = [[lookup[word] + 4 for word in pair[0].split() if lookup[word] > 200] for pair in history]
+    her = [[lookup[word] + 4 for word in pair[1].split() if lookup[word] > 200] for pair in history]
+    end = pairs - 20
+    index = utils.rag_speculation.MemoryIndex()
+    index.extend(me, her, end)
+
+    retriever = HybridRetriever(encode)
+    start = time.perf_counter()
+    for first in range(0, pairs, EMBED_BATCH):
+        texts = [pair_text(pair) for pair in history[first:first + EMBED_BATCH]]
+        retriever.embeddings.append(first, encode(texts), texts)
+    embed_seconds = time.perf_counter() - start
+
+    # Each query paraphrases a stored message: most of its words, plus three keywords from it
+    questions = []
+    for i in rng.sample(range(1, end), queries):
+        words = history[i][0].split()
+        questions.append((i, " ".join(rng.sample(words, 9)), rng.sample([lookup[w] + 4 for w in words], 3)))
+
+    def run(label):
+        start = time.perf_counter()
+        used = found = 0
+        for source, message, keywords in questions:
+            matches = index.matches(keywords, end)
+            if label == "keywords only":
+                found += best_match(matches) == source
+                continue
+            fused, made_it = retriever.fused_matches(message, matches, end, deadline_ms / 1000)
+            found += best_match(fused) == source
+            used += made_it
+        elapsed = (time.perf_counter() - start) / len(questions) * 1000
+        print(f"{label}: {elapsed:.1f} ms per query, source pair recalled {found}/{len(questions)}"
+              + ("" if label == "keywords only" else f", embedding side in time for {used}/{len(questions)}"))
+
+    print(f"embedded {pairs} pairs in {embed_seconds:.1f} s (stand-in encoder, {dim} dims)")
+    run("keywords only")
+    run(f"hybrid, {encode_ms:.0f} ms encoder")
+
+    # The first query loading the model misses; the ones after it skip until it is done, rather than queue behind it
+    loading[0] = 1.0
+    run(f"hybrid, {encode_ms:.0f} ms encoder, 1 s model load on the first query")
+    time.sleep(1.0)
+    run(f"hybrid, {encode_ms:.0f} ms encoder, once loaded")
+    delay[0] = deadline_ms * 2 / 1000
+    run(f"hybrid, {deadline_ms * 2:.0f} ms encoder")
+    retriever._query_pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    benchmark_rag_hybrid()
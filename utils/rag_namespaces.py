@@ -0,0 +1,371 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import utils.based_rag
+import utils.rag_speculation
+import utils.settings
+import utils.tokenizer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+NAMESPACE_DIR = "RAG_Database/Namespaces"
+
+# Rough resident cost of a word and a pair beyond their text, for the memory cap
+WORD_OVERHEAD = 120
+PAIR_OVERHEAD = 400
+ID_BYTES = 8
+
+# A small namespace would find every word common; until it has this many, words are judged as if it did
+PRUNE_FLOOR_WORDS = 20000
+
+_audience: contextvars.ContextVar = contextvars.ContextVar('z_waif_rag_audience', default=None)
+
+
+@contextmanager
+def audience(namespace: Optional[str]):
+    """Send the RAG adds and searches made in this block to a namespace (None for the global one)"""
+    token = _audience.set(namespace)
+    try:
+        yield
+    finally:
+        _audience.reset(token)
+
+
+def current_namespace() -> Optional[str]:
+    if not utils.settings.rag_namespaces_enabled:
+        return None
+    return _audience.get()
+
+
+def namespace_for(platform: str, channel, user) -> str:
+    """A platform's namespace for a message, per channel or per user as set"""
+    if utils.settings.rag_namespace_scope == "user":
+        return f"{platform}-user-{user}"
+    return f"{platform}-channel-{channel}"
+
+
+class RagIndex:
+    """One audience's memories, kept in the same shape as based_rag's global database"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.word_database = {
+            'word': ["", " ", "the", "it"],
+            'count': [1, 1, 1, 1],
+            'value': [utils.based_rag.word_value(1)] * 4,
+            'total_word_count': 0
+        }
+        self.histories_word_id_database = {'me': [], 'her': [], 'scores': []}
+        self.history_database: List[list] = []
+        self.word_ids: Dict[str, int] = {word: i for i, word in enumerate(self.word_database['word'])}
+        self.memory = utils.rag_speculation.MemoryIndex()
+        self.approx_bytes = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def new(cls, name: str) -> "RagIndex":
+        index = cls(name)
+        index.add_pair("Start of all history!", "Start of all history!")
+        return index
+
+    @classmethod
+    def from_json(cls, name: str, data: dict) -> "RagIndex":
+        index = cls(name)
+        index.word_database = data['word_database']
+        index.histories_word_id_database = data['histories_word_id_database']
+        index.history_database = data['history_database']
+        index.word_ids = {}
+        for i, word in enumerate(index.word_database['word']):
+            index.word_ids.setdefault(word, i)
+        utils.based_rag.calc_word_values(index.word_database)
+        index.approx_bytes = (len(index.word_database['word']) * WORD_OVERHEAD
+                              + sum(len(pair[0]) + len(pair[1]) + PAIR_OVERHEAD for pair in index.history_database)
+                              + sum(len(ids) for ids in index.histories_word_id_database['me']) * ID_BYTES
+                              + sum(len(ids) for ids in index.histories_word_id_database['her']) * ID_BYTES)
+        return index
+
+    def to_json(self) -> dict:
+        return {
+            'word_database': self.word_database,
+            'histories_word_id_database': self.histories_word_id_database,
+            'history_database': self.history_database
+        }
+
+    def _parse(self, words, count: bool) -> List[int]:
+        """Word ids for split words, counting them in when count is set (parse_words_to_database's flags 0/1 vs 2/3)"""
+        database = self.word_database
+        word_ids = []
+        for word in words:
+            word_id = self.word_ids.get(word)
+            if word_id is None:
+                if not count:
+                    continue
+                word_id = len(database['word'])
+                database['word'].append(word)
+                database['count'].append(0)
+                database['value'].append(0.0)
+                self.word_ids[word] = word_id
+                self.approx_bytes += len(word) + WORD_OVERHEAD
+
+            if count:
+                database['count'][word_id] += 1
+                database['value'][word_id] = utils.based_rag.word_value(database['count'][word_id])
+            word_ids.append(word_id)
+
+        if count:
+            database['total_word_count'] += len(words)
+        return word_ids
+
+    def _prune(self, word_ids: List[int]) -> List[int]:
+        counts = self.word_database['count']
+        total = max(self.word_database['total_word_count'], PRUNE_FLOOR_WORDS)
+        return [word_id for word_id in word_ids if counts[word_id] / total <= utils.based_rag.common_word_ratio]
+
+    def add_pair(self, me: str, her: str):
+        with self._lock:
+            my_ids = self._parse(utils.tokenizer.words(me), True)
+            her_ids = self._parse(utils.tokenizer.words(her), True)
+
+            # Pruned on the way in, as add_message_to_database does for the global database
+            my_ids = self._prune(my_ids)
+            her_ids = self._prune(her_ids)
+            self.histories_word_id_database['me'].append(my_ids)
+            self.histories_word_id_database['her'].append(her_ids)
+            self.histories_word_id_database['scores'].append(0)
+            self.history_database.append([me, her])
+
+            self.approx_bytes += len(me) + len(her) + PAIR_OVERHEAD + (len(my_ids) + len(her_ids)) * ID_BYTES
+            self.dirty = True
+
+    def last_reply(self) -> Optional[str]:
+        return self.history_database[-1][1] if len(self.history_database) > 1 else None
+
+    def search(self, message: str, her_previous: str) -> Optional[Tuple[float, int]]:
+        """Best scoring pair for a message and her reply before it, or None if no pair shares a keyword"""
+        with self._lock:
+            end = len(self.histories_word_id_database['me']) - utils.based_rag.history_demarc
+            if end < 2:
+                return None
+
+            my_ids = self._parse(utils.tokenizer.words(message), False)
+            her_ids = self._parse(utils.tokenizer.words(her_previous), False)
+            top = utils.based_rag.pick_keywords(my_ids, her_ids, self.word_database)
+
+            self.memory.extend(self.histories_word_id_database['me'], self.histories_word_id_database['her'], end)
+            matches = self.memory.matches(top, end)
+
+        if not matches:
+            return None
+        best_id, (best_score, _) = max(matches.items(), key=lambda item: (item[1][0], item[0]))
+        return best_score, best_id
+
+    def memory_text(self, best_id: int) -> str:
+        return utils.based_rag.compose_rag_message(best_id, self.history_database)
+
+
+class NamespaceStore:
+    """Namespaced RAG indexes, loaded from disk on first use and kept in an LRU under a memory cap.
+
+    A resident index is one dictionary lookup away however many namespaces
+    exist. The least recently used ones are saved and dropped once the
+    resident total passes the cap.
+    """
+
+    def __init__(self, directory: str = NAMESPACE_DIR, memory_cap_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.memory_cap_bytes = memory_cap_bytes
+        self.resident: "OrderedDict[str, RagIndex]" = OrderedDict()
+        self.resident_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", name) + ".json")
+
+    def _load(self, name: str) -> RagIndex:
+        path = self._path(name)
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as openfile:
+                    return RagIndex.from_json(name, json.load(openfile))
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Could not load RAG namespace '{name}', starting it fresh: {e}")
+        return RagIndex.new(name)
+
+    def _save(self, index: RagIndex):
+        if not index.dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(index.name), 'w') as outfile:
+            json.dump(index.to_json(), outfile)
+        index.dirty = False
+
+    def _evict(self, keep: str):
+        while self.resident_bytes > self.memory_cap_bytes and len(self.resident) > 1:
+            name = next(iter(self.resident))
+            if name == keep:
+                break
+            index = self.resident.pop(name)
+            self._save(index)
+            self.resident_bytes -= index.approx_bytes
+            self.evictions += 1
+
+    def _get(self, name: str) -> RagIndex:
+        index = self.resident.get(name)
+        if index is not None:
+            self.resident.move_to_end(name)
+            self.hits += 1
+            return index
+
+        index = self._load(name)
+        self.loads += 1
+        self.resident[name] = index
+        self.resident_bytes += index.approx_bytes
+        self._evict(name)
+        return index
+
+    def get(self, name: str) -> RagIndex:
+        with self._lock:
+            return self._get(name)
+
+    def add(self, name: str, me: str, her: str):
+        with self._lock:
+            index = self._get(name)
+            before = index.approx_bytes
+            index.add_pair(me, her)
+            self.resident_bytes += index.approx_bytes - before
+            self._evict(name)
+
+    def save_all(self):
+        with self._lock:
+            for index in self.resident.values():
+                self._save(index)
+
+    def stats(self) -> dict:
+        return {
+            'resident': len(self.resident),
+            'resident_mb': self.resident_bytes / (1024 * 1024),
+            'hits': self.hits,
+            'loads': self.loads,
+            'evictions': self.evictions
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+# Pairs already filed under a namespace, so the global add on the next send passes them over
+_claimed: deque = deque(maxlen=64)
+
+
+def get_namespace_store() -> NamespaceStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = NamespaceStore(NAMESPACE_DIR, int(utils.settings.rag_namespace_memory_mb * 1024 * 1024))
+        return _store
+
+
+def record_reply(pair: list):
+    """File a finished pair under the current namespace, if there is one"""
+    namespace = current_namespace()
+    if namespace is None or not utils.settings.rag_enabled:
+        return
+    get_namespace_store().add(namespace, pair[0], pair[1])
+    _claimed.append((pair[0], pair[1]))
+
+
+def is_claimed(pair: list) -> bool:
+    return (pair[0], pair[1]) in _claimed
+
+
+def _global_best(message: str, her_previous: str) -> Optional[Tuple[float, int]]:
+    rag = utils.based_rag
+    if rag.is_setting_up:
+        return None
+    my_ids = utils.rag_speculation.message_word_ids(message)
+    her_ids = utils.rag_speculation.message_word_ids(her_previous)
+    matches, _ = utils.rag_speculation.memory_matches(rag.pick_keywords(my_ids, her_ids))
+    if not matches:
+        return None
+    best_id, (best_score, _) = max(matches.items(), key=lambda item: (item[1][0], item[0]))
+    return best_score, best_id
+
+
+def recall(message: str, her_previous: str, namespace: str) -> Optional[str]:
+    """The best memory for a message from its own namespace, or from the global one when fanning out.
+
+    A tie goes to the namespace's own memory. None if neither has a pair
+    sharing a keyword; the latest global pair is not a fair fallback here.
+    """
+    index = get_namespace_store().get(namespace)
+    her_previous = index.last_reply() or her_previous
+
+    own = index.search(message, her_previous)
+    shared = _global_best(message, her_previous) if utils.settings.rag_namespace_fanout else None
+
+    if own is not None and (shared is None or own[0] >= shared[0]):
+        return index.memory_text(own[1])
+    if shared is not None:
+        return utils.based_rag.compose_rag_message(shared[1])
+    return None
+
+
+def benchmark_rag_namespaces(counts=(10, 100, 400), pairs: int = 60, lookups: int = 2000):
+    """Resident lookup and search time as the number of namespaces grows, with the LRU under a cap"""
+    import random
+    import tempfile
+
+    rng = random.Random(17)
+    words = [f"w{i}" for i in range(4000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+
+    def sentence(length):
+        return " ".join(rng.choices(words, weights, k=length))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in counts:
+            store = NamespaceStore(os.path.join(directory, str(count)), memory_cap_bytes=8 * 1024 * 1024)
+            start = time.perf_counter()
+            for n in range(count):
+                for _ in range(pairs):
+                    store.add(f"discord-channel-{n}", sentence(12), sentence(30))
+            fill_seconds = time.perf_counter() - start
+
+            hot = f"discord-channel-{count - 1}"
+            start = time.perf_counter()
+            for _ in range(lookups):
+                store.get(hot)
+            lookup_us = (time.perf_counter() - start) / lookups * 1e6
+
+            index = store.get(hot)
+            messages = [sentence(20) for _ in range(100)]
+            start = time.perf_counter()
+            found = sum(1 for message in messages if index.search(message, index.last_reply()) is not None)
+            search_us = (time.perf_counter() - start) / len(messages) * 1e6
+
+            start = time.perf_counter()
+            store.get("discord-channel-0")
+            cold_ms = (time.perf_counter() - start) * 1000
+
+            stats = store.stats()
+            print(f"{count:>5} namespaces: resident lookup {lookup_us:.2f} us, search {search_us:.0f} us "
+                  f"({found}% recalled), "
+                  f"cold load {cold_ms:.1f} ms; {stats['resident']} resident in {stats['resident_mb']:.1f} MB, "
+                  f"{stats['evictions']} evicted (filled in {fill_seconds:.1f} s)")
+
+
+if __name__ == "__main__":
+    benchmark_rag_namespaces()
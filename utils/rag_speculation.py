@@ -0,0 +1,315 @@
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+import logging
+
+import utils.based_rag
+import utils.lorebook
+import utils.settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PARTIAL_PATH = os.path.join(tempfile.gettempdir(), "z_waif_partial_voice.wav")
+
+
+class MemoryIndex:
+    """Which stored message pairs hold each word, so a search only visits pairs sharing a keyword.
+
+    Gives the same pick as based_rag.search_memories: the highest scoring pair,
+    the most recent one on a tie.
+    """
+
+    def __init__(self):
+        self.me: Dict[int, List[int]] = {}
+        self.her: Dict[int, List[int]] = {}
+        self.penalties: List[Tuple[float, float]] = []
+
+    def __len__(self):
+        return len(self.penalties)
+
+    def extend(self, me_word_ids: List[List[int]], her_word_ids: List[List[int]], upto: int):
+        for i in range(len(self.penalties), upto):
+            for word_id in set(me_word_ids[i]):
+                self.me.setdefault(word_id, []).append(i)
+            for word_id in set(her_word_ids[i]):
+                self.her.setdefault(word_id, []).append(i)
+            self.penalties.append((len(me_word_ids[i]) / 120, len(her_word_ids[i]) / 120))
+
+    def search(self, highest_score_ids: List[int], end: int) -> int:
+        me_hits: Dict[int, int] = {}
+        her_hits: Dict[int, int] = {}
+        for postings, hits in ((self.me, me_hits), (self.her, her_hits)):
+            for word_id in highest_score_ids:
+                for i in postings.get(word_id, ()):
+                    hits[i] = hits.get(i, 0) + 1
+
+        # Pairs sharing no keyword score 0, so the latest of those is the fallback
+        best_id, best_score = (end - 1, 0) if end > 1 else (0, 0)
+        for i in set(me_hits) | set(her_hits):
+            if i < 1 or i >= end:
+                continue
+            me_penalty, her_penalty = self.penalties[i]
+            score = max(0, me_hits.get(i, 0) - me_penalty) + max(0, her_hits.get(i, 0) - her_penalty)
+            if score > best_score or (score == best_score and i > best_id):
+                best_id, best_score = i, score
+        return best_id
+
+    def matches(self, highest_score_ids: List[int], end: int) -> Dict[int, Tuple[float, FrozenSet[int]]]:
+        """Score and matched keywords of every searchable pair sharing a keyword, as search scores them"""
+        me_hits: Dict[int, int] = {}
+        her_hits: Dict[int, int] = {}
+        matched: Dict[int, set] = {}
+        for postings, hits in ((self.me, me_hits), (self.her, her_hits)):
+            for word_id in highest_score_ids:
+                for i in postings.get(word_id, ()):
+                    hits[i] = hits.get(i, 0) + 1
+                    matched.setdefault(i, set()).add(word_id)
+
+        results = {}
+        for i, words in matched.items():
+            if i < 1 or i >= end:
+                continue
+            me_penalty, her_penalty = self.penalties[i]
+            score = max(0, me_hits.get(i, 0) - me_penalty) + max(0, her_hits.get(i, 0) - her_penalty)
+            if score > 0:
+                results[i] = (score, frozenset(words))
+        return results
+
+
+class RetrievalSpeculator:
+    """Does the RAG and lore work for the next message before it is sent.
+
+    When her reply lands, the memory index is brought up to date and the lore
+    for the recent history is matched. While we are still talking, rough
+    transcripts are run through the whole search, so the real message finds
+    its words already tokenized and the search only touches pairs sharing a
+    keyword.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._index = MemoryIndex()
+        self._pending: Dict[str, object] = {}
+        self._work = threading.Condition()
+        self._worker = None
+
+    def _check_database(self):
+        rag = utils.based_rag
+        with self._lock:
+            if rag.database_generation != self._generation:
+                self._generation = rag.database_generation
+                self._index = MemoryIndex()
+
+    def message_word_ids(self, message: str) -> List[int]:
+        """Word ids for a message; tokenized once and cached, so the send path reuses the speculated split"""
+        self._check_database()
+        return utils.based_rag.parse_words_to_database(message, 2)
+
+    def _searchable(self) -> int:
+        """Index every pair a search may return; the newest are past the recall cutoff anyway"""
+        self._check_database()
+        rag = utils.based_rag
+        end = len(rag.histories_word_id_database['me']) - rag.history_demarc
+        with self._lock:
+            self._index.extend(rag.histories_word_id_database['me'], rag.histories_word_id_database['her'], max(0, end))
+        return end
+
+    def best_memory(self, highest_score_ids: List[int]) -> int:
+        end = self._searchable()
+        with self._lock:
+            return self._index.search(highest_score_ids, end)
+
+    def memory_matches(self, highest_score_ids: List[int]) -> Tuple[Dict[int, Tuple[float, FrozenSet[int]]], int]:
+        """Every scoring pair and the search end, for picking more than one memory"""
+        end = self._searchable()
+        with self._lock:
+            return self._index.matches(highest_score_ids, end), end
+
+    # Speculative work, on a worker thread
+
+    def _submit(self, kind: str, payload):
+        with self._work:
+            self._pending[kind] = payload
+            self._work.notify()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._work:
+                self._work.wait_for(lambda: self._pending)
+                kind = "prepare" if "prepare" in self._pending else next(iter(self._pending))
+                payload = self._pending.pop(kind)
+
+            if utils.based_rag.is_setting_up:
+                continue
+            try:
+                if kind == "prepare":
+                    self.prepare_now(payload)
+                else:
+                    self._partial_audio(payload)
+            except Exception as e:
+                # Anything missed here is simply done on the send path instead
+                logging.warning(f"Speculative retrieval skipped: {e}")
+
+    def prepare(self, history: List[list]):
+        """Her reply landed; get her words and the recent lore ready"""
+        if history:
+            self._submit("prepare", [list(pair) for pair in history[-3:]])
+
+    def prepare_now(self, recent: List[list]):
+        self._searchable()
+        for pair in recent:
+            utils.lorebook.lore_matches(pair[0])
+            utils.lorebook.lore_matches(pair[1])
+
+    def submit_audio(self, audio: bytes):
+        """Audio so far while recording; only the newest is transcribed"""
+        self._submit("audio", audio)
+
+    def cancel_partials(self):
+        """Drop queued audio; one already being transcribed finishes, and the real transcript waits on it"""
+        with self._work:
+            self._pending.pop("audio", None)
+
+    def _partial_audio(self, audio: bytes):
+        import API.Oogabooga_Api_Support
+        import utils.audio
+        import utils.transcriber_translate
+
+        utils.audio.save_wav(audio, PARTIAL_PATH)
+        partial = utils.transcriber_translate.to_transcribe_original_language(PARTIAL_PATH)
+        history = API.Oogabooga_Api_Support.ooga_history
+        self.speculate(partial, history[-1][1] if history else "")
+
+    def speculate(self, partial: str, her_previous: str):
+        """Run the whole search for a rough transcript, so the indexes and lore cache are current when the real one lands"""
+        if not partial.strip():
+            return
+        my_ids = self.message_word_ids(partial)
+        her_ids = self.message_word_ids(her_previous)
+        self.best_memory(utils.based_rag.pick_keywords(my_ids, her_ids))
+        utils.lorebook.lore_matches(partial)
+
+    def stats(self) -> dict:
+        return {
+            'indexed_words': utils.based_rag.word_index_size,
+            'indexed_pairs': len(self._index)
+        }
+
+
+_speculator = RetrievalSpeculator()
+
+
+def get_speculator() -> RetrievalSpeculator:
+    return _speculator
+
+
+def message_word_ids(message: str) -> List[int]:
+    return _speculator.message_word_ids(message)
+
+
+def best_memory(highest_score_ids: List[int]) -> int:
+    return _speculator.best_memory(highest_score_ids)
+
+
+def memory_matches(highest_score_ids: List[int]) -> Tuple[Dict[int, Tuple[float, FrozenSet[int]]], int]:
+    return _speculator.memory_matches(highest_score_ids)
+
+
+def prepare_next_turn(history: List[list]):
+    if utils.settings.rag_speculation_enabled and utils.settings.rag_enabled:
+        _speculator.prepare(history)
+
+
+def partial_audio_callback() -> Optional[Callable[[bytes], None]]:
+    """What to give utils.audio.record, if rough transcripts are wanted"""
+    if (utils.settings.rag_speculation_enabled and utils.settings.rag_enabled
+            and utils.settings.rag_speculation_partial_seconds > 0):
+        return _speculator.submit_audio
+    return None
+
+
+def benchmark_speculative_rag(pairs: int = 5000, vocabulary: int = 20000, turns: int = 20):
+    """Send-path RAG time, scoring every pair vs finalizing speculated work.
+
+    Fills the RAG database with synthetic history, then for each turn feeds
+    three growing rough transcripts (the last a few words short) before
+    sending the full message.
+    """
+    import random
+
+    rng = random.Random(11)
+    rag = utils.based_rag
+    words = [f"w{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+
+    def sentence(length):
+        return " ".join(rng.choices(words, weights, k=length))
+
+    def word_ids(text):
+        # Rare words only, as prune_common leaves them
+        return [int(word[1:]) + 4 for word in text.split(" ") if int(word[1:]) > 200]
+
+    rag.word_database = {'word': ["", " ", "the", "it"] + words, 'count': [1] * (vocabulary + 4),
+                         'value': [0.0] * (vocabulary + 4), 'total_word_count': 0}
+    rag.history_database = [[sentence(12), sentence(30)] for _ in range(pairs)]
+    rag.histories_word_id_database = {'me': [word_ids(pair[0]) for pair in rag.history_database],
+                                      'her': [word_ids(pair[1]) for pair in rag.history_database],
+                                      'scores': [0] * pairs}
+    for i, word in enumerate(words):
+        rag.word_database['count'][i + 4] = max(1, int(pairs * 42 * weights[i] / sum(weights[:50])))
+    rag.calc_word_values()
+    rag.database_generation += 1
+    rag.is_setting_up = False
+
+    speculator = RetrievalSpeculator()
+    start = time.perf_counter()
+    with rag.word_index_lock:
+        rag.sync_word_index()
+    speculator._searchable()
+    index_ms = (time.perf_counter() - start) * 1000
+
+    old_seconds = new_seconds = 0.0
+    for _ in range(turns):
+        her_previous = rag.history_database[-1][1]
+        message = sentence(24)
+
+        start = time.perf_counter()
+        my_ids = rag.parse_words_to_database(message, 2)
+        her_ids = rag.parse_words_to_database(her_previous, 3)
+        old_best = rag.search_memories(rag.pick_keywords(my_ids, her_ids))[0]
+        old_seconds += time.perf_counter() - start
+
+        # While talking: her words once her reply lands, then rough transcripts as they come in
+        speculator.prepare_now([["", her_previous]])
+        message_words = message.split(" ")
+        for cut in (8, 16, 21):
+            speculator.speculate(" ".join(message_words[:cut]), her_previous)
+
+        start = time.perf_counter()
+        top = rag.pick_keywords(speculator.message_word_ids(message), speculator.message_word_ids(her_previous))
+        new_best = speculator.best_memory(top)
+        new_seconds += time.perf_counter() - start
+
+        assert new_best == old_best
+
+        # Sent; the pair joins the database, as add_message_to_database does
+        rag.history_database.append([message, sentence(30)])
+        rag.histories_word_id_database['me'].append(word_ids(message))
+        rag.histories_word_id_database['her'].append(word_ids(rag.history_database[-1][1]))
+        rag.histories_word_id_database['scores'].append(0)
+
+    print(f"send path, no speculation: {old_seconds / turns * 1000:.1f} ms per message "
+          f"({pairs} pairs, {len(rag.word_database['word'])} words)")
+    print(f"send path, speculated:     {new_seconds / turns * 1000:.2f} ms per message")
+    print(f"word and memory indexes built off the send path in {index_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    benchmark_speculative_rag()
@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional
+import logging
+
+import API.Oogabooga_Api_Support
+import utils.based_rag
+import utils.settings
+import utils.tokenizer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Pairs per summary, as many as a retrospect looks at
+SUMMARY_WINDOW = 16
+SUMMARY_PATH = "RAG_Database/LiveRAG_Summaries.json"
+POLL_SECONDS = 5
+
+SUMMARY_HEADER = "[System M]; This is a summary of interactions you have had, relevant to what is currently happening;\n"
+SUMMARY_FOOTER = "\n[System M]; This is the end of the memory!"
+
+
+def window_start(pair_id: int) -> int:
+    """First pair of the summary window a pair falls in; windows start after the opening pair"""
+    return 1 + (pair_id - 1) // SUMMARY_WINDOW * SUMMARY_WINDOW
+
+
+def window_hash(pairs: List[list]) -> str:
+    digest = hashlib.sha1()
+    for pair in pairs:
+        digest.update(pair[0].encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(pair[1].encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def summary_instruction() -> str:
+    return ("[System L] Can you please summarize these chat messages in a few sentences? They are previous memories that you, "
+            + str(utils.based_rag.char_name) + ", have experienced. Keep the names, places and things that came up.")
+
+
+def _request_summary(pairs: List[list]) -> Optional[str]:
+    return API.Oogabooga_Api_Support.summarize_pairs(pairs, summary_instruction(), utils.settings.rag_summary_tokens)
+
+
+class SummaryTier:
+    """A second, compact memory tier: one summary per fixed window of older history.
+
+    Summaries are keyed by a hash of the window's text, so a window is only
+    ever summarized once; rebuilding or reloading the RAG finds the same text
+    and reuses what was made. They are made on a background thread, a batch
+    at a time, only while nobody is talking to her. Each keeps its set of
+    words, so recall can check it still mentions what was asked about.
+    """
+
+    def __init__(self, path: str = SUMMARY_PATH, summarize: Callable[[List[list]], Optional[str]] = _request_summary):
+        self.path = path
+        self.summarize = summarize
+        self._lock = threading.Lock()
+        self._summaries: Dict[str, str] = {}
+        self._words: Dict[str, FrozenSet[str]] = {}
+        self._loaded = False
+        self._dirty = False
+
+        # Window start to content hash, good until history is rebuilt or undone
+        self._hashes: Dict[int, str] = {}
+        self._generation = None
+
+        self._last_activity = time.monotonic()
+        self._thread = None
+        self.requests = 0
+        self.failures = 0
+
+    # Storage
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if os.path.isfile(self.path):
+                with open(self.path, 'r') as openfile:
+                    for key, summary in json.load(openfile).items():
+                        self._summaries[key] = summary
+                        self._words[key] = frozenset(utils.tokenizer.tokenize(summary))
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            summaries = dict(self._summaries)
+
+        temporary = self.path + ".tmp"
+        with open(temporary, 'w') as outfile:
+            json.dump(summaries, outfile, indent=4)
+        os.replace(temporary, self.path)
+
+    def add(self, key: str, summary: str):
+        with self._lock:
+            self._summaries[key] = summary
+            self._words[key] = frozenset(utils.tokenizer.tokenize(summary))
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._summaries)
+
+    # Windows
+
+    def _window_key(self, history: List[list], start: int) -> Optional[str]:
+        rag = utils.based_rag
+        with self._lock:
+            if rag.database_generation != self._generation:
+                self._generation = rag.database_generation
+                self._hashes = {}
+            key = self._hashes.get(start)
+        if key is not None:
+            return key
+
+        pairs = history[start:start + SUMMARY_WINDOW]
+        if len(pairs) < SUMMARY_WINDOW:
+            return None
+        key = window_hash(pairs)
+        with self._lock:
+            self._hashes[start] = key
+        return key
+
+    def pending(self, history: List[list]) -> List[int]:
+        """Starts of the full windows past the recall cutoff that have no summary yet, newest first"""
+        self._ensure_loaded()
+        end = len(history) - utils.based_rag.history_demarc
+        starts = []
+        for start in range(1, end - SUMMARY_WINDOW + 1, SUMMARY_WINDOW):
+            key = self._window_key(history, start)
+            if key is not None and key not in self._summaries:
+                starts.append(start)
+        starts.reverse()
+        return starts
+
+    def summary_for(self, history: List[list], pair_id: int, keywords: List[str]) -> Optional[str]:
+        """The summary of the window holding a pair, if there is one and it mentions one of the keywords"""
+        self._ensure_loaded()
+        key = self._window_key(history, window_start(pair_id))
+        if key is None or key not in self._summaries:
+            return None
+        if keywords and not any(keyword in self._words[key] for keyword in keywords):
+            return None
+        return self._summaries[key]
+
+    # Background work
+
+    def note_activity(self):
+        self._last_activity = time.monotonic()
+
+    def idle(self) -> bool:
+        if API.Oogabooga_Api_Support.currently_sending_message != "":
+            return False
+        return time.monotonic() - self._last_activity >= utils.settings.rag_summary_idle_seconds
+
+    def summarize_pending(self, limit: int, history: Optional[List[list]] = None, wait_for_idle: bool = True) -> int:
+        """Summarize up to limit windows, stopping as soon as someone talks; returns how many were made"""
+        history = history if history is not None else utils.based_rag.history_database
+        made = 0
+        for start in self.pending(history)[:limit]:
+            if wait_for_idle and not self.idle():
+                break
+
+            pairs = history[start:start + SUMMARY_WINDOW]
+            key = window_hash(pairs)
+            self.requests += 1
+            summary = self.summarize(pairs)
+            if not summary:
+                self.failures += 1
+                continue
+            self.add(key, summary)
+            made += 1
+
+        if made:
+            self.save()
+        return made
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="rag-summaries")
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(POLL_SECONDS)
+            if utils.based_rag.is_setting_up or not self.idle():
+                continue
+            try:
+                self.summarize_pending(utils.settings.rag_summary_batch)
+            except Exception as e:
+                self.failures += 1
+                logging.warning(f"Summarizing history for the RAG failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            'summaries': len(self._summaries),
+            'requests': self.requests,
+            'failures': self.failures
+        }
+
+
+_tier = None
+_tier_lock = threading.Lock()
+
+
+def get_summary_tier() -> SummaryTier:
+    global _tier
+    with _tier_lock:
+        if _tier is None:
+            _tier = SummaryTier()
+        return _tier
+
+
+def start_summarizer():
+    get_summary_tier().start()
+
+
+def note_activity():
+    if _tier is not None:
+        _tier.note_activity()
+
+
+def summary_memory(best_message_id: int, highest_score_ids: List[int]) -> Optional[str]:
+    """The memory block for a recall as a summary, in place of the raw pairs, when one is ready"""
+    if not utils.settings.rag_summaries_enabled:
+        return None
+
+    # Past the placeholder words every database starts with (and pads the keywords with)
+    rag = utils.based_rag
+    keywords = [rag.word_database['word'][word_id] for word_id in highest_score_ids if word_id > 3]
+    summary = get_summary_tier().summary_for(rag.history_database, best_message_id, keywords)
+    if summary is None:
+        return None
+    return SUMMARY_HEADER + summary + SUMMARY_FOOTER
+
+
+def benchmark_rag_summaries(pairs: int = 30000, vocabulary: int = 20000, recalls: int = 2000, summary_words: int = 40):
+    """Prompt tokens per recall, raw window vs summary, and what memoizing saves on a rebuild.
+
+    A stand-in summarizer (the window's rarest words, cut to a typical
+    summary length) keeps this runnable without a model. Her replies are
+    drawn at the length of a usual LLM reply.
+    """
+    import random
+    import tempfile
+
+    import utils.prompt_budget
+
+    rng = random.Random(31)
+    words = [f"w{i}" for i in range(vocabulary)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    history = [["Start of all history!", "Start of all history!"]]
+    history += [[" ".join(rng.choices(words, weights, k=rng.randint(4, 24))),
+                 " ".join(rng.choices(words, weights, k=rng.randint(20, 90)))] for _ in range(pairs)]
+
+    def summarize(window):
+        found = sorted({word for pair in window for word in " ".join(pair).split()}, key=lambda w: -int(w[1:]))
+        return " ".join(found[:summary_words]) + "."
+
+    counter = utils.prompt_budget.TokenCounter()
+    with tempfile.TemporaryDirectory() as directory:
+        tier = SummaryTier(os.path.join(directory, "summaries.json"), summarize)
+
+        start = time.perf_counter()
+        made = tier.summarize_pending(len(history), history, wait_for_idle=False)
+        build_seconds = time.perf_counter() - start
+
+        # A rebuild (new generation) has to hash every window again, but asks for nothing new
+        utils.based_rag.database_generation += 1
+        tier.requests = 0
+        start = time.perf_counter()
+        tier.summarize_pending(len(history), history, wait_for_idle=False)
+        rebuild_ms = (time.perf_counter() - start) * 1000
+        rebuild_requests = tier.requests
+
+        raw_tokens = summary_tokens = 0
+        found = 0
+        centers = [rng.randrange(2, len(history) - utils.based_rag.history_demarc - 1) for _ in range(recalls)]
+        start = time.perf_counter()
+        for center in centers:
+            summary = tier.summary_for(history, center, [])
+            found += summary is not None
+        recall_us = (time.perf_counter() - start) / recalls * 1e6
+
+        for center in centers[:200]:
+            raw = "".join("User: " + pair[0] + "\nHer: " + pair[1] + "\n" for pair in history[center - 1:center + 2])
+            raw_tokens += counter.count(raw)
+            summary_tokens += counter.count(SUMMARY_HEADER + (tier.summary_for(history, center, []) or "") + SUMMARY_FOOTER)
+
+    print(f"summarized {made} windows of {SUMMARY_WINDOW} pairs ({pairs} pairs) in {build_seconds:.2f} s (stand-in summarizer)")
+    print(f"rebuild: {rebuild_requests} new requests, {rebuild_ms:.0f} ms to re-hash every window")
+    print(f"recall: summary found for {found}/{recalls}, {recall_us:.1f} us per lookup")
+    print(f"prompt tokens per memory: raw 3-pair window {raw_tokens / 200:.0f}, summary {summary_tokens / 200:.0f}")
+
+
+if __name__ == "__main__":
+    benchmark_rag_summaries()
@@ -0,0 +1,166 @@
+import heapq
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import logging
+
+import utils.prompt_budget
+import utils.rag_speculation
+import utils.settings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# A memory is the pair that scored plus one either side, as compose_rag_message lays it out
+WINDOW_RADIUS = 1
+
+MEMORIES_HEADER = "[System M]; These messages are memories of interactions you have had, relevant to what is currently happening;\n"
+MEMORIES_FOOTER = "[System M]; This is the end of the memories!"
+MEMORY_SEPARATOR = "...\n"
+
+
+def window_scores(matches: Dict[int, Tuple[float, FrozenSet[int]]], end: int) -> Dict[int, Tuple[float, FrozenSet[int]]]:
+    """Sliding sum of pair scores over each window, and the keywords it matched.
+
+    Only windows touching a scoring pair get a score, so the work follows the
+    matches from the index, not the length of history.
+    """
+    windows: Dict[int, Tuple[float, FrozenSet[int]]] = {}
+    for i, (score, words) in matches.items():
+        for center in range(max(1, i - WINDOW_RADIUS), min(end, i + WINDOW_RADIUS + 1)):
+            total, matched = windows.get(center, (0.0, frozenset()))
+            windows[center] = (total + score, matched | words)
+    return windows
+
+
+def _overlap(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def select_windows(windows: Dict[int, Tuple[float, FrozenSet[int]]], k: int, diversity: float) -> List[int]:
+    """Best k non-overlapping windows, MMR style.
+
+    Each pick is scored as its relevance (relative to the best window) less
+    diversity times its keyword overlap with the closest window already
+    picked. Penalties only grow as picks are made, so a heap with lazy
+    re-scoring gives the same picks as re-scoring everything each round.
+    Ties go to the more recent window, as the single-memory search does.
+    """
+    if not windows or k < 1:
+        return []
+
+    top = max(score for score, _ in windows.values())
+    heap = [(-score / top, -center, center, 0) for center, (score, _) in windows.items()]
+    heapq.heapify(heap)
+
+    picked: List[int] = []
+    while heap and len(picked) < k:
+        negative, _, center, scored_at = heapq.heappop(heap)
+        if any(abs(center - other) <= 2 * WINDOW_RADIUS for other in picked):
+            continue
+
+        if scored_at < len(picked):
+            score, words = windows[center]
+            penalty = max(_overlap(words, windows[other][1]) for other in picked)
+            heapq.heappush(heap, (-(score / top - diversity * penalty), -center, center, len(picked)))
+            continue
+
+        picked.append(center)
+    return picked
+
+
+def window_text(history: List[list], center: int, char_name: str) -> str:
+    text = ""
+    for pair in history[center - WINDOW_RADIUS:center + WINDOW_RADIUS + 1]:
+        text += "User: " + pair[0] + "\n"
+        text += str(char_name) + ": " + pair[1] + "\n"
+    return text
+
+
+def compose_memories(history: List[list], centers: List[int], char_name: str, token_budget: int,
+                     counter: Optional[utils.prompt_budget.TokenCounter] = None) -> Tuple[str, List[int]]:
+    """The [System M] block for the picked windows, best first until the token budget runs out.
+
+    The best window always goes in, as the single memory did. Kept windows
+    are shown oldest first, so the block reads in the order things happened.
+    """
+    counter = counter or utils.prompt_budget.get_token_counter()
+    used = counter.count(MEMORIES_HEADER) + counter.count(MEMORIES_FOOTER)
+
+    kept = {}
+    for center in centers:
+        text = window_text(history, center, char_name)
+        cost = counter.count(text) + counter.count(MEMORY_SEPARATOR)
+        if kept and token_budget > 0 and used + cost > token_budget:
+            break
+        kept[center] = text
+        used += cost
+
+    order = sorted(kept)
+    return MEMORIES_HEADER + MEMORY_SEPARATOR.join(kept[center] for center in order) + MEMORIES_FOOTER, order
+
+
+def retrieve_memories(highest_score_ids: List[int], history: List[list], char_name: str,
+                      matches: Optional[Tuple[Dict[int, Tuple[float, FrozenSet[int]]], int]] = None) -> Optional[str]:
+    """Several memories for the keywords (or for already scored pairs and their end); None when nothing scored"""
+    matches, end = matches or utils.rag_speculation.memory_matches(highest_score_ids)
+    windows = window_scores(matches, end)
+    centers = select_windows(windows, utils.settings.rag_top_k, utils.settings.rag_diversity)
+    if not centers:
+        return None
+
+    message, _ = compose_memories(history, centers, char_name, utils.settings.rag_token_budget)
+    return message
+
+
+def benchmark_rag_windows(pairs: int = 20000, vocabulary: int = 20000, queries: int = 50,
+                          ks=(1, 2, 4, 8, 16), budget: int = 600):
+    """Selection latency against k, next to the single-memory scan of every pair"""
+    import random
+
+    rng = random.Random(13)
+    words = list(range(4, vocabulary + 4))
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+
+    def sentence_ids(length):
+        # Rare words only, as prune_common leaves them
+        return [word for word in rng.choices(words, weights, k=length) if word > 200]
+
+    me = [sentence_ids(12) for _ in range(pairs)]
+    her = [sentence_ids(30) for _ in range(pairs)]
+    history = [[" ".join(f"w{word}" for word in me[i]), " ".join(f"w{word}" for word in her[i])] for i in range(pairs)]
+    end = pairs - 20
+
+    index = utils.rag_speculation.MemoryIndex()
+    index.extend(me, her, end)
+
+    def evaluate(keywords, ids):
+        value = sum(1 for word in keywords if word in ids) - len(ids) / 120
+        return max(0, value)
+
+    keyword_sets = [rng.sample(words[200:2000], 6) for _ in range(queries)]
+
+    start = time.perf_counter()
+    for keywords in keyword_sets[:5]:
+        best_score = 0
+        for i in range(1, end):
+            score = evaluate(keywords, me[i]) + evaluate(keywords, her[i])
+            if best_score <= score:
+                best_score = score
+    scan_ms = (time.perf_counter() - start) / 5 * 1000
+
+    counter = utils.prompt_budget.TokenCounter()
+    print(f"full scan, single memory: {scan_ms:.1f} ms ({pairs} pairs)")
+    for k in ks:
+        start = time.perf_counter()
+        kept = 0
+        for keywords in keyword_sets:
+            windows = window_scores(index.matches(keywords, end), end)
+            centers = select_windows(windows, k, 0.3)
+            _, order = compose_memories(history, centers, "Her", budget, counter)
+            kept += len(order)
+        elapsed = (time.perf_counter() - start) / queries * 1000
+        print(f"k={k:>2}: {elapsed:.2f} ms per query, {kept / queries:.1f} memories kept in {budget} tokens")
+
+
+if __name__ == "__main__":
+    benchmark_rag_windows()
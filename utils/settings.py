@@ -16,6 +16,10 @@ cam_use_image_feed = False
 cam_direct_talk = True
 cam_reply_after = False
 cam_image_preview = True
+cam_jpeg_quality = 85           # JPEG quality sent to the vision model
+cam_max_dimension = 512         # Longest side, in pixels, sent to the vision model
+cam_vision_retry_budget = 3     # Attempts to get a non-blank description
+cam_vision_timeout = 60         # Seconds per vision request
 
 # Valid values; "Faces", "Random", "None"
 eyes_follow = "None"
@@ -27,6 +31,51 @@ discord_enabled = True
 rag_enabled = True
 vision_enabled = True
 
+# Speech output engine; "sapi", "local" (offline pyttsx3) or "stub"
+speech_engine = "sapi"
+
+# Local transformers models (emotion, personalized replies)
+model_memory_budget_mb = 0        # Evict idle models past this much; 0 for no limit
+model_idle_unload_seconds = 900   # Unload a model unused this long; 0 to keep loaded
+model_batch_size = 8              # Requests run through a model in one call
+model_batch_wait = 0.02           # Seconds to wait for a batch to fill
+
+# Prompt assembly
+prompt_budget_enabled = True        # Fit history, lore and RAG to a token budget before sending
+prompt_token_budget = 0             # Cap on prompt tokens; 0 fills the context left after the reply
+prompt_system_reserve_tokens = 400  # Held back for the character card and chat template
+prompt_tokenizer = ""               # Hugging Face tokenizer matching the backend model; blank to estimate
+prompt_layout = "sliding"           # "stable" keeps the prompt prefix fixed so the backend can reuse its cache
+prompt_history_block = 8            # In the stable layout, history drops off this many pairs at a time
+
+# RAG
+rag_speculation_enabled = True          # Work out RAG and lore while the user is still talking
+rag_speculation_partial_seconds = 2.0   # Seconds of speech between rough transcripts; 0 for none
+rag_top_k = 1                           # Memories recalled per message; above 1, the best non-overlapping ones
+rag_diversity = 0.3                     # How strongly extra memories must differ in keywords from those already picked
+rag_token_budget = 600                  # Token cap for the memory block when recalling several; 0 for no cap
+rag_namespaces_enabled = True           # Discord and Twitch chats keep their own memories instead of sharing the global ones
+rag_namespace_scope = "channel"         # Namespace per "channel" or per "user"
+rag_namespace_fanout = True             # Namespaced chats can also recall from the global memories
+rag_namespace_memory_mb = 64            # Memory cap for loaded namespaces; the least recently used are saved and dropped
+rag_hybrid_enabled = False              # Blend embedding search into the keyword RAG (loads a small sentence-transformers model)
+rag_hybrid_deadline_ms = 150            # Embedding search that takes longer is dropped for that message; keywords only
+rag_embedding_model = "all-MiniLM-L6-v2"
+rag_history_mmap = True                 # Keep RAG history text on disk, memory-mapped, instead of all in RAM
+rag_summaries_enabled = False           # Summarize older history while idle, and recall those summaries in place of raw pairs;
+                                        # sends the LLM a request per window while idle, and a message can wait behind one
+rag_summary_idle_seconds = 60           # Quiet time before background summaries are requested from the LLM
+rag_summary_batch = 4                   # Windows summarized per idle check, at most
+rag_summary_tokens = 120                # Length cap for each summary
+
+# Web UI
+web_ui_stream_replies = True  # Stream replies into the web UI chat as they are written
+stream_reply_timeout = 120    # Seconds a streamed reply may go quiet (or take to connect) before it is given up on
+metrics_export_port = 7865    # Latency export at /metrics and /metrics.json; 0 to disable
+log_max_entries = 2000        # Lines kept in memory by each debug log panel
+log_max_kb = 256              # Text kept in memory by each debug log panel
+log_spill_to_disk = False     # Write lines the debug logs let go of to logs/debug.log and logs/rag.log, instead of dropping them
+
 # Feature Toggles
 autochat_enabled = True  # Toggle for auto-chat feature
 voice_enabled = True       # Toggle for voice feature
@@ -49,9 +98,20 @@ TWITCH_MAX_RESPONSE_LENGTH = 500  # Maximum length of responses
 DISCORD_VOICE_ENABLED = True
 DISCORD_TTS_LANGUAGE = "en"
 DISCORD_TTS_SPEED = 1.0
+DISCORD_TTS_VOICE = "com"  # gTTS accent domain (com, co.uk, com.au, ...)
+DISCORD_TTS_CACHE_MAX_MB = 64  # LRU cap for the TTS audio cache
+DISCORD_TTS_PRESYNTHESIZE = True  # Pre-make the spoken lines listed in Configurables/TTSPhrases.json at startup
 DISCORD_VOICE_TIMEOUT = 300  # 5 minutes
 DISCORD_MAX_AUDIO_LENGTH = 300  # 5 minutes
 DISCORD_AUDIO_QUALITY = "high"
+DISCORD_PREFETCH_TRACKS = 2      # Upcoming tracks resolved ahead of playback
+DISCORD_RESOLVE_WORKERS = 2      # Threads running yt-dlp resolution
+DISCORD_STREAM_URL_TTL = 1800    # Seconds a resolved stream URL is reused
+
+# Discord Response Settings
+DISCORD_MAX_PENDING_PER_GUILD = 2    # Messages per guild allowed to wait on the model at once
+DISCORD_MAX_PENDING_PER_CHANNEL = 1  # Messages per channel allowed to wait on the model at once
+DISCORD_STREAM_EDIT_INTERVAL = 1.0   # Seconds between streamed message edits
 
 # Voice Command Settings
 DISCORD_COMMAND_PREFIX = "/"
@@ -0,0 +1,289 @@
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+import logging
+
+import utils.tracing
+from utils.tts_cache import split_sentences
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+OUTPUT_DIR = Path(tempfile.gettempdir()) / "z_waif_speech"
+
+
+@dataclass
+class SpeechClip:
+    text: str
+    path: Optional[Path]
+    duration: float
+
+
+def wav_duration(path: Path) -> float:
+    with wave.open(str(path), 'rb') as wav_file:
+        return wav_file.getnframes() / float(wav_file.getframerate())
+
+
+def play_wav_file(clip: SpeechClip, stop_event: threading.Event):
+    """Play a WAV clip, returning early if the stop event is set"""
+    if sys.platform == "win32":
+        import winsound
+
+        winsound.PlaySound(str(clip.path), winsound.SND_FILENAME | winsound.SND_ASYNC)
+        if stop_event.wait(clip.duration):
+            winsound.PlaySound(None, 0)
+        return
+
+    import numpy as np
+    import sounddevice as sd
+
+    with wave.open(str(clip.path), 'rb') as wav_file:
+        rate = wav_file.getframerate()
+        channels = wav_file.getnchannels()
+        frames = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+
+    sd.play(frames.reshape(-1, channels), rate)
+    if stop_event.wait(clip.duration):
+        sd.stop()
+
+
+class SAPISpeechEngine:
+    """Windows SAPI voice, rendered to WAV so it can be queued and interrupted"""
+    name = "sapi"
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _voice(self):
+        if not hasattr(self._local, "voice"):
+            import pythoncom
+            import win32com.client
+
+            pythoncom.CoInitialize()
+            self._local.voice = win32com.client.Dispatch("SAPI.SpVoice")
+        return self._local.voice
+
+    def synthesize(self, text: str) -> SpeechClip:
+        import win32com.client
+
+        voice = self._voice()
+        path = OUTPUT_DIR / f"sapi_{uuid.uuid4().hex}.wav"
+        stream = win32com.client.Dispatch("SAPI.SpFileStream")
+        stream.Open(str(path), 3)  # SSFMCreateForWrite
+        voice.AudioOutputStream = stream
+        voice.Speak(text)
+        stream.Close()
+        return SpeechClip(text, path, wav_duration(path))
+
+    def play(self, clip: SpeechClip, stop_event: threading.Event):
+        play_wav_file(clip, stop_event)
+
+
+class LocalSpeechEngine:
+    """Offline, cross-platform voice through pyttsx3 (espeak / nsss / sapi5)"""
+    name = "local"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine = None
+
+    def synthesize(self, text: str) -> SpeechClip:
+        import pyttsx3
+
+        path = OUTPUT_DIR / f"local_{uuid.uuid4().hex}.wav"
+        with self._lock:
+            if self._engine is None:
+                self._engine = pyttsx3.init()
+            self._engine.save_to_file(text, str(path))
+            self._engine.runAndWait()
+        return SpeechClip(text, path, wav_duration(path))
+
+    def play(self, clip: SpeechClip, stop_event: threading.Event):
+        play_wav_file(clip, stop_event)
+
+
+class StubSpeechEngine:
+    """File-backed stand-in with no audio device, timed at a speaking pace"""
+    name = "stub"
+
+    def __init__(self, words_per_second: float = 2.5, synth_seconds: float = 0.0):
+        self.words_per_second = words_per_second
+        self.synth_seconds = synth_seconds
+        self.spoken = []
+
+    def synthesize(self, text: str) -> SpeechClip:
+        if self.synth_seconds:
+            time.sleep(self.synth_seconds)
+        path = OUTPUT_DIR / f"stub_{uuid.uuid4().hex}.txt"
+        path.write_text(text, encoding='utf-8')
+        return SpeechClip(text, path, len(text.split()) / self.words_per_second)
+
+    def play(self, clip: SpeechClip, stop_event: threading.Event):
+        if not stop_event.wait(clip.duration):
+            self.spoken.append(clip.text)
+
+
+ENGINES = {
+    "sapi": SAPISpeechEngine,
+    "local": LocalSpeechEngine,
+    "stub": StubSpeechEngine,
+}
+
+
+def create_engine(name: str):
+    if name not in ENGINES:
+        logging.error(f"Unknown speech engine '{name}', using stub")
+        name = "stub"
+    return ENGINES[name]()
+
+
+class SpeechPipeline:
+    """Producer/consumer speech queue: sentence N+1 is synthesized while N plays"""
+
+    def __init__(self, engine, lookahead: int = 1,
+                 on_sentence: Optional[Callable[[str, float], None]] = None):
+        self.engine = engine
+        self.on_sentence = on_sentence
+
+        self._sentences = queue.Queue()
+        self._clips = queue.Queue(maxsize=lookahead)
+        self._stop_event = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = 0
+        self._threads = []
+
+    def start(self):
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        for target in (self._produce, self._consume):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def speak(self, text: str):
+        """Queue a message to be spoken; returns immediately"""
+        sentences = split_sentences(text)
+        # Speech runs on our threads, so carry the turn's span along with each sentence
+        parent = utils.tracing.current_span()
+        with self._lock:
+            generation = self._generation
+            self._pending += len(sentences)
+            if sentences:
+                self._idle.clear()
+        for sentence in sentences:
+            self._sentences.put((generation, sentence, parent))
+
+    def interrupt(self):
+        """Stop the current sentence and drop everything still queued"""
+        with self._lock:
+            self._generation += 1
+            self._stop_event.set()
+        for pending_queue in (self._sentences, self._clips):
+            while True:
+                try:
+                    item = pending_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if pending_queue is self._clips:
+                    self._discard(item[1])
+                self._done_item()
+
+    def is_speaking(self) -> bool:
+        return not self._idle.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._idle.wait(timeout)
+
+    def _current(self, generation: int) -> bool:
+        return generation == self._generation
+
+    def _done_item(self):
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+            if self._pending == 0:
+                self._idle.set()
+
+    def _discard(self, clip: SpeechClip):
+        if clip.path is not None:
+            try:
+                os.remove(clip.path)
+            except OSError:
+                pass
+
+    def _produce(self):
+        while True:
+            generation, sentence, parent = self._sentences.get()
+            if not self._current(generation):
+                self._done_item()
+                continue
+
+            try:
+                with utils.tracing.span("speech.synthesize", parent=parent):
+                    clip = self.engine.synthesize(sentence)
+            except Exception as e:
+                logging.error(f"Speech synthesis failed: {e}")
+                self._done_item()
+                continue
+
+            # Blocks while the player is a full lookahead behind
+            self._clips.put((generation, clip, parent))
+
+    def _consume(self):
+        while True:
+            generation, clip, parent = self._clips.get()
+
+            # Checked and re-armed together, so an interrupt landing in between is not erased
+            with self._lock:
+                current = self._current(generation)
+                if current:
+                    self._stop_event.clear()
+
+            if current:
+                if self.on_sentence is not None:
+                    try:
+                        self.on_sentence(clip.text, clip.duration)
+                    except Exception as e:
+                        logging.error(f"Speech timing callback failed: {e}")
+                try:
+                    with utils.tracing.span("speech.play", parent=parent, seconds=round(clip.duration, 2)):
+                        self.engine.play(clip, self._stop_event)
+                except Exception as e:
+                    logging.error(f"Speech playback failed: {e}")
+
+            self._discard(clip)
+            self._done_item()
+
+
+_pipeline: Optional[SpeechPipeline] = None
+
+
+def start_speech_output(engine_name: str, on_sentence: Optional[Callable[[str, float], None]] = None) -> SpeechPipeline:
+    global _pipeline
+    _pipeline = SpeechPipeline(create_engine(engine_name), on_sentence=on_sentence)
+    _pipeline.start()
+    return _pipeline
+
+
+def speak(text: str):
+    if _pipeline is None:
+        start_speech_output("stub")
+    _pipeline.speak(text)
+
+
+def interrupt():
+    if _pipeline is not None:
+        _pipeline.interrupt()
+
+
+def is_speaking() -> bool:
+    return _pipeline is not None and _pipeline.is_speaking()
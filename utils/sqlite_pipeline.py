@@ -0,0 +1,214 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _open(db_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(db_path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class SQLitePipeline:
+    """Write-behind queue with one writer thread that commits in batches.
+
+    Writes are jobs taking a cursor, run in order and committed together, so a
+    burst of messages costs one fsync instead of one each. Each job runs in its
+    own savepoint, so one that fails part way leaves nothing behind, and the
+    rest of its batch still commits. Reads go through a per-thread connection;
+    under WAL they never wait on the writer, but they only see committed
+    batches (call flush() first to read your own writes).
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 256, flush_interval: float = 0.05):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches_committed = 0
+        self.jobs_committed = 0
+
+        self._jobs = queue.Queue()
+        self._readers = threading.local()
+        self._reader_connections = []
+        self._reader_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def submit(self, job: Callable[[sqlite3.Cursor], object]) -> Future:
+        """Queue a write job; the future resolves once its batch is committed"""
+        future = Future()
+        self._jobs.put((job, future))
+        return future
+
+    def execute(self, sql: str, params=()) -> Future:
+        return self.submit(lambda cursor: cursor.execute(sql, params).lastrowid)
+
+    def executescript(self, script: str):
+        """Run schema statements and wait for them"""
+        self.submit(lambda cursor: cursor.executescript(script)).result()
+
+    def flush(self, timeout: Optional[float] = None):
+        self.submit(lambda cursor: None).result(timeout)
+
+    def query(self, sql: str, params=()) -> list:
+        return self._reader().execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params=()):
+        return self._reader().execute(sql, params).fetchone()
+
+    def _reader(self) -> sqlite3.Connection:
+        if not hasattr(self._readers, "connection"):
+            self._readers.connection = _open(self.db_path)
+            with self._reader_lock:
+                self._reader_connections.append(self._readers.connection)
+        return self._readers.connection
+
+    def close(self, timeout: Optional[float] = None):
+        """Commit what is queued, then close the writer and every reader connection"""
+        self._jobs.put(None)
+        self._writer.join(timeout)
+        with self._reader_lock:
+            for connection in self._reader_connections:
+                connection.close()
+            self._reader_connections = []
+
+    def _run_job(self, connection: sqlite3.Connection, cursor: sqlite3.Cursor, job):
+        # One batch transaction, with a savepoint per job inside it
+        if not connection.in_transaction:
+            cursor.execute("BEGIN")
+        cursor.execute("SAVEPOINT job")
+        try:
+            result = job(cursor)
+        except Exception:
+            # A job that committed on its own (executescript does) has no savepoint left to undo
+            if connection.in_transaction:
+                cursor.execute("ROLLBACK TO job")
+                cursor.execute("RELEASE job")
+            raise
+        if connection.in_transaction:
+            cursor.execute("RELEASE job")
+        return result
+
+    def _write_loop(self):
+        connection = _open(self.db_path)
+        cursor = connection.cursor()
+        closing = False
+
+        while not closing:
+            batch = [self._jobs.get()]
+
+            # Gather whatever else arrives within the flush window
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                closing = True
+                batch = batch[:batch.index(None)]
+
+            results = []
+            for job, future in batch:
+                try:
+                    results.append((future, self._run_job(connection, cursor, job), None))
+                except Exception as e:
+                    logging.error(f"SQLite write job failed: {e}")
+                    results.append((future, None, e))
+
+            try:
+                connection.commit()
+            except sqlite3.Error as e:
+                logging.error(f"SQLite batch commit failed: {e}")
+                connection.rollback()
+                results = [(future, None, e) for future, _, _ in results]
+
+            self.batches_committed += 1
+            self.jobs_committed += len(batch)
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+        connection.close()
+
+
+_pipelines: Dict[str, SQLitePipeline] = {}
+_pipelines_lock = threading.Lock()
+
+
+def get_sqlite_pipeline(db_path: str) -> SQLitePipeline:
+    """One pipeline, and so one writer, per database file"""
+    key = os.path.abspath(db_path)
+    with _pipelines_lock:
+        if key not in _pipelines:
+            _pipelines[key] = SQLitePipeline(db_path)
+        return _pipelines[key]
+
+
+def benchmark_twitch_firehose(messages: int = 5000, users: int = 300):
+    """Sustained messages/sec for per-message commits vs the batched writer"""
+    import random
+    import tempfile
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS interactions (
+            user_id TEXT, timestamp DATETIME, message TEXT, response TEXT, emotion TEXT, context TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_interactions_user_time ON interactions (user_id, timestamp);
+    '''
+    insert = "INSERT INTO interactions (user_id, timestamp, message, response, emotion) VALUES (?, ?, ?, ?, ?)"
+    rng = random.Random(7)
+    firehose = [(f"viewer{rng.randrange(users)}", time.strftime('%Y-%m-%d %H:%M:%S'),
+                 f"PogChamp message {i}", "", rng.uniform(-1, 1)) for i in range(messages)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The old setup: default journal, a commit per message
+        connection = sqlite3.connect(os.path.join(temp_dir, "per_message.db"))
+        connection.executescript(schema)
+        start = time.perf_counter()
+        for row in firehose:
+            connection.execute(insert, row)
+            connection.commit()
+        per_message_rate = messages / (time.perf_counter() - start)
+        connection.close()
+
+        pipeline = SQLitePipeline(os.path.join(temp_dir, "batched.db"))
+        pipeline.executescript(schema)
+        start = time.perf_counter()
+        for row in firehose:
+            pipeline.execute(insert, row)
+        pipeline.flush()
+        batched_rate = messages / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(200):
+            pipeline.query("SELECT message FROM interactions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10",
+                           (f"viewer{i % users}",))
+        history_ms = (time.perf_counter() - start) / 200 * 1000
+
+        # Windows will not delete the directory while either connection holds the file
+        pipeline.close()
+
+    print(f"per-message commit: {per_message_rate:,.0f} msg/s")
+    print(f"batched writer:     {batched_rate:,.0f} msg/s in {pipeline.batches_committed} batches")
+    print(f"indexed user history lookup: {history_ms:.3f} ms")
+    return {'per_message_rate': per_message_rate, 'batched_rate': batched_rate, 'history_ms': history_ms}
+
+
+if __name__ == "__main__":
+    benchmark_twitch_firehose()
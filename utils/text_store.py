@@ -0,0 +1,224 @@
+import mmap
+import os
+import threading
+import time
+from array import array
+from typing import Iterable, Iterator, List
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class PairTextStore:
+    """Message pairs as one UTF-8 blob on disk plus an offsets array, read through a memory map.
+
+    Stands in for the list of [me, her] pairs it replaces: indexing,
+    slicing, len, iteration, append, +=, pop and cutting off the tail all
+    work the same. Only the pairs asked for become Python strings; the rest
+    stay in the page cache, where the OS can drop them.
+    """
+
+    def __init__(self, path: str):
+        self.blob_path = path + ".bin"
+        self.offsets_path = path + ".idx"
+        self._lock = threading.RLock()
+        self._map = None
+        self._mapped = 0
+
+        # Message k runs from offsets[k] to offsets[k + 1]; a pair is messages 2i and 2i + 1
+        self._offsets = array('q', [0])
+        if os.path.isfile(self.offsets_path):
+            with open(self.offsets_path, 'rb') as openfile:
+                saved = array('q')
+                saved.frombytes(openfile.read())
+            if saved and saved[0] == 0 and len(saved) % 2 == 1:
+                self._offsets = saved
+
+        self._file = open(self.blob_path, 'a+b')
+
+        # Cut back to the last fully written pair, in case we stopped between the blob and the offsets
+        size = os.path.getsize(self.blob_path)
+        while self._offsets[-1] > size:
+            del self._offsets[-2:]
+        if size > self._offsets[-1]:
+            self._file.truncate(self._offsets[-1])
+
+    @classmethod
+    def create(cls, path: str, pairs: Iterable[list]) -> "PairTextStore":
+        """A new store holding pairs, replacing any store already at path"""
+        for extension in (".bin", ".idx"):
+            if os.path.isfile(path + extension):
+                os.remove(path + extension)
+        store = cls(path)
+        store.extend(pairs)
+        store.flush()
+        return store
+
+    def __len__(self) -> int:
+        return (len(self._offsets) - 1) // 2
+
+    def _text(self, k: int) -> str:
+        start, end = self._offsets[k], self._offsets[k + 1]
+        if end > self._mapped:
+            self._remap()
+        return self._map[start:end].decode('utf-8')
+
+    def _remap(self):
+        self._file.flush()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        size = os.path.getsize(self.blob_path)
+        if size:
+            self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        self._mapped = size
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                return [[self._text(2 * i), self._text(2 * i + 1)] for i in range(*index.indices(len(self)))]
+
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("pair index out of range")
+            return [self._text(2 * index), self._text(2 * index + 1)]
+
+    def __iter__(self) -> Iterator[list]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, pair: list):
+        me = pair[0].encode('utf-8')
+        her = pair[1].encode('utf-8')
+        with self._lock:
+            self._file.write(me)
+            self._file.write(her)
+            self._offsets.append(self._offsets[-1] + len(me))
+            self._offsets.append(self._offsets[-1] + len(her))
+
+    def extend(self, pairs: Iterable[list]):
+        for pair in pairs:
+            self.append(pair)
+
+    def __iadd__(self, pairs: Iterable[list]) -> "PairTextStore":
+        self.extend(pairs)
+        return self
+
+    def __delitem__(self, index):
+        """Only the tail can go (del store[n:]), as undo does"""
+        if not isinstance(index, slice) or index.step not in (None, 1) or index.stop not in (None, len(self)):
+            raise TypeError("PairTextStore can only drop pairs from the end")
+
+        with self._lock:
+            start = index.indices(len(self))[0]
+            end = self._offsets[2 * start]
+
+            # The map has to go first; Windows will not shrink a mapped file
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._mapped = 0
+
+            self._file.flush()
+            self._file.truncate(end)
+            del self._offsets[2 * start + 1:]
+
+    def pop(self) -> list:
+        with self._lock:
+            pair = self[-1]
+            del self[len(self) - 1:]
+            return pair
+
+    def flush(self):
+        """Write the blob out and replace the offsets file in one step"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            temporary = self.offsets_path + ".tmp"
+            with open(temporary, 'wb') as outfile:
+                self._offsets.tofile(outfile)
+            os.replace(temporary, self.offsets_path)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+    def resident_bytes(self) -> int:
+        """What the store itself keeps in RAM: the offsets"""
+        return len(self._offsets) * self._offsets.itemsize
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open("/proc/self/statm") as openfile:
+            return int(openfile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _synthetic_pairs(pairs: int) -> Iterator[List[str]]:
+    import random
+
+    rng = random.Random(23)
+    words = ("so today we played the new game and honestly it was great chat loved it what do you think "
+             "about the boss fight I think we should try again tomorrow maybe with friends").split()
+    for _ in range(pairs):
+        yield [" ".join(rng.choices(words, k=rng.randint(4, 30))),
+               " ".join(rng.choices(words, k=rng.randint(10, 80)))]
+
+
+def _measure(kind: str, pairs: int, path: str, results):
+    import gc
+    import random
+
+    gc.collect()
+    before = rss_bytes()
+    if kind == "list":
+        history = [pair for pair in _synthetic_pairs(pairs)]
+    else:
+        history = PairTextStore.create(path, _synthetic_pairs(pairs))
+    gc.collect()
+    after = rss_bytes()
+
+    # Retrieval only ever reads a few windows
+    rng = random.Random(29)
+    centers = [rng.randrange(1, len(history) - 1) for _ in range(10000)]
+    start = time.perf_counter()
+    for center in centers:
+        history[center - 1:center + 2]
+    window_us = (time.perf_counter() - start) / len(centers) * 1e6
+
+    results.put((kind, after - before, window_us))
+
+
+def benchmark_text_store(pairs: int = 300000):
+    """RSS of the history held as Python strings vs the memory-mapped store, each in a fresh process"""
+    import multiprocessing
+    import tempfile
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history")
+        for kind in ("list", "store"):
+            process = context.Process(target=_measure, args=(kind, pairs, path, results))
+            process.start()
+            process.join()
+            kind, grown, window_us = results.get()
+            print(f"{kind:>5}: RSS +{grown / (1024 * 1024):.0f} MB for {pairs} pairs, "
+                  f"reading a 3-pair window {window_us:.1f} us")
+        blob_mb = os.path.getsize(path + ".bin") / (1024 * 1024)
+        index_mb = os.path.getsize(path + ".idx") / (1024 * 1024)
+        print(f"on disk: {blob_mb:.0f} MB text, {index_mb:.1f} MB offsets")
+
+
+if __name__ == "__main__":
+    benchmark_text_store()
@@ -0,0 +1,170 @@
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Punctuation dropped and newlines made spaces, in one pass
+REFINE_TABLE = str.maketrans("\n", " ", string.punctuation)
+
+# The RAG's word split: a word takes one trailing space with it, and any two
+# spaces after that (or a last lone one) count as an empty word, as the
+# original character loop did
+_WORD_PATTERN = re.compile(r"([^ ]+) ?|( )(?: |\Z)| ")
+
+
+def refine(text: str) -> str:
+    return text.translate(REFINE_TABLE).lower()
+
+
+def split_words(refined: str) -> Tuple[str, ...]:
+    if "  " in refined:
+        return tuple(match[0] for match in _WORD_PATTERN.findall(refined) if match[0] or match[1])
+
+    # Single spaces only (nearly always): a plain split, minus a leading or trailing space
+    if len(refined) < 2:
+        return ("",) if refined == " " else ((refined,) if refined else ())
+    parts = refined.split(" ")
+    return tuple(parts[refined[0] == " ":len(parts) - (refined[-1] == " ")])
+
+
+def tokenize(text: str) -> Tuple[str, ...]:
+    """RAG words for a message, uncached"""
+    return split_words(refine(text))
+
+
+def between_asterisks(text: str) -> str:
+    """The *emoted* parts of a message, run together (an unclosed one runs to the end)"""
+    return "".join(text.split("*")[1::2])
+
+
+@lru_cache(maxsize=1024)
+def lowered_keywords(keywords: Tuple[str, ...]) -> Tuple[str, ...]:
+    return tuple(keyword.lower() for keyword in keywords)
+
+
+class TokenCache:
+    """Words and lowercase text per message, so each utterance is processed once.
+
+    Keyed by the text itself; the string's hash is computed once and kept by
+    Python, and a real key cannot collide the way a bare hash could.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._words: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._lowered: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, cache: OrderedDict, text: str, make):
+        with self._lock:
+            value = cache.get(text)
+            if value is not None:
+                cache.move_to_end(text)
+                self.hits += 1
+                return value
+
+        value = make(text)
+        with self._lock:
+            self.misses += 1
+            cache[text] = value
+            while len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        return value
+
+    def words(self, text: str) -> Tuple[str, ...]:
+        return self._get(self._words, text, tokenize)
+
+    def lowered(self, text: str) -> str:
+        return self._get(self._lowered, text, str.lower)
+
+
+_cache = TokenCache()
+
+
+def words(text: str) -> Tuple[str, ...]:
+    return _cache.words(text)
+
+
+def words_bulk(texts: Iterable[str]) -> List[Tuple[str, ...]]:
+    """Tokenize many messages at once (log rebuilds), without flushing the per-turn cache"""
+    return [split_words(text.translate(REFINE_TABLE).lower()) for text in texts]
+
+
+def lowered(text: str) -> str:
+    return _cache.lowered(text)
+
+
+def contains_any(text: str, keywords: Tuple[str, ...]) -> bool:
+    """Case-insensitive substring check, lowering the text once per message and the keywords once ever"""
+    text = lowered(text)
+    return any(keyword in text for keyword in lowered_keywords(tuple(keywords)))
+
+
+def _legacy_words(message: str) -> List[str]:
+    # parse_words_to_database's split before this module, kept for the benchmark
+    refined_message = message.translate(str.maketrans('', '', string.punctuation))
+    refined_message = str.lower(refined_message)
+    refined_message = refined_message.replace("\n", " ")
+
+    found = []
+    i = 0
+    word_start_marker = 0
+    while i < len(refined_message):
+        if refined_message[i] == " ":
+            word_start_marker = i + 1
+        if i + 1 == len(refined_message) or refined_message[i + 1] == ' ':
+            found.append(refined_message[word_start_marker:i + 1])
+            word_start_marker = i + 2
+            i = i + 1
+        i = i + 1
+    return found
+
+
+def benchmark_tokenizer(messages: int = 5000, repeats: int = 3):
+    """Character loop vs compiled split, uncached, bulk and cached per turn"""
+    import random
+
+    rng = random.Random(9)
+    vocabulary = ("so today we played the new game and honestly it was great, chat loved it! "
+                  "what do you think about the boss fight?\nI think we should try again tomorrow...").split(" ")
+    texts = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 60))) for _ in range(messages)]
+    texts += ["odd  spacing   here    and\n\nthere ", "   ", "", "*waves* hi!"]
+
+    mismatches = sum(1 for text in texts if list(tokenize(text)) != _legacy_words(text))
+
+    def timed(run):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        return best / len(texts) * 1e6
+
+    legacy_us = timed(lambda: [_legacy_words(text) for text in texts])
+    compiled_us = timed(lambda: [tokenize(text) for text in texts])
+    bulk_us = timed(lambda: words_bulk(texts))
+
+    # Per turn, the same message is tokenized for RAG, lore and emotes
+    cache = TokenCache(max_entries=len(texts))
+    for text in texts:
+        cache.words(text)
+    cached_us = timed(lambda: [cache.words(text) for text in texts])
+
+    print(f"character loop:   {legacy_us:.1f} us per message")
+    print(f"compiled split:   {compiled_us:.1f} us per message")
+    print(f"bulk (log build): {bulk_us:.1f} us per message")
+    print(f"cached repeat:    {cached_us:.2f} us per message")
+    print(f"splits differing from the loop: {mismatches} of {len(texts)}")
+
+
+if __name__ == "__main__":
+    benchmark_tokenizer()
@@ -0,0 +1,293 @@
+import asyncio
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RECENT_TRACES = 50
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('z_waif_current_span', default=None)
+_ids = itertools.count(1)
+
+_INHERIT = object()
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'end', 'attrs', 'thread')
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = next(_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+class Trace:
+    """One turn: a root span and everything started under it, on any thread"""
+
+    def __init__(self, name: str):
+        self.trace_id = next(_ids)
+        self.name = name
+        self.started_at = time.time()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def root(self) -> Optional[Span]:
+        return self.spans[0] if self.spans else None
+
+    @property
+    def duration_ms(self) -> float:
+        """Root start to the last span's end, so speech after the turn returns still counts"""
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return 0.0
+        end = max(span.end if span.end is not None else time.perf_counter() for span in spans)
+        return (end - spans[0].start) * 1000
+
+    def flame_rows(self) -> List[dict]:
+        """Spans depth-first, with their offset from the start of the turn"""
+        with self._lock:
+            spans = list(self.spans)
+        if not spans:
+            return []
+
+        children: Dict[Optional[int], List[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        origin = spans[0].start
+        rows = []
+
+        def visit(span: Span, depth: int):
+            rows.append({
+                'name': span.name,
+                'depth': depth,
+                'offset_ms': (span.start - origin) * 1000,
+                'duration_ms': span.duration_ms,
+                'thread': span.thread,
+                'open': span.end is None,
+                'attrs': dict(span.attrs)
+            })
+            for child in sorted(children.get(span.span_id, []), key=lambda s: s.start):
+                visit(child, depth + 1)
+
+        visit(spans[0], 0)
+        return rows
+
+
+class _SpanScope:
+    """Context manager for one span; sets it as current for the block"""
+
+    __slots__ = ('tracer', 'trace', 'name', 'parent_id', 'attrs', 'span', 'token')
+
+    def __init__(self, tracer: "Tracer", trace: Trace, name: str, parent_id: Optional[int], attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = attrs
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.trace, self.name, self.parent_id, self.attrs)
+        self.trace.add(self.span)
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end = time.perf_counter()
+        if exc is not None:
+            self.span.attrs['error'] = repr(exc)
+        _current_span.reset(self.token)
+        self.tracer.version += 1
+        return False
+
+
+class _NoSpan:
+    """Outside a trace, spans cost one context variable lookup"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    """In-process tracer keeping the last few turns in a ring buffer"""
+
+    def __init__(self, capacity: int = RECENT_TRACES):
+        self.traces: Deque[Trace] = deque(maxlen=capacity)
+        self.version = 0
+
+    def trace(self, name: str, **attrs) -> _SpanScope:
+        """Start a new trace, even inside another one"""
+        trace = Trace(name)
+        self.traces.append(trace)
+        return _SpanScope(self, trace, name, None, attrs)
+
+    def span(self, name: str, parent=_INHERIT, **attrs):
+        """A child of the current span (or of parent); does nothing outside a trace"""
+        if parent is _INHERIT:
+            parent = _current_span.get()
+        if parent is None:
+            return _NO_SPAN
+        return _SpanScope(self, parent.trace, name, parent.span_id, attrs)
+
+    def recent(self) -> List[Trace]:
+        return list(reversed(self.traces))
+
+    def find(self, trace_id: int) -> Optional[Trace]:
+        for trace in self.traces:
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+
+tracer = Tracer()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def trace(name: str, **attrs):
+    return tracer.trace(name, **attrs)
+
+
+def span(name: str, parent=_INHERIT, **attrs):
+    return tracer.span(name, parent, **attrs)
+
+
+def traced(name: Optional[str] = None, new_trace: bool = False):
+    """Decorator: run the function in a span, or as the root of a new trace"""
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        def start():
+            return tracer.trace(span_name) if new_trace else tracer.span(span_name)
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not new_trace and _current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with start():
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not new_trace and _current_span.get() is None:
+                return func(*args, **kwargs)
+            with start():
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def bind(func: Callable) -> Callable:
+    """Carry the caller's trace context into a thread or executor.
+
+    asyncio tasks copy context on their own; threads and run_in_executor do not.
+    """
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def bound(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return bound
+
+
+def recent_traces() -> List[Trace]:
+    return tracer.recent()
+
+
+def find_trace(trace_id: int) -> Optional[Trace]:
+    return tracer.find(trace_id)
+
+
+def benchmark_tracing(calls: int = 200000):
+    """Per-call overhead of a span inside and outside a trace"""
+
+    def work():
+        return None
+
+    @traced("work")
+    def traced_work():
+        return None
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        work()
+    bare_ns = (time.perf_counter() - start) / calls * 1e9
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        traced_work()
+    idle_ns = (time.perf_counter() - start) / calls * 1e9
+
+    local = Tracer()
+    spans = 1000
+    with local.trace("turn"):
+        start = time.perf_counter()
+        for _ in range(spans):
+            with local.span("stage"):
+                work()
+        active_ns = (time.perf_counter() - start) / spans * 1e9
+
+    # Context crossing into a thread and back out of asyncio
+    def in_thread(results):
+        with local.span("thread.stage"):
+            results.append(current_span().trace.trace_id)
+
+    async def in_task(results):
+        await asyncio.sleep(0)
+        with local.span("task.stage"):
+            results.append(current_span().trace.trace_id)
+
+    results = []
+    with local.trace("cross") as root:
+        thread = threading.Thread(target=bind(in_thread), args=(results,))
+        thread.start()
+        thread.join()
+        asyncio.run(in_task(results))
+
+    print(f"bare call: {bare_ns:.0f} ns")
+    print(f"traced, no active trace: {idle_ns:.0f} ns")
+    print(f"span inside a trace: {active_ns:.0f} ns")
+    print(f"thread and task spans joined the turn: {results == [root.trace.trace_id] * 2}")
+    for row in local.recent()[0].flame_rows():
+        print(f"  {'  ' * row['depth']}{row['name']} on {row['thread']}")
+
+
+if __name__ == "__main__":
+    benchmark_tracing()
@@ -1,9 +1,10 @@
 import os
+import threading
 import whisper
 import torch
 from dotenv import load_dotenv
-from transformers import pipeline
 import logging
+from utils.model_registry import EMOTION, infer, get_model_registry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,21 +13,31 @@ load_dotenv()
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 USER_MODEL = os.environ.get("WHISPER_MODEL")
+WHISPER = "whisper"
 
-# Initialize emotion recognition model
-emotion_recognizer = pipeline("text-classification", model="bhadresh-savani/bert-base-uncased-emotion", device=0 if device == "cuda" else -1)
+# Whisper hangs its key/value cache hooks on the model while decoding, so two decodes at once corrupt each other
+_transcribe_lock = threading.Lock()
 
 def to_transcribe_original_language(voice):
     logging.info("Transcribing original language.")
-    model = whisper.load_model(USER_MODEL, device=device)
-    result = model.transcribe(voice, language="en", compression_ratio_threshold=1.9, no_speech_threshold=0.1)
+
+    # Loaded once and pinned, never unloaded when idle (rough transcripts while recording call this every few seconds)
+    registry = get_model_registry()
+    registry.register(WHISPER, lambda: whisper.load_model(USER_MODEL, device=device), pinned=True)
+    model = registry.acquire(WHISPER)
+    try:
+        # A rough transcript still running finishes first; the real one waits for it rather than sharing the model
+        with _transcribe_lock:
+            result = model.transcribe(voice, language="en", compression_ratio_threshold=1.9, no_speech_threshold=0.1)
+    finally:
+        registry.release(WHISPER)
     return " ".join([mem['text'] for mem in result["segments"]])
 
 def analyze_audio_emotion(voice):
     logging.info("Analyzing audio emotion.")
     """Transcribe audio and analyze emotion."""
     transcribed_text = to_transcribe_original_language(voice)
-    emotion = emotion_recognizer(transcribed_text)[0]['label']
+    emotion = infer(EMOTION, transcribed_text)[0]['label']
     return transcribed_text, emotion
 
 
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_FILE_NAME = "tts_index.json"
+COMMON_PHRASES_PATH = "Configurables/TTSPhrases.json"
+
+# Splits after sentence enders, keeping the punctuation with the sentence
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a reply into speakable sentence chunks"""
+    return [chunk.strip() for chunk in SENTENCE_SPLIT_PATTERN.split(text) if chunk and chunk.strip()]
+
+
+def content_key(text: str, voice: str, language: str, engine_name: str) -> str:
+    """Stable cache key; unlike hash(), this is the same across runs"""
+    payload = "\x1f".join([engine_name, voice, language, text])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class GTTSEngine:
+    """Google TTS, the default engine for Discord voice"""
+    name = "gtts"
+    extension = "mp3"
+
+    def synthesize(self, text: str, voice: str, language: str, out_path: Path):
+        from gtts import gTTS
+
+        tts = gTTS(text=text, lang=language, tld=voice or "com")
+        tts.save(str(out_path))
+
+
+class StubTTSEngine:
+    """Offline engine that writes deterministic bytes, for tests and benchmarks"""
+    name = "stub"
+    extension = "bin"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def synthesize(self, text: str, voice: str, language: str, out_path: Path):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        out_path.write_bytes(f"{voice}|{language}|{text}".encode('utf-8'))
+
+
+class TTSCache:
+    """Content-addressed TTS audio cache with an LRU byte cap and an on-disk index"""
+
+    def __init__(self, cache_dir: Path, engine=None, max_bytes: int = 64 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.engine = engine or GTTSEngine()
+        self.max_bytes = max_bytes
+        self.index_path = self.cache_dir / INDEX_FILE_NAME
+
+        # key -> {"file": name, "size": bytes}, ordered oldest use first
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._load_index()
+
+    def _load_index(self):
+        if not self.index_path.is_file():
+            return
+
+        try:
+            with open(self.index_path, 'r') as openfile:
+                stored = json.load(openfile)
+        except (OSError, ValueError) as e:
+            logging.error(f"TTS cache index unreadable, starting fresh: {e}")
+            return
+
+        for key, entry in stored:
+            # Skip anything that was deleted out from under us
+            if (self.cache_dir / entry['file']).is_file():
+                self.entries[key] = entry
+                self.total_bytes += entry['size']
+
+    def _save_index(self):
+        temp_path = self.index_path.with_suffix(".tmp")
+        with open(temp_path, 'w') as outfile:
+            json.dump(list(self.entries.items()), outfile)
+        os.replace(temp_path, self.index_path)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry['size']
+            try:
+                (self.cache_dir / entry['file']).unlink()
+            except OSError as e:
+                logging.error(f"Error evicting TTS file {entry['file']}: {e}")
+
+    def lookup(self, text: str, voice: str = "", language: str = "en") -> Optional[Path]:
+        key = content_key(text, voice, language, self.engine.name)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return self.cache_dir / entry['file']
+
+    def get(self, text: str, voice: str = "", language: str = "en") -> Path:
+        """Return the audio file for this text, synthesizing it only on a miss"""
+        key = content_key(text, voice, language, self.engine.name)
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.cache_dir / entry['file']
+
+        # Synthesize outside the lock, so other lookups are not held up; each writer gets its own temp file
+        file_name = f"{key}.{self.engine.extension}"
+        out_path = self.cache_dir / file_name
+        handle, temp_name = tempfile.mkstemp(prefix=f"{key}.", suffix=".partial", dir=self.cache_dir)
+        os.close(handle)
+        temp_path = Path(temp_name)
+        try:
+            self.engine.synthesize(text, voice, language, temp_path)
+            os.replace(temp_path, out_path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self.misses += 1
+            if key not in self.entries:
+                size = out_path.stat().st_size
+                self.entries[key] = {'file': file_name, 'size': size}
+                self.total_bytes += size
+                self._evict()
+                self._save_index()
+            return out_path
+
+    def iter_sentences(self, text: str, voice: str = "", language: str = "en") -> Iterator[Path]:
+        """Yield one audio file per sentence, so playback can begin on the first"""
+        for sentence in split_sentences(text):
+            yield self.get(sentence, voice, language)
+
+    def presynthesize(self, phrases: List[str], voice: str = "", language: str = "en") -> int:
+        """Warm the cache with known phrases; returns how many were newly made"""
+        made = 0
+        for phrase in phrases:
+            for sentence in split_sentences(phrase):
+                if self.lookup(sentence, voice, language) is None:
+                    try:
+                        self.get(sentence, voice, language)
+                        made += 1
+                    except Exception as e:
+                        logging.error(f"Error pre-synthesizing '{sentence}': {e}")
+        return made
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+def load_common_phrases(path: str = COMMON_PHRASES_PATH) -> List[str]:
+    """Fixed lines she speaks in voice, listed in the phrases file, to make ahead of time.
+
+    Only text that is actually played belongs here; replies are different
+    every time and are cached as they are spoken. No file means no phrases.
+    """
+    if not os.path.isfile(path):
+        return []
+
+    try:
+        with open(path, 'r') as openfile:
+            phrases = json.load(openfile)
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not load TTS phrases: {e}")
+        return []
+
+    return [phrase for phrase in phrases if isinstance(phrase, str) and phrase.strip()]
@@ -0,0 +1,328 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SAMPLE_TICK = 0.05
+SAMPLE_WORKERS = 4
+KEEPALIVE_SECONDS = 30.0
+
+_UNSET = object()
+
+# Yielded by a stream when nothing changed for a keepalive, so the caller gets
+# a chance to notice its client has gone and stop
+KEEPALIVE = object()
+
+
+class VersionedState:
+    """One UI panel's value, with a version that moves only when the value changes"""
+
+    def __init__(self, name: str, read: Callable[[], Any], interval: float = 1.0,
+                 render: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.read = read
+        self.interval = interval
+        self.render = render
+        self.version = 0
+        self.raw = _UNSET
+        self.value = None
+        self.next_sample = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        # Per panel, so a slow render (a model call) only holds up its own panel
+        with self._lock:
+            raw = self.read()
+            if raw == self.raw:
+                return False
+            value = self.render(raw) if self.render else raw
+            self.raw = raw
+            self.value = value
+            self.version += 1
+            return True
+
+
+class UIStateHub:
+    """Server-side change detection for the web UI.
+
+    Panels used to be polled by every browser tab. Here one sampler thread
+    schedules each panel at its interval (or it is re-read on notify()), and
+    each connected client's stream only yields when a panel's version has
+    moved. Sampled reads run on a small pool, so a slow render (the emotion
+    panel runs a model) does not hold up the other panels' sampling.
+    """
+
+    def __init__(self, tick: float = SAMPLE_TICK):
+        self.tick = tick
+        self.states: Dict[str, VersionedState] = {}
+        self.callbacks: Counter = Counter()
+        self._first_seen: Dict[str, float] = {}
+        self._changed = threading.Condition()
+        self._lock = threading.Lock()
+        self._async_waiters = set()
+        self._sampler = None
+        self._sample_pool = None
+        self._sampling: Dict[str, Future] = {}
+
+    def register(self, name: str, read: Callable[[], Any], interval: float = 1.0,
+                 render: Optional[Callable[[Any], Any]] = None) -> VersionedState:
+        """Add a panel; an interval of 0 means it only changes through notify()"""
+        state = VersionedState(name, read, interval, render)
+        self.states[name] = state
+        self._refresh(state)
+        self.start()
+        return state
+
+    def notify(self, name: str):
+        """Re-read a panel now, pushing it to clients if it changed"""
+        state = self.states.get(name)
+        if state is not None:
+            self._refresh(state)
+
+    def _refresh(self, state: VersionedState):
+        try:
+            changed = state.refresh()
+        except Exception as e:
+            logging.error(f"Could not refresh UI panel '{state.name}': {e}")
+            return
+        if changed:
+            with self._changed:
+                self._changed.notify_all()
+            self._wake_async()
+
+    def _wake_async(self):
+        with self._lock:
+            waiters = list(self._async_waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Its event loop has closed
+                with self._lock:
+                    self._async_waiters.discard((loop, event))
+
+    def start(self):
+        if self._sampler is None:
+            self._sample_pool = ThreadPoolExecutor(max_workers=SAMPLE_WORKERS, thread_name_prefix="ui-sample")
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            now = time.monotonic()
+            for state in list(self.states.values()):
+                if not state.interval or now < state.next_sample:
+                    continue
+
+                # A panel still rendering from its last sample is left to finish, not queued again
+                running = self._sampling.get(state.name)
+                if running is not None and not running.done():
+                    continue
+                state.next_sample = now + state.interval
+                self._sampling[state.name] = self._sample_pool.submit(self._refresh, state)
+            time.sleep(self.tick)
+
+    def stream(self, name: str, client: Optional[str] = None,
+               keepalive: float = KEEPALIVE_SECONDS) -> Iterator[Any]:
+        """Yield the panel's value now, then again each time it changes, and KEEPALIVE after a quiet keepalive"""
+        state = self.states[name]
+        version = None
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: state.version != version, timeout=keepalive)
+            if state.version == version:
+                yield KEEPALIVE
+                continue
+            version = state.version
+            self.record_callback(client)
+            yield state.value
+
+    async def stream_async(self, name: str, client: Optional[str] = None,
+                           keepalive: float = KEEPALIVE_SECONDS) -> AsyncIterator[Any]:
+        """As stream, but waiting on the event loop, so an open tab holds no worker thread"""
+        state = self.states[name]
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._async_waiters.add(waiter)
+
+        version = None
+        try:
+            while True:
+                if state.version == version:
+                    waiter[1].clear()
+                    # Checked again after the clear, in case it changed in between
+                    if state.version == version:
+                        try:
+                            await asyncio.wait_for(waiter[1].wait(), keepalive)
+                        except asyncio.TimeoutError:
+                            pass
+                    if state.version == version:
+                        yield KEEPALIVE
+                        continue
+                version = state.version
+                self.record_callback(client)
+                yield state.value
+        finally:
+            with self._lock:
+                self._async_waiters.discard(waiter)
+
+    def record_callback(self, client: Optional[str]):
+        client = client or "unknown"
+        with self._lock:
+            self._first_seen.setdefault(client, time.monotonic())
+            self.callbacks[client] += 1
+
+    def callback_rates(self) -> Dict[str, float]:
+        """Callbacks per second for each client since it connected"""
+        now = time.monotonic()
+        with self._lock:
+            return {client: count / max(now - self._first_seen[client], 1e-9)
+                    for client, count in self.callbacks.items()}
+
+
+hub = UIStateHub()
+
+
+def register(name: str, read: Callable[[], Any], interval: float = 1.0,
+             render: Optional[Callable[[Any], Any]] = None) -> VersionedState:
+    return hub.register(name, read, interval, render)
+
+
+def notify(name: str):
+    hub.notify(name)
+
+
+def stream(name: str, client: Optional[str] = None) -> Iterator[Any]:
+    return hub.stream(name, client)
+
+
+def stream_async(name: str, client: Optional[str] = None) -> AsyncIterator[Any]:
+    return hub.stream_async(name, client)
+
+
+def callback_rates() -> Dict[str, float]:
+    return hub.callback_rates()
+
+
+def benchmark_ui_callbacks(clients: int = 3, seconds: float = 3.0, reply_tokens: int = 60):
+    """Callbacks and chat bytes per client, fixed-interval polling vs pushed panels.
+
+    Stand-in traffic: a settings toggle every second and one streamed reply.
+    The polling intervals are the ones web_ui registered before this change.
+    """
+    settings = {'recording': False, 'autochat': False}
+    pair = ["How was the stream today? " * 2, "It went great, chat was lovely and we beat the boss! " * 4]
+    chat = {'history': [pair] * 30, 'sending': "", 'partial': ""}
+
+    def read_settings():
+        return settings['recording'], settings['autochat']
+
+    def read_chat():
+        rows = [list(pair) for pair in chat['history'][-30:]]
+        if chat['sending']:
+            rows = (rows + [[chat['sending'], chat['partial']]])[-30:]
+        return rows
+
+    def traffic(stop, on_change):
+        start = time.monotonic()
+        streamed = False
+        while not stop.is_set():
+            elapsed = time.monotonic() - start
+            settings['recording'] = int(elapsed) % 2 == 1
+            on_change('settings')
+            if not streamed and elapsed > seconds / 3:
+                chat['sending'] = "tell me a story"
+                for i in range(reply_tokens):
+                    chat['partial'] += f" word{i}"
+                    on_change('chat')
+                    time.sleep(0.02)
+                chat['history'] = chat['history'] + [[chat['sending'], chat['partial']]]
+                chat['sending'], chat['partial'] = "", ""
+                on_change('chat')
+                streamed = True
+            time.sleep(0.05)
+
+    def run_polling():
+        polls = [(read_settings, 0.05)] * 4 + [(read_chat, 1.0), (lambda: chat['sending'], 1.0)]
+        counts = Counter()
+        sent_bytes = Counter()
+        stop = threading.Event()
+
+        def client(client_id):
+            due = [0.0] * len(polls)
+            while not stop.is_set():
+                now = time.monotonic()
+                for i, (read, interval) in enumerate(polls):
+                    if now >= due[i]:
+                        due[i] = now + interval
+                        value = read()
+                        counts[client_id] += 1
+                        if read is read_chat:
+                            sent_bytes[client_id] += len(json.dumps(value))
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=client, args=(f"client{i}",)) for i in range(clients)]
+        threads.append(threading.Thread(target=traffic, args=(stop, lambda name: None)))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return counts, sent_bytes
+
+    def run_push():
+        test_hub = UIStateHub()
+        test_hub.register('settings', read_settings, interval=SAMPLE_TICK)
+        test_hub.register('chat', read_chat, interval=1.0)
+        sent_bytes = Counter()
+        stop = threading.Event()
+
+        def client(client_id):
+            shown = []
+            for value in test_hub.stream('chat', client_id, keepalive=0.1):
+                if value is KEEPALIVE:
+                    if stop.is_set():
+                        return
+                    continue
+                # The browser gets a diff; for a growing last message, that is the new text
+                if shown and len(value) == len(shown) and value[:-1] == shown[:-1]:
+                    sent_bytes[client_id] += len(value[-1][1]) - len(shown[-1][1])
+                else:
+                    sent_bytes[client_id] += len(json.dumps(value))
+                shown = value
+                if stop.is_set():
+                    return
+
+        def settings_client(client_id):
+            for _ in test_hub.stream('settings', client_id, keepalive=0.1):
+                if stop.is_set():
+                    return
+
+        threads = []
+        for i in range(clients):
+            threads.append(threading.Thread(target=client, args=(f"client{i}",), daemon=True))
+            threads.append(threading.Thread(target=settings_client, args=(f"client{i}",), daemon=True))
+        traffic_thread = threading.Thread(target=traffic, args=(stop, test_hub.notify))
+        for thread in threads + [traffic_thread]:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        traffic_thread.join()
+        return test_hub.callbacks, sent_bytes
+
+    for label, (counts, sent_bytes) in (("polling", run_polling()), ("push", run_push())):
+        per_client = sum(counts.values()) / clients / seconds
+        chat_bytes = sum(sent_bytes.values()) / clients
+        print(f"{label:>8}: {per_client:.1f} callbacks/s per client, {chat_bytes:,.0f} chat bytes per client")
+
+
+if __name__ == "__main__":
+    benchmark_ui_callbacks()
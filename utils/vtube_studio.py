@@ -1,6 +1,6 @@
 import time
 
-import utils.cane_lib
+import utils.tokenizer
 import asyncio,os,threading
 import pyvts
 import json
@@ -54,6 +54,10 @@ LOOK_LEVEL_ID = 1
 global look_start_id
 look_start_id = int(os.environ.get("EYES_START_ID", 0))
 
+# Lip-sync timing of the sentence currently being spoken
+SPEECH_SENTENCE = ""
+SPEECH_END_TIME = 0.0
+
 # Integration mode configuration
 USE_ADVANCED_INTEGRATION = ADVANCED_INTEGRATION_AVAILABLE and os.environ.get("USE_ADVANCED_VTUBE", "true").lower() == "true"
 MOTION_CAPTURE_ENABLED = os.environ.get("MOTION_CAPTURE_ENABLED", "true").lower() == "true"
@@ -240,6 +244,18 @@ async def handle_motion_capture_data(data):
         log_error(f"Error handling motion capture data: {e}")
 
 
+# Speech Timing
+
+def set_speech_timing(sentence, duration):
+    """Record when the current spoken sentence ends, for mouth movement"""
+    global SPEECH_SENTENCE, SPEECH_END_TIME
+    SPEECH_SENTENCE = sentence
+    SPEECH_END_TIME = time.time() + duration
+
+def is_speaking():
+    return time.time() < SPEECH_END_TIME
+
+
 # Emote System
 
 def set_emote_string(emote_string):
@@ -285,18 +301,11 @@ def check_emote_string():
     EMOTE_ID = -1
 
     # Cleanup the text to only look at the asterisk'ed words
-    clean_emote_text = ''
-    asterisk_count = 0
-
-    for char in EMOTE_STRING:
-        if char == "*":
-            asterisk_count += 1
-        elif asterisk_count % 2 == 1:
-            clean_emote_text = clean_emote_text + char
+    clean_emote_text = utils.tokenizer.between_asterisks(EMOTE_STRING)
 
     # Run through emotes, using OOP to only run one at a time (last = most prominent)
     for emote_page in emote_lib:
-        if utils.cane_lib.keyword_check(clean_emote_text, emote_page[0]):
+        if utils.tokenizer.contains_any(clean_emote_text, emote_page[0]):
             EMOTE_ID = emote_page[1]
 
     # If we got an emote, run it through the appropriate system
@@ -508,7 +517,9 @@ def get_vtube_status():
         'current_emote_id': EMOTE_ID,
         'current_emote_string': EMOTE_STRING,
         'current_look': CUR_LOOK,
-        'look_level_id': LOOK_LEVEL_ID
+        'look_level_id': LOOK_LEVEL_ID,
+        'speaking': is_speaking(),
+        'speech_sentence': SPEECH_SENTENCE
     }
     
     if USE_ADVANCED_INTEGRATION and _advanced_integration:
@@ -553,5 +564,6 @@ __all__ = [
     'set_emote_string',
     'check_emote_string',
     'change_look_level',
-    'analyze_voice_tone'
+    'analyze_voice_tone',
+    'set_speech_timing'
 ]
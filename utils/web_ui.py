@@ -1,5 +1,6 @@
 import random
 import logging
+import time
 from datetime import timedelta
 
 import gradio
@@ -9,6 +10,9 @@ import API.Oogabooga_Api_Support
 import utils.logging
 import utils.settings
 import utils.hotkeys
+import utils.ui_state
+import utils.metrics_store
+import utils.tracing
 import plotly.graph_objects as go
 from utils.performance_metrics import get_system_metrics
 from utils.personality_metrics import (
@@ -51,6 +55,18 @@ class VisualUI:
                         
         return interface
 
+def push_panel(name, outputs):
+    # Each tab gets the panel's value once, then again only when it changes. The stream waits on the event
+    # loop rather than holding a worker thread, and its keepalives go out as no-op updates, so a closed tab ends it
+    unchanged = gr.update() if len(outputs) == 1 else tuple(gr.update() for _ in outputs)
+
+    async def stream_panel(request: gr.Request):
+        async for value in utils.ui_state.stream_async(name, request.session_hash):
+            yield unchanged if value is utils.ui_state.KEEPALIVE else value
+
+    demo.load(stream_panel, outputs=outputs, concurrency_limit=None)
+
+
 based_theme = gr.themes.Base(
     primary_hue="fuchsia",
     secondary_hue="indigo",
@@ -80,16 +96,19 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
             chat_history.append((message, message_reply))
             return "", API.Oogabooga_Api_Support.ooga_history[-30:]
 
-        def update_chat():
+        def read_chat():
+            # Copy the pairs, so a message edited in place still counts as a change
+            chat_combine = [list(pair) for pair in API.Oogabooga_Api_Support.ooga_history[-30:]]
             if API.Oogabooga_Api_Support.currently_sending_message != "":
-                chat_combine = API.Oogabooga_Api_Support.ooga_history[-30:]
-                chat_combine.append([API.Oogabooga_Api_Support.currently_sending_message, ""])
-                return chat_combine[-30:]
-            else:
-                return API.Oogabooga_Api_Support.ooga_history[-30:]
+                chat_combine.append([API.Oogabooga_Api_Support.currently_sending_message,
+                                     API.Oogabooga_Api_Support.currently_streaming_reply])
+            return chat_combine[-30:]
+
+        # Pushed on each streamed token and history save; sampled each second as a fallback
+        utils.ui_state.register("chat", read_chat, interval=1)
 
         msg.submit(respond, [msg, chatbot], [msg, chatbot])
-        demo.load(update_chat, every=1, outputs=[chatbot])
+        push_panel("chat", [chatbot])
 
         #
         # Basic Mic Chat
@@ -175,8 +194,8 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
             return utils.hotkeys.get_speak_input(), utils.hotkeys.get_autochat_toggle()
 
 
-        demo.load(update_settings_view, every=0.05,
-                  outputs=[recording_checkbox_view, autochat_checkbox_view])
+        utils.ui_state.register("chat_toggles", update_settings_view, interval=0.05)
+        push_panel("chat_toggles", [recording_checkbox_view, autochat_checkbox_view])
 
     #
     # PERFORMANCE METRICS
@@ -228,6 +247,92 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
 
         demo.load(update_plot, every=10, outputs=[performance_plot])
 
+        # Response time percentiles, from the shared metrics store
+        latency_table = gr.Dataframe(
+            headers=["Function", "Calls", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Error Rate"],
+            label="Response Times (Last Hour)"
+        )
+
+        def read_latency():
+            return utils.metrics_store.get_metrics_store().summary(3600)
+
+        def render_latency(summary):
+            return [
+                [name, stats['count'], round(stats['p50'] * 1000, 1), round(stats['p95'] * 1000, 1),
+                 round(stats['p99'] * 1000, 1), f"{stats['error_rate'] * 100:.1f}%"]
+                for name, stats in sorted(summary.items())
+            ]
+
+        utils.ui_state.register("latency", read_latency, interval=5, render=render_latency)
+        push_panel("latency", [latency_table])
+
+        def export_metrics():
+            return utils.metrics_store.get_metrics_store().export(3600)
+
+        with gr.Row():
+            export_button = gr.Button(value="Export Metrics")
+            metrics_export = gr.JSON(label="Metrics Export")
+            export_button.click(fn=export_metrics, outputs=metrics_export, api_name="export_metrics")
+
+    #
+    # TURN TRACES
+    #
+
+    with gr.Tab("Turn Traces"):
+        trace_choice = gr.Dropdown(label="Recent Turns", choices=[], interactive=True)
+        trace_plot = gr.Plot(label="Where The Turn Went")
+        trace_table = gr.Dataframe(
+            headers=["Stage", "Thread", "Start (ms)", "Duration (ms)", "Share"],
+            label="Breakdown"
+        )
+
+        def trace_label(trace):
+            started = time.strftime("%H:%M:%S", time.localtime(trace.started_at))
+            return f"{started} {trace.name} ({trace.duration_ms:.0f} ms)"
+
+        def render_trace(trace):
+            rows = trace.flame_rows() if trace is not None else []
+            total = max(trace.duration_ms, 1e-9) if trace is not None else 1
+
+            fig = go.Figure(go.Bar(
+                y=list(range(len(rows))),
+                x=[row['duration_ms'] for row in rows],
+                base=[row['offset_ms'] for row in rows],
+                orientation='h',
+                text=[f"{row['duration_ms']:.0f} ms" for row in rows],
+                hovertext=[f"{row['name']} on {row['thread']}" for row in rows]
+            ))
+            fig.update_layout(
+                title=trace_label(trace) if trace is not None else "No turns traced yet",
+                xaxis_title='Time Into Turn (ms)',
+                yaxis=dict(autorange='reversed', tickmode='array', tickvals=list(range(len(rows))),
+                           ticktext=["\u2003" * row['depth'] + row['name'] for row in rows])
+            )
+
+            table = [
+                ["  " * row['depth'] + row['name'] + (" (running)" if row['open'] else ""), row['thread'],
+                 round(row['offset_ms'], 1), round(row['duration_ms'], 1),
+                 f"{row['duration_ms'] / total * 100:.0f}%"]
+                for row in rows
+            ]
+            return fig, table
+
+        def render_recent_traces(version):
+            # Follows the newest turn; picking one from the list holds it until the next span lands
+            traces = utils.tracing.recent_traces()
+            choices = [(trace_label(trace), trace.trace_id) for trace in traces]
+            fig, table = render_trace(traces[0] if traces else None)
+            return gr.update(choices=choices), fig, table
+
+        def show_trace(trace_id):
+            if trace_id is None:
+                return gr.update(), gr.update()
+            return render_trace(utils.tracing.find_trace(trace_id))
+
+        utils.ui_state.register("traces", lambda: utils.tracing.tracer.version, interval=1, render=render_recent_traces)
+        push_panel("traces", [trace_choice, trace_plot, trace_table])
+        trace_choice.change(fn=show_trace, inputs=trace_choice, outputs=[trace_plot, trace_table])
+
     #
     # EMOTION METRICS
     #
@@ -237,18 +342,19 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
             current_emotion = gr.Label("Current Emotion: Neutral")
             emotion_intensity = gr.Label("Intensity: 0%")
 
-        def update_emotion_metrics():
-            if API.Oogabooga_Api_Support.currently_sending_message:
-                emotion, intensity = API.Oogabooga_Api_Support.analyze_emotion(
-                    API.Oogabooga_Api_Support.currently_sending_message
-                )
+        def update_emotion_metrics(sending_message):
+            if sending_message:
+                emotion, intensity = API.Oogabooga_Api_Support.analyze_emotion(sending_message)
                 return (
                     f"Current Emotion: {emotion.title()}",
                     f"Intensity: {intensity*100:.1f}%"
                 )
             return "Current Emotion: Neutral", "Intensity: 0%"
 
-        demo.load(update_emotion_metrics, every=1, outputs=[current_emotion, emotion_intensity])
+        # Analyzed once per new message, not once per tab per second
+        utils.ui_state.register("emotion", lambda: API.Oogabooga_Api_Support.currently_sending_message,
+                                interval=1, render=update_emotion_metrics)
+        push_panel("emotion", [current_emotion, emotion_intensity])
 
         # Emotion Graph
         emotion_plot = gr.Plot(label="Emotion Analysis")
@@ -382,8 +488,8 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
                 return utils.settings.cam_use_image_feed, utils.settings.cam_direct_talk, utils.settings.cam_reply_after, utils.settings.cam_image_preview
 
 
-            demo.load(update_visual_view, every=0.05,
-                      outputs=[cam_use_image_feed_checkbox_view, cam_direct_talk_checkbox_view, cam_reply_after_checkbox_view, cam_image_preview_checkbox_view])
+            utils.ui_state.register("visual", update_visual_view, interval=0.05)
+            push_panel("visual", [cam_use_image_feed_checkbox_view, cam_direct_talk_checkbox_view, cam_reply_after_checkbox_view, cam_image_preview_checkbox_view])
 
     #
     # SETTINGS
@@ -534,7 +640,8 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
             return utils.settings.hotkeys_locked, utils.settings.speak_shadowchats, utils.settings.newline_cut
 
 
-        demo.load(update_settings_view, every=0.05, outputs=[hotkey_checkbox_view, shadowchats_checkbox_view, newline_cut_checkbox_view])
+        utils.ui_state.register("settings", update_settings_view, interval=0.05)
+        push_panel("settings", [hotkey_checkbox_view, shadowchats_checkbox_view, newline_cut_checkbox_view])
 
     #
     # PERSONALITY ADJUSTMENTS
@@ -762,14 +869,19 @@ with gr.Blocks(theme=based_theme, title="Z-Waif UI") as demo:
     #
 
     with gr.Tab("Debug / Log"):
-        debug_log = gr.Textbox(utils.logging.debug_log, lines=10, label="General Debug", autoscroll=True)
-        rag_log = gr.Textbox(utils.logging.rag_log, lines=10, label="RAG Debug", autoscroll=True)
+        debug_log = gr.Textbox(utils.logging.debug_log.text(), lines=10, label="General Debug", autoscroll=True)
+        rag_log = gr.Textbox(utils.logging.rag_log.text(), lines=10, label="RAG Debug", autoscroll=True)
         kelvin_log = gr.Textbox(utils.logging.kelvin_log, lines=1, label="Random Temperature Readout")
 
-        def update_logs():
-            return utils.logging.debug_log, utils.logging.rag_log, utils.logging.kelvin_log
+        # Change is spotted by the logs' versions; the text is only joined when one moved
+        def log_versions():
+            return utils.logging.debug_log.version, utils.logging.rag_log.version, utils.logging.kelvin_log
+
+        def update_logs(_):
+            return utils.logging.debug_log.text(), utils.logging.rag_log.text(), utils.logging.kelvin_log
 
-        demo.load(update_logs, every=0.05, outputs=[debug_log, rag_log, kelvin_log])
+        utils.ui_state.register("logs", log_versions, interval=0.05, render=update_logs)
+        push_panel("logs", [debug_log, rag_log, kelvin_log])
 
 
 
@@ -4,11 +4,13 @@ import discord
 from discord.ext import commands
 import main
 import API.Oogabooga_Api_Support
-from discord import FFmpegPCMAudio
+import utils.tracing
+import utils.rag_namespaces
 from discord.ext import commands
 from utils import settings
 from .discord_voice_handler import DiscordVoiceHandler
-import yt_dlp
+from .discord_response_bridge import DiscordResponseBridge
+from .discord_playlist import PlaylistEngine
 import requests  # Make sure to import requests or any other library you use for API calls
 import logging
 from utils.logging import log_info, log_error
@@ -23,14 +25,21 @@ class DiscordClient(commands.Bot):
         intents.message_content = True
         super().__init__(command_prefix='/', intents=intents)
         self.voice_handler = DiscordVoiceHandler(self)
+        self.playlist_engine = PlaylistEngine(
+            self.voice_handler.stream_resolver,
+            prefetch_count=settings.DISCORD_PREFETCH_TRACKS
+        )
+        self.response_bridge = DiscordResponseBridge(
+            generate_blocking_response,
+            per_guild=settings.DISCORD_MAX_PENDING_PER_GUILD,
+            per_channel=settings.DISCORD_MAX_PENDING_PER_CHANNEL,
+            edit_interval=settings.DISCORD_STREAM_EDIT_INTERVAL
+        )
         log_info("Discord Client initialized.")
         
     async def setup_hook(self):
         print("Setting up command tree...")
         
-        # Initialize a dictionary to hold playlists for each guild
-        playlists = {}
-
         @self.tree.command(name="play", description="Play audio from URL or add to playlist")
         async def play(interaction: discord.Interaction, url: str):
             print(f"Play command received for URL: {url}")
@@ -49,22 +58,20 @@ class DiscordClient(commands.Bot):
             voice_channel = voice_state.channel
             print(f"User is in voice channel: {voice_channel.name}")
 
-            # Initialize the playlist for the guild if it doesn't exist
-            if guild_id not in playlists:
-                playlists[guild_id] = []
+            # Add the URL to the playlist, this also starts resolving it in the background
+            self.playlist_engine.enqueue(guild_id, url)
 
-            # Add the URL to the playlist
-            playlists[guild_id].append(url)
+            # Claim the start before any await, so a /play landing meanwhile only queues
+            should_start = self.playlist_engine.claim_start(guild_id)
             await interaction.response.send_message(f"🎵 Added to playlist: {url}")
 
             # If the bot is not already playing, start playing the playlist
-            if len(playlists[guild_id]) == 1:  # Only start if this is the first item
+            if should_start:
                 try:
                     # Connect to the voice channel
                     if guild_id in self.voice_handler.voice_clients:
                         print("Already connected, disconnecting...")
-                        await self.voice_handler.voice_clients[guild_id].disconnect()
-                        del self.voice_handler.voice_clients[guild_id]
+                        await self.voice_handler.voice_clients.pop(guild_id).disconnect()
 
                     print("Connecting to voice channel...")
                     voice_client = await voice_channel.connect()
@@ -76,36 +83,54 @@ class DiscordClient(commands.Bot):
                     
                 except Exception as e:
                     print(f"Error during playback: {e}")
+                    self.playlist_engine.clear(guild_id)
                     await channel.send(f"❌ Error: {str(e)}")
 
+        def is_current(guild_id, voice_client):
+            # A stopped or replaced session's client is no longer the registered one
+            return self.voice_handler.voice_clients.get(guild_id) is voice_client and voice_client.is_connected()
+
+        async def end_session(guild_id, voice_client):
+            # Unregister before the await, so a second caller (or the after callback) finds nothing to end
+            if self.voice_handler.voice_clients.get(guild_id) is voice_client:
+                del self.voice_handler.voice_clients[guild_id]
+                await voice_client.disconnect()
+
         async def play_next(guild_id, voice_client, channel):
             """Play the next audio in the playlist."""
-            if guild_id in playlists and playlists[guild_id]:
-                url = playlists[guild_id][0]  # Get the first URL in the playlist
+            # The after callback fires on /stop too; a session that has ended must not take the next track
+            if not is_current(guild_id, voice_client):
+                return
+
+            url = self.playlist_engine.advance(guild_id)
+            if url is not None:
                 print(f"Playing next URL: {url}")
                 
                 try:
+                    # Usually already resolved while the previous track played
+                    stream_url = await self.playlist_engine.stream_url(url)
+                    if not is_current(guild_id, voice_client):
+                        return
+
+                    # Start the audio first; the announcement is a round trip to Discord
+                    loop = asyncio.get_running_loop()
+                    self.voice_handler.play_stream(
+                        stream_url, voice_client,
+                        after_callback=lambda e: asyncio.run_coroutine_threadsafe(play_next(guild_id, voice_client, channel), loop)
+                    )
                     await channel.send(f"🎵 Now playing: {url}")
-                    # Pass the callback to play_audio
-                    await self.voice_handler.play_audio(url, voice_client, after_callback=lambda e: asyncio.create_task(play_next(guild_id, voice_client, channel)))
-                    
-                    # Remove the played URL from the playlist
-                    playlists[guild_id].pop(0)
-                    print(f"Removed played URL. Remaining playlist: {playlists[guild_id]}")
+                    print(f"Resolver stats: {self.playlist_engine.metrics()}")
 
                 except Exception as e:
                     print(f"Error playing next URL: {e}")
                     await channel.send(f"❌ Error: {str(e)}")
                     # Cleanup on error
-                    if guild_id in self.voice_handler.voice_clients:
-                        await voice_client.disconnect()
-                        del self.voice_handler.voice_clients[guild_id]
+                    self.playlist_engine.clear(guild_id)
+                    await end_session(guild_id, voice_client)
             else:
                 print("No more URLs in the playlist.")
                 await channel.send("✅ Playlist finished.")
-                if guild_id in self.voice_handler.voice_clients:
-                    await voice_client.disconnect()
-                    del self.voice_handler.voice_clients[guild_id]
+                await end_session(guild_id, voice_client)
                 # Allow the bot to respond to new commands
                 await channel.send("🤖 I'm back and ready for your commands!")
 
@@ -117,20 +142,19 @@ class DiscordClient(commands.Bot):
             
             try:
                 await interaction.response.send_message("⏹️ Stopping playback...")
+
+                # Clear the playlist first, so stopping does not hand off to the next track
+                self.playlist_engine.clear(guild_id)
+                print("Cleared the playlist.")
                 
-                if guild_id in self.voice_handler.voice_clients:
-                    voice_client = self.voice_handler.voice_clients[guild_id]
+                # Unregistered before stopping, so the track's after callback sees the session has ended
+                voice_client = self.voice_handler.voice_clients.pop(guild_id, None)
+                if voice_client is not None:
                     if voice_client.is_playing():
                         voice_client.stop()
                     await voice_client.disconnect()
-                    del self.voice_handler.voice_clients[guild_id]
                     await channel.send("✅ Stopped and disconnected")
                 
-                # Clear the playlist
-                if guild_id in playlists:
-                    playlists[guild_id].clear()
-                    print("Cleared the playlist.")
-                
                 await channel.send("🤖 I'm back and ready for your commands!")
                 
             except Exception as e:
@@ -187,71 +211,12 @@ class DiscordClient(commands.Bot):
         print(f'Logged in as {self.user} (ID: {self.user.id})')
         print('------')
 
+        # Common lines get made once, up front, so they play instantly later
+        asyncio.create_task(self.voice_handler.presynthesize_common_phrases())
+
     async def play_audio(self, url, voice_client):
         """Play audio from URL"""
-        try:
-            print(f"Starting play_audio for URL: {url}")
-            
-            # Check if it's a YouTube URL
-            if 'youtube.com' in url or 'youtu.be' in url:
-                print("YouTube URL detected")
-                
-                # YouTube DL options
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'quiet': False,
-                    'no_warnings': False,
-                    'extract_audio': True,
-                    'force_generic_extractor': False
-                }
-                
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        print("Extracting video info...")
-                        info = await asyncio.get_event_loop().run_in_executor(
-                            None, lambda: ydl.extract_info(url, download=False)
-                        )
-                        print("Info extracted successfully")
-                        
-                        if 'formats' in info:
-                            print("Selecting best audio format...")
-                            formats = [f for f in info['formats'] 
-                                     if f.get('acodec') != 'none']
-                            if not formats:
-                                formats = info['formats']
-                            
-                            stream_url = formats[0]['url']
-                            print(f"Audio stream URL selected: {stream_url}")
-                        else:
-                            stream_url = info['url']
-                            print("Using direct URL")
-                        
-                        print("Setting up FFmpeg options...")
-                        ffmpeg_options = {
-                            'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-                            'options': '-vn'
-                        }
-                        
-                        print("Creating audio source...")
-                        audio_source = FFmpegPCMAudio(stream_url, **ffmpeg_options)
-                        
-                        print("Starting playback...")
-                        voice_client.play(audio_source)
-                        print("Playback started successfully")
-                        
-                except Exception as e:
-                    print(f"Error in YouTube processing: {e}")
-                    raise
-                
-            else:
-                print("Non-YouTube URL detected")
-                audio_source = FFmpegPCMAudio(url)
-                voice_client.play(audio_source)
-                print("Direct URL playback started")
-                
-        except Exception as e:
-            print(f"Error in play_audio: {e}")
-            raise
+        await self.voice_handler.play_audio(url, voice_client)
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -260,18 +225,18 @@ class DiscordClient(commands.Bot):
             if message.author == self.user:
                 return  # Ignore messages from the bot itself
 
-            # Process the message and generate a response
-            response = await self.generate_response(message.content)
-            await message.channel.send(response)
+            # Generate off the event loop, so the gateway, /play and /tts keep running
+            namespace = utils.rag_namespaces.namespace_for("discord", message.channel.id, message.author.id)
+            with utils.tracing.trace("discord_turn", channel=str(message.channel.id)), utils.rag_namespaces.audience(namespace):
+                await self.response_bridge.respond(message.channel, message.content, guild_id=message.guild.id if message.guild else None)
         except Exception as e:
             log_error(f"Error processing message: {e}")
 
     async def generate_response(self, content):
         """Send the content to the Oogabooga API and return the response."""
         try:
-            # Use the Oogabooga API to get a response
-            API.Oogabooga_Api_Support.send_via_oogabooga(content)  # Send the user input to Oogabooga
-            response = API.Oogabooga_Api_Support.receive_via_oogabooga()  # Get the response from Oogabooga
+            # Through the bridge's one worker, as the API keeps its history in globals
+            response = await self.response_bridge.reply_text(content)
 
             if response:
                 return response
@@ -282,6 +247,16 @@ class DiscordClient(commands.Bot):
             print(f"Error generating response: {e}")
             return "Sorry, I couldn't process that."
 
+
+def generate_blocking_response(content, on_partial=None):
+    """Blocking generation; only ever call this from a worker thread"""
+    try:
+        API.Oogabooga_Api_Support.send_via_oogabooga(content, on_partial)  # Send the user input to Oogabooga
+        return API.Oogabooga_Api_Support.receive_via_oogabooga()  # Get the response from Oogabooga
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        return None
+
 def run_z_waif_discord():
     log_info("Starting Discord bot...")
     DISCORD_TOKEN = os.environ.get("DISCORD_TOKEN")